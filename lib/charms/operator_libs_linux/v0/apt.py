@@ -22,8 +22,8 @@ A sane default configuration is attainable through nothing more than instantiati
 appropriate classes. `DebianPackage` objects provide information about the architecture, version,
 name, and status of a package.
 
-`DebianPackage` will try to look up a package either from `dpkg -L` or from `apt-cache` when
-provided with a string indicating the package name. If it cannot be located, `PackageNotFoundError`
+`DebianPackage` will try to look up a package either from the dpkg status database or from
+`apt-cache` when provided with a string indicating the package name. If it cannot be located, `PackageNotFoundError`
 will be returned, as `apt` and `dpkg` otherwise return `100` for all errors, and a meaningful error
 message if the package is not known is desirable.
 
@@ -102,16 +102,23 @@ if "deb-us.archive.ubuntu.com-xenial" not in repositories:
 ```
 """
 
+import base64
+import bz2
 import fileinput
 import glob
+import gzip
+import hashlib
+import json
 import logging
+import lzma
 import os
 import re
 import subprocess
+import time
 from collections.abc import Mapping
 from enum import Enum
 from subprocess import PIPE, CalledProcessError, check_call, check_output
-from typing import Iterable, List, Optional, Tuple, Union
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
 from urllib.parse import urlparse
 
 logger = logging.getLogger(__name__)
@@ -124,12 +131,97 @@ LIBAPI = 0
 
 # Increment this PATCH version before using `charmcraft publish-lib` or reset
 # to 0 if you are raising the major API version
-LIBPATCH = 7
+LIBPATCH = 8
+
+# This copy is forked from LIBPATCH 7 of the published library: the charm relies on
+# additions that are not published yet, so it must not be refreshed with
+# `charmcraft fetch-lib`, which would silently drop them, until they are upstreamed.
+# The additions are:
+#
+# - `update(max_age)`, `update_source()` and `get_cache_age()`, to skip or narrow
+#   `apt-get update`
+# - `PackageSnapshot` and `SnapshotDiff`, to report what an upgrade changed
+# - `Version.from_string()`, `max_version()`, `sort_versions()` and `compare_many()`
+# - `add_command_observer()`, to time the commands the library runs
+# - `DebianRepository.read_armored_key()`, and native key dearmoring, so that keys
+#   can be read without gpg and written by the caller
+# - `DebianPackage.from_installed_packages()` and `get_system_architecture()`, with
+#   package lookups served from indexes of the dpkg status file and apt lists
+#   instead of `dpkg` and `apt-cache` processes
 
 
 VALID_SOURCE_TYPES = ("deb", "deb-src")
 OPTIONS_MATCHER = re.compile(r"\[.*?\]")
 
+DPKG_STATUS_FILE = "/var/lib/dpkg/status"
+DPKG_UPDATES_DIR = "/var/lib/dpkg/updates"
+
+APT_LISTS_DIR = "/var/lib/apt/lists"
+APT_LISTS_INDEX_FILE = "/var/cache/apt/operator-libs-linux-lists-index.json"
+APT_PREFERENCES = ("/etc/apt/preferences", "/etc/apt/preferences.d")
+APT_PKGCACHE_FILE = "/var/cache/apt/pkgcache.bin"
+APT_SOURCES = ("/etc/apt/sources.list", "/etc/apt/sources.list.d")
+
+# Index targets that `apt-get update` fetches by default but that package management
+# never reads: translations, Contents for `apt-file`, AppStream metadata for software
+# centres and command-not-found databases. Only single sources are refreshed this way:
+# a full refresh would either delete the host's copies of these, or keep the lists of
+# removed sources around, which would then be read as package candidates.
+APT_LEAN_UPDATE_OPTIONS = [
+    "-o",
+    "Acquire::Languages=none",
+    *(
+        option
+        for target in (
+            "Contents-deb",
+            "Contents-udeb",
+            "Contents-deb-legacy",
+            "DEP-11",
+            "DEP-11-icons",
+            "DEP-11-icons-small",
+            "DEP-11-icons-hidpi",
+            "CNF",
+        )
+        for option in ("-o", "Acquire::IndexTargets::deb::{}::DefaultEnabled=false".format(target))
+    ),
+]
+
+
+_command_observers = []
+
+
+def add_command_observer(observer) -> None:
+    """Calls `observer(command, seconds, **details)` after each command this library runs.
+
+    `details` holds the command's `returncode`, when known, and the `output_bytes` it
+    returned, if any. Observers must not raise; they are meant for timing and counting
+    commands.
+    """
+    _command_observers.append(observer)
+
+
+def _observed(run, command: List[str], *args, **kwargs):
+    """Runs `command` with `run`, e.g. `check_call`, and notifies command observers."""
+    start = time.monotonic()
+    details = {"returncode": None}
+    try:
+        result = run(command, *args, **kwargs)
+    except CalledProcessError as e:
+        details["returncode"] = e.returncode
+        raise
+    else:
+        if isinstance(result, (str, bytes)):
+            details["returncode"] = 0
+            details["output_bytes"] = len(result)
+        elif isinstance(result, int):
+            details["returncode"] = result
+        elif hasattr(result, "returncode"):
+            details["returncode"] = result.returncode
+        return result
+    finally:
+        for observer in _command_observers:
+            observer(command, time.monotonic() - start, **details)
+
 
 class Error(Exception):
     """Base class of most errors raised by this library."""
@@ -250,7 +342,7 @@ class DebianPackage:
             package_names = [package_names]
         _cmd = ["apt-get", "-y", *optargs, command, *package_names]
         try:
-            check_call(_cmd, stderr=PIPE, stdout=PIPE)
+            _observed(check_call, _cmd, stderr=PIPE, stdout=PIPE)
         except CalledProcessError as e:
             raise PackageError(
                 "Could not {} package(s) [{}]: {}".format(command, [*package_names], e.output)
@@ -392,87 +484,109 @@ class DebianPackage:
             arch: an optional architecture, defaulting to `dpkg --print-architecture`.
                 If an architecture is not specified, this will be used for selection.
         """
-        system_arch = check_output(
-            ["dpkg", "--print-architecture"], universal_newlines=True
-        ).strip()
-        arch = arch if arch else system_arch
-
-        # Regexps are a really terrible way to do this. Thanks dpkg
-        output = ""
-        try:
-            output = check_output(["dpkg", "-l", package], stderr=PIPE, universal_newlines=True)
-        except CalledProcessError:
-            raise PackageNotFoundError("Package is not installed: {}".format(package)) from None
-
-        # Pop off the output from `dpkg -l' because there's no flag to
-        # omit it`
-        lines = str(output).splitlines()[5:]
-
-        dpkg_matcher = re.compile(
-            r"""
-        ^(?P<package_status>\w+?)\s+
-        (?P<package_name>.*?)(?P<throwaway_arch>:\w+?)?\s+
-        (?P<version>.*?)\s+
-        (?P<arch>\w+?)\s+
-        (?P<description>.*)
-        """,
-            re.VERBOSE,
-        )
-
-        for line in lines:
-            try:
-                matches = dpkg_matcher.search(line).groupdict()
-                package_status = matches["package_status"]
-
-                if not package_status.endswith("i"):
-                    logger.debug(
-                        "package '%s' in dpkg output but not installed, status: '%s'",
-                        package,
-                        package_status,
-                    )
-                    break
-
-                epoch, split_version = DebianPackage._get_epoch_from_version(matches["version"])
-                pkg = DebianPackage(
-                    matches["package_name"],
-                    split_version,
-                    epoch,
-                    matches["arch"],
-                    PackageState.Present,
+        if ":" in package:
+            package, _, package_arch = package.partition(":")
+            arch = arch or package_arch
+        arch = arch if arch else get_system_architecture()
+
+        index = _get_dpkg_status_index()
+        entries = index.get(package, []) if index is not None else _query_dpkg(package)
+
+        for status, full_version, package_arch in entries:
+            if not status.endswith(" installed"):
+                logger.debug(
+                    "package '%s' in dpkg status but not installed, status: '%s'",
+                    package,
+                    status,
                 )
-                if (pkg.arch == "all" or pkg.arch == arch) and (
-                    version == "" or str(pkg.version) == version
-                ):
-                    return pkg
-            except AttributeError:
-                logger.warning("dpkg matcher could not parse line: %s", line)
+                continue
+
+            epoch, split_version = DebianPackage._get_epoch_from_version(full_version)
+            pkg = DebianPackage(package, split_version, epoch, package_arch, PackageState.Present)
+            if (pkg.arch == "all" or pkg.arch == arch) and (
+                version == "" or str(pkg.version) == version
+            ):
+                return pkg
 
         # If we didn't find it, fail through
         raise PackageNotFoundError("Package {}.{} is not installed!".format(package, arch))
 
+    @classmethod
+    def from_installed_packages(
+        cls, packages: Iterable[str], arch: Optional[str] = ""
+    ) -> Dict[str, "DebianPackage"]:
+        """Look up several installed packages at once.
+
+        Args:
+            packages: the names of the packages
+            arch: an optional architecture, defaulting to `dpkg --print-architecture`.
+
+        Returns:
+            A dict of `DebianPackage` instances by name, without the packages which are
+            not installed.
+        """
+        installed = {}
+        for package in packages:
+            try:
+                installed[package] = cls.from_installed_package(package, arch=arch)
+            except PackageNotFoundError:
+                continue
+        return installed
+
     @classmethod
     def from_apt_cache(
         cls, package: str, version: Optional[str] = "", arch: Optional[str] = ""
     ) -> "DebianPackage":
         """Check whether the package is already installed and return an instance.
 
+        The candidate is chosen like apt does: the highest version among the
+        repositories with the highest priority, honouring `NotAutomatic` releases
+        and, when there are any, the pins from `apt_preferences`.
+
         Args:
             package: a string representing the package
             version: an optional string if a specific version isr equested
             arch: an optional architecture, defaulting to `dpkg --print-architecture`.
                 If an architecture is not specified, this will be used for selection.
         """
-        system_arch = check_output(
-            ["dpkg", "--print-architecture"], universal_newlines=True
-        ).strip()
-        arch = arch if arch else system_arch
+        arch = arch if arch else get_system_architecture()
 
-        # Regexps are a really terrible way to do this. Thanks dpkg
-        keys = ("Package", "Architecture", "Version")
+        index = _get_apt_lists_index()
+        if index is None:
+            return cls._from_apt_cache_show(package, version, arch)
+
+        if not version and _has_apt_preferences():
+            version = _get_pinned_candidate(package)
+
+        candidates = []
+        for filename, entry in index.items():
+            for offset in entry["packages"].get(package, []):
+                vals = _read_list_stanza(filename, offset)
+                epoch, split_version = DebianPackage._get_epoch_from_version(vals["Version"])
+                pkg = DebianPackage(
+                    vals["Package"],
+                    split_version,
+                    epoch,
+                    vals["Architecture"],
+                    PackageState.Available,
+                )
+                if (pkg.arch == "all" or pkg.arch == arch) and (
+                    version == "" or str(pkg.version) == version
+                ):
+                    candidates.append((entry["priority"], pkg.version, pkg))
+
+        if candidates:
+            return max(candidates, key=lambda candidate: candidate[:2])[2]
 
+        # If we didn't find it, fail through
+        raise PackageNotFoundError("Package {}.{} is not in the apt cache!".format(package, arch))
+
+    @classmethod
+    def _from_apt_cache_show(cls, package: str, version: str, arch: str) -> "DebianPackage":
+        """Look up a package with `apt-cache show`, when the lists can't be read directly."""
         try:
-            output = check_output(
-                ["apt-cache", "show", package], stderr=PIPE, universal_newlines=True
+            output = _observed(
+                check_output, ["apt-cache", "show", package], stderr=PIPE, universal_newlines=True
             )
         except CalledProcessError as e:
             raise PackageError(
@@ -510,6 +624,452 @@ class DebianPackage:
         raise PackageNotFoundError("Package {}.{} is not in the apt cache!".format(package, arch))
 
 
+_dpkg_status_cache = {"stamp": None, "index": {}}
+
+
+def _parse_dpkg_status(filename: str) -> Dict[str, List[Tuple[str, str, str]]]:
+    """Stream the dpkg status database into an index.
+
+    Only the fields needed to identify installed packages are kept; descriptions and
+    other multi-line fields are skipped without being decoded.
+
+    Returns:
+        A dict of `(status, version, architecture)` tuples by package name, with one
+        tuple per architecture the package is known for.
+    """
+    index = {}
+    fields = {}
+    wanted = (b"Package", b"Status", b"Version", b"Architecture")
+
+    def add_stanza():
+        if b"Package" in fields:
+            index.setdefault(fields[b"Package"].decode(), []).append(
+                (
+                    fields.get(b"Status", b"").decode(),
+                    fields.get(b"Version", b"").decode(),
+                    fields.get(b"Architecture", b"").decode(),
+                )
+            )
+        fields.clear()
+
+    with open(filename, "rb") as status_file:
+        for line in status_file:
+            if line[:1] in (b" ", b"\t"):
+                continue
+            if not line.strip():
+                add_stanza()
+                continue
+            key, _, value = line.partition(b":")
+            if key in wanted:
+                fields[key] = value.strip()
+    add_stanza()
+
+    return index
+
+
+def _get_dpkg_status_index() -> Optional[Dict[str, List[Tuple[str, str, str]]]]:
+    """Return the dpkg status index, parsing the database only when it has changed.
+
+    Returns None if the database can't be read directly, or if dpkg has pending journal
+    entries in its updates directory which are not merged into the database yet.
+    """
+    try:
+        stat = os.stat(DPKG_STATUS_FILE)
+    except OSError:
+        return None
+
+    try:
+        if os.listdir(DPKG_UPDATES_DIR):
+            return None
+    except FileNotFoundError:
+        pass
+    except OSError:
+        return None
+
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    if _dpkg_status_cache["stamp"] != stamp:
+        try:
+            _dpkg_status_cache["index"] = _parse_dpkg_status(DPKG_STATUS_FILE)
+        except (OSError, UnicodeDecodeError):
+            return None
+        _dpkg_status_cache["stamp"] = stamp
+
+    return _dpkg_status_cache["index"]
+
+
+def _query_dpkg(package: str) -> List[Tuple[str, str, str]]:
+    """Look up a package with `dpkg-query`, when the database can't be read directly."""
+    try:
+        output = _observed(
+            check_output,
+            [
+                "dpkg-query",
+                "--show",
+                "--showformat=${Status}\\t${Version}\\t${Architecture}\\n",
+                package,
+            ],
+            stderr=PIPE,
+            universal_newlines=True,
+        )
+    except CalledProcessError:
+        raise PackageNotFoundError("Package is not installed: {}".format(package)) from None
+
+    return [tuple(line.split("\t")) for line in output.splitlines() if line.count("\t") == 2]
+
+
+class SnapshotDiff(NamedTuple):
+    """Differences between two `PackageSnapshot`s.
+
+    `added` and `removed` hold `(name, arch, version, status)` rows. `changed` holds
+    `(name, arch, (old_version, old_status), (new_version, new_status))` rows.
+    """
+
+    added: List[Tuple[str, str, str, str]]
+    removed: List[Tuple[str, str, str, str]]
+    changed: List[Tuple[str, str, Tuple[str, str], Tuple[str, str]]]
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def names(self) -> set:
+        """Returns the names of the packages that differ."""
+        return {row[0] for rows in self for row in rows}
+
+
+class PackageSnapshot:
+    """A compact snapshot of the packages known to dpkg.
+
+    Packages are held in parallel columns of names, architectures, versions and
+    statuses, sorted by name and architecture, instead of one `DebianPackage` each.
+    This keeps snapshots small enough to store, and lets two of them be diffed in a
+    single merge pass.
+    """
+
+    __slots__ = ("names", "archs", "versions", "statuses")
+
+    def __init__(
+        self,
+        names: Iterable[str] = (),
+        archs: Iterable[str] = (),
+        versions: Iterable[str] = (),
+        statuses: Iterable[str] = (),
+    ):
+        self.names = tuple(names)
+        self.archs = tuple(archs)
+        self.versions = tuple(versions)
+        self.statuses = tuple(statuses)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, PackageSnapshot):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    @classmethod
+    def take(cls, packages: Optional[Iterable[str]] = None) -> "PackageSnapshot":
+        """Snapshots the dpkg status database, with one `dpkg-query` call at most.
+
+        Args:
+            packages: an (Optional) collection of package names to limit the snapshot to
+        """
+        wanted = set(packages) if packages is not None else None
+        index = _get_dpkg_status_index()
+        if index is not None:
+            rows = [
+                (name, arch, version, status)
+                for name, entries in index.items()
+                if wanted is None or name in wanted
+                for status, version, arch in entries
+            ]
+        else:
+            rows = [row for row in _query_dpkg_all() if wanted is None or row[0] in wanted]
+
+        rows.sort(key=lambda row: row[:2])
+        return cls(*zip(*rows)) if rows else cls()
+
+    @classmethod
+    def from_dict(cls, columns: Mapping) -> "PackageSnapshot":
+        """Returns a snapshot from the columns returned by `to_dict`."""
+        return cls(
+            columns.get("names", ()),
+            columns.get("archs", ()),
+            columns.get("versions", ()),
+            columns.get("statuses", ()),
+        )
+
+    def to_dict(self) -> Dict[str, List[str]]:
+        """Returns the snapshot's columns, as lists that can be serialised."""
+        return {
+            "names": list(self.names),
+            "archs": list(self.archs),
+            "versions": list(self.versions),
+            "statuses": list(self.statuses),
+        }
+
+    def diff(self, other: "PackageSnapshot") -> SnapshotDiff:
+        """Returns what changed from this snapshot to `other`, in linear time."""
+        added, removed, changed = [], [], []
+        i = j = 0
+        while i < len(self) or j < len(other):
+            ours = (self.names[i], self.archs[i]) if i < len(self) else None
+            theirs = (other.names[j], other.archs[j]) if j < len(other) else None
+            if theirs is None or (ours is not None and ours < theirs):
+                removed.append((*ours, self.versions[i], self.statuses[i]))
+                i += 1
+            elif ours is None or theirs < ours:
+                added.append((*theirs, other.versions[j], other.statuses[j]))
+                j += 1
+            else:
+                old = (self.versions[i], self.statuses[i])
+                new = (other.versions[j], other.statuses[j])
+                if old != new:
+                    changed.append((*ours, old, new))
+                i += 1
+                j += 1
+        return SnapshotDiff(added, removed, changed)
+
+
+def _query_dpkg_all() -> List[Tuple[str, str, str, str]]:
+    """List every package known to dpkg with a single `dpkg-query` call."""
+    output = _observed(
+        check_output,
+        [
+            "dpkg-query",
+            "--show",
+            "--showformat=${Package}\t${Architecture}\t${Version}\t${Status}\n",
+        ],
+        stderr=PIPE,
+        universal_newlines=True,
+    )
+    return [tuple(line.split("\t")) for line in output.splitlines() if line.count("\t") == 3]
+
+
+_LIST_OPENERS = {"": open, ".gz": gzip.open, ".xz": lzma.open, ".bz2": bz2.open}
+_PACKAGE_MATCHER = re.compile(rb"^Package:[ \t]*(\S+)", re.MULTILINE)
+_LIST_CHUNK_BYTES = 2**20
+_apt_lists_cache = {"files": None}
+
+
+def _open_list_file(filename: str):
+    """Open a `Packages` list, decompressing it transparently."""
+    return _LIST_OPENERS[os.path.splitext(filename)[1]](filename, "rb")
+
+
+def _get_list_priority(filename: str) -> int:
+    """Return the default apt priority of the release a `Packages` list belongs to.
+
+    Releases marked `NotAutomatic`, such as backports, get 1, or 100 if they also have
+    `ButAutomaticUpgrades`. Others, and flat repositories, get 500.
+    """
+    match = re.match(r"(.*_dists_[^_]+)_", os.path.basename(filename))
+    if not match:
+        return 500
+
+    fields = {}
+    for release_name in ("InRelease", "Release"):
+        release_file = os.path.join(
+            os.path.dirname(filename), "{}_{}".format(match.group(1), release_name)
+        )
+        try:
+            with open(release_file, "r", errors="replace") as f:
+                for line in f:
+                    # The release fields come before the checksums
+                    if line.startswith(("MD5Sum:", "SHA1:", "SHA256:", "SHA512:")):
+                        break
+                    key, _, value = line.partition(":")
+                    fields[key] = value.strip().lower()
+            break
+        except OSError:
+            continue
+
+    if fields.get("NotAutomatic") == "yes":
+        return 100 if fields.get("ButAutomaticUpgrades") == "yes" else 1
+    return 500
+
+
+def _index_list_file(filename: str) -> Dict[str, List[int]]:
+    """Return the offsets of the stanzas in a `Packages` list, by package name.
+
+    The list is read in chunks, so that a large decompressed list is never held in
+    memory as a whole.
+    """
+    packages = {}
+    offset = 0
+    rest = b""
+    with _open_list_file(filename) as f:
+        while True:
+            chunk = f.read(_LIST_CHUNK_BYTES)
+            data = rest + chunk
+            # Only complete lines are searched, the last one is left for the next chunk.
+            end = data.rfind(b"\n") + 1 if chunk else len(data)
+            for match in _PACKAGE_MATCHER.finditer(data, 0, end):
+                packages.setdefault(match.group(1).decode(), []).append(offset + match.start())
+            offset += end
+            rest = data[end:]
+            if not chunk:
+                return packages
+
+
+def _read_list_stanza(filename: str, offset: int) -> Dict[str, str]:
+    """Read the top-level fields of the stanza starting at `offset` in a `Packages` list."""
+    vals = {}
+    with _open_list_file(filename) as f:
+        f.seek(offset)
+        for line in f:
+            if not line.strip():
+                break
+            if line[:1] in (b" ", b"\t"):
+                continue
+            key, _, value = line.decode("utf-8", errors="replace").partition(":")
+            vals[key] = value.strip()
+    return vals
+
+
+def _get_apt_lists_index() -> Optional[Dict[str, dict]]:
+    """Return an index of the `Packages` lists in `APT_LISTS_DIR`, by list file.
+
+    Each entry holds the list's `stamp` (mtime and size), its release `priority`, and the
+    offsets of its stanzas by package name. The index is kept in memory and persisted to
+    `APT_LISTS_INDEX_FILE`, and only the lists whose stamp changed are indexed again.
+
+    Returns None if there are no lists, or lists in a compression format that can't be
+    read natively.
+    """
+    filenames = sorted(glob.glob(os.path.join(APT_LISTS_DIR, "*_Packages*")))
+    if not filenames or any(os.path.splitext(f)[1] not in _LIST_OPENERS for f in filenames):
+        return None
+
+    cached = _apt_lists_cache["files"]
+    if cached is None:
+        try:
+            with open(APT_LISTS_INDEX_FILE, "r") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+
+    index = {}
+    changed = set(cached) != set(filenames)
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        stamp = [stat.st_mtime_ns, stat.st_size]
+
+        entry = cached.get(filename)
+        if not entry or entry.get("stamp") != stamp:
+            logger.debug("indexing apt list '%s'", filename)
+            try:
+                entry = {
+                    "stamp": stamp,
+                    "priority": _get_list_priority(filename),
+                    "packages": _index_list_file(filename),
+                }
+            except (OSError, EOFError, lzma.LZMAError) as e:
+                logger.warning("could not index apt list '%s': %s", filename, e)
+                return None
+            changed = True
+        index[filename] = entry
+
+    _apt_lists_cache["files"] = index
+    if changed:
+        try:
+            tmp_file = "{}.{}".format(APT_LISTS_INDEX_FILE, os.getpid())
+            with open(tmp_file, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_file, APT_LISTS_INDEX_FILE)
+        except OSError as e:
+            logger.debug("could not persist the apt lists index: %s", e)
+
+    return index
+
+
+def _has_apt_preferences() -> bool:
+    """Return whether any `apt_preferences` file may pin package versions."""
+    for path in APT_PREFERENCES:
+        if os.path.isfile(path) or (os.path.isdir(path) and os.listdir(path)):
+            return True
+    return False
+
+
+def _get_pinned_candidate(package: str) -> str:
+    """Return the candidate version of a package according to `apt-cache policy`."""
+    try:
+        output = _observed(
+            check_output, ["apt-cache", "policy", package], stderr=PIPE, universal_newlines=True
+        )
+    except CalledProcessError as e:
+        raise PackageError("Could not get apt policy: {}".format(e.output)) from None
+
+    match = re.search(r"^\s*Candidate:\s*(\S+)", output, re.MULTILINE)
+    if not match or match.group(1) == "(none)":
+        raise PackageNotFoundError("Package {} has no candidate!".format(package))
+    return match.group(1)
+
+
+_system_architecture = ""
+
+
+def get_system_architecture() -> str:
+    """Return the native architecture, as `dpkg --print-architecture` does.
+
+    This is the architecture dpkg itself is installed for, so it is read from the dpkg
+    status database when possible, and `dpkg` is only run once per process otherwise.
+    """
+    global _system_architecture
+    if not _system_architecture:
+        index = _get_dpkg_status_index() or {}
+        installed_dpkg = [e for e in index.get("dpkg", []) if e[0].endswith(" installed")]
+        if len(installed_dpkg) == 1:
+            _system_architecture = installed_dpkg[0][2]
+        else:
+            _system_architecture = _observed(
+                check_output, ["dpkg", "--print-architecture"], universal_newlines=True
+            ).strip()
+    return _system_architecture
+
+
+_VERSION_PART = re.compile(r"(\D*)(\d*)")
+
+# Sort weights of the characters in the non-digit part of a version: a tilde sorts
+# before anything, even the end of the part, and letters sort before non-letters.
+_TILDE_WEIGHT = 0
+_END_WEIGHT = 1
+_LETTER_WEIGHT = 2
+_OTHER_WEIGHT = 256
+
+# A part made of an empty string and zero, which is what a missing part compares as.
+# It also terminates every key, so that a shorter revision compares as if padded.
+_END_OF_VERSION = ((_END_WEIGHT,), 0)
+
+
+def _char_weight(char: str) -> int:
+    if char == "~":
+        return _TILDE_WEIGHT
+    if char.isalpha():
+        return _LETTER_WEIGHT + ord(char)
+    return _OTHER_WEIGHT + ord(char)
+
+
+def _revision_key(revision: str) -> tuple:
+    """Return a key that orders upstream or Debian revision strings like dpkg does.
+
+    The revision is split into alternating non-digit and digit parts. Each non-digit
+    part is mapped to a tuple of character weights ending with `_END_WEIGHT`, so that
+    tuples compare like the lexical comparison described in Debian policy.
+    """
+    parts = [
+        (tuple(map(_char_weight, alphas)) + (_END_WEIGHT,), int(digits or 0))
+        for alphas, digits in _VERSION_PART.findall(revision)
+        if alphas or digits
+    ]
+    # Only the first part can have no non-digits, so only an empty revision has no
+    # part equal to `_END_OF_VERSION` where other revisions start with one, e.g. `0`.
+    return tuple(parts or [_END_OF_VERSION]) + (_END_OF_VERSION,)
+
+
 class Version:
     """An abstraction around package versions.
 
@@ -518,20 +1078,38 @@ class Version:
 
     This class implements the algorithm found here:
     https://www.debian.org/doc/debian-policy/ch-controlfields.html#version
+
+    Versions are parsed once into a sort key, so comparing, sorting and hashing them
+    does not parse them again. Versions that dpkg considers equal, such as `1.0` and
+    `1.00`, compare and hash equal.
     """
 
+    __slots__ = ("_version", "_epoch", "_key")
+
     def __init__(self, version: str, epoch: str):
         self._version = version
         self._epoch = epoch or ""
+        upstream, debian = self._get_parts(version)
+        self._key = (
+            int(self._epoch or 0),
+            _revision_key(upstream),
+            _revision_key(debian),
+        )
 
     def __repr__(self):
         """A representation of the package."""
-        return "<{}.{}: {}>".format(self.__module__, self.__class__.__name__, self.__dict__)
+        return "<{}.{}: {}>".format(self.__module__, self.__class__.__name__, str(self))
 
     def __str__(self):
         """A human-readable representation of the package."""
         return "{}{}".format("{}:".format(self._epoch) if self._epoch else "", self._version)
 
+    @classmethod
+    def from_string(cls, version: str) -> "Version":
+        """Returns a `Version` for a string, which may include an epoch."""
+        epoch, number = DebianPackage._get_epoch_from_version(version)
+        return cls(number, epoch)
+
     @property
     def epoch(self):
         """Returns the epoch for a package. May be empty."""
@@ -542,183 +1120,99 @@ class Version:
         """Returns the version number for a package."""
         return self._version
 
-    def _get_parts(self, version: str) -> Tuple[str, str]:
+    @property
+    def key(self) -> tuple:
+        """Returns a key that sorts versions like dpkg does."""
+        return self._key
+
+    @staticmethod
+    def _get_parts(version: str) -> Tuple[str, str]:
         """Separate the version into component upstream and Debian pieces."""
-        try:
-            version.rindex("-")
-        except ValueError:
+        if "-" not in version:
             # No hyphens means no Debian version
             return version, "0"
 
         upstream, debian = version.rsplit("-", 1)
         return upstream, debian
 
-    def _listify(self, revision: str) -> List[str]:
-        """Split a revision string into a listself.
-
-        This list is comprised of  alternating between strings and numbers,
-        padded on either end to always be "str, int, str, int..." and
-        always be of even length.  This allows us to trivially implement the
-        comparison algorithm described.
-        """
-        result = []
-        while revision:
-            rev_1, remains = self._get_alphas(revision)
-            rev_2, remains = self._get_digits(remains)
-            result.extend([rev_1, rev_2])
-            revision = remains
-        return result
-
-    def _get_alphas(self, revision: str) -> Tuple[str, str]:
-        """Return a tuple of the first non-digit characters of a revision."""
-        # get the index of the first digit
-        for i, char in enumerate(revision):
-            if char.isdigit():
-                if i == 0:
-                    return "", revision
-                return revision[0:i], revision[i:]
-        # string is entirely alphas
-        return revision, ""
-
-    def _get_digits(self, revision: str) -> Tuple[int, str]:
-        """Return a tuple of the first integer characters of a revision."""
-        # If the string is empty, return (0,'')
-        if not revision:
-            return 0, ""
-        # get the index of the first non-digit
-        for i, char in enumerate(revision):
-            if not char.isdigit():
-                if i == 0:
-                    return 0, revision
-                return int(revision[0:i]), revision[i:]
-        # string is entirely digits
-        return int(revision), ""
-
-    def _dstringcmp(self, a, b):  # noqa: C901
-        """Debian package version string section lexical sort algorithm.
-
-        The lexical comparison is a comparison of ASCII values modified so
-        that all the letters sort earlier than all the non-letters and so that
-        a tilde sorts before anything, even the end of a part.
-        """
-        if a == b:
-            return 0
-        try:
-            for i, char in enumerate(a):
-                if char == b[i]:
-                    continue
-                # "a tilde sorts before anything, even the end of a part"
-                # (emptyness)
-                if char == "~":
-                    return -1
-                if b[i] == "~":
-                    return 1
-                # "all the letters sort earlier than all the non-letters"
-                if char.isalpha() and not b[i].isalpha():
-                    return -1
-                if not char.isalpha() and b[i].isalpha():
-                    return 1
-                # otherwise lexical sort
-                if ord(char) > ord(b[i]):
-                    return 1
-                if ord(char) < ord(b[i]):
-                    return -1
-        except IndexError:
-            # a is longer than b but otherwise equal, greater unless there are tildes
-            if char == "~":
-                return -1
-            return 1
-        # if we get here, a is shorter than b but otherwise equal, so check for tildes...
-        if b[len(a)] == "~":
-            return 1
-        return -1
-
-    def _compare_revision_strings(self, first: str, second: str):  # noqa: C901
-        """Compare two debian revision strings."""
-        if first == second:
-            return 0
-
-        # listify pads results so that we will always be comparing ints to ints
-        # and strings to strings (at least until we fall off the end of a list)
-        first_list = self._listify(first)
-        second_list = self._listify(second)
-        if first_list == second_list:
-            return 0
-        try:
-            for i, item in enumerate(first_list):
-                # explicitly raise IndexError if we've fallen off the edge of list2
-                if i >= len(second_list):
-                    raise IndexError
-                # if the items are equal, next
-                if item == second_list[i]:
-                    continue
-                # numeric comparison
-                if isinstance(item, int):
-                    if item > second_list[i]:
-                        return 1
-                    if item < second_list[i]:
-                        return -1
-                else:
-                    # string comparison
-                    return self._dstringcmp(item, second_list[i])
-        except IndexError:
-            # rev1 is longer than rev2 but otherwise equal, hence greater
-            # ...except for goddamn tildes
-            if first_list[len(second_list)][0][0] == "~":
-                return 1
-            return 1
-        # rev1 is shorter than rev2 but otherwise equal, hence lesser
-        # ...except for goddamn tildes
-        if second_list[len(first_list)][0][0] == "~":
-            return -1
-        return -1
-
     def _compare_version(self, other) -> int:
-        if (self.number, self.epoch) == (other.number, other.epoch):
-            return 0
-
-        if self.epoch < other.epoch:
-            return -1
-        if self.epoch > other.epoch:
-            return 1
-
-        # If none of these are true, follow the algorithm
-        upstream_version, debian_version = self._get_parts(self.number)
-        other_upstream_version, other_debian_version = self._get_parts(other.number)
-
-        upstream_cmp = self._compare_revision_strings(upstream_version, other_upstream_version)
-        if upstream_cmp != 0:
-            return upstream_cmp
-
-        debian_cmp = self._compare_revision_strings(debian_version, other_debian_version)
-        if debian_cmp != 0:
-            return debian_cmp
-
-        return 0
+        return (self._key > other._key) - (self._key < other._key)
 
     def __lt__(self, other) -> bool:
         """Less than magic method impl."""
-        return self._compare_version(other) < 0
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key < other._key
 
     def __eq__(self, other) -> bool:
         """Equality magic method impl."""
-        return self._compare_version(other) == 0
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key == other._key
+
+    def __hash__(self):
+        """Hash consistent with equality."""
+        return hash(self._key)
 
     def __gt__(self, other) -> bool:
         """Greater than magic method impl."""
-        return self._compare_version(other) > 0
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key > other._key
 
     def __le__(self, other) -> bool:
         """Less than or equal to magic method impl."""
-        return self.__eq__(other) or self.__lt__(other)
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key <= other._key
 
     def __ge__(self, other) -> bool:
         """Greater than or equal to magic method impl."""
-        return self.__gt__(other) or self.__eq__(other)
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key >= other._key
 
     def __ne__(self, other) -> bool:
         """Not equal to magic method impl."""
-        return not self.__eq__(other)
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key != other._key
+
+
+def _as_version(version: Union[Version, str]) -> Version:
+    return version if isinstance(version, Version) else Version.from_string(version)
+
+
+def max_version(versions: Iterable[Union[Version, str]]) -> Version:
+    """Returns the highest of some versions, given as `Version`s or strings.
+
+    Raises:
+        ValueError if there are no versions
+    """
+    return max(map(_as_version, versions), key=lambda version: version.key)
+
+
+def sort_versions(
+    versions: Iterable[Union[Version, str]], reverse: bool = False
+) -> List[Version]:
+    """Returns versions, given as `Version`s or strings, sorted from lowest to highest."""
+    return sorted(
+        map(_as_version, versions), key=lambda version: version.key, reverse=reverse
+    )
+
+
+def compare_many(
+    version: Union[Version, str], others: Iterable[Union[Version, str]]
+) -> List[int]:
+    """Compares a version against many others, like `dpkg --compare-versions` does.
+
+    Returns: -1, 0 or 1 for each of `others`, as `version` is lower, equal or higher
+    """
+    key = _as_version(version).key
+    return [
+        (key > other_key) - (key < other_key)
+        for other_key in (_as_version(other).key for other in others)
+    ]
 
 
 def add_package(
@@ -754,24 +1248,17 @@ def add_package(
             "Explicit version should not be set if more than one package is being added!"
         )
 
-    for p in package_names:
-        pkg, success = _add(p, version, arch)
-        if success:
-            packages["success"].append(pkg)
-        else:
-            logger.warning("failed to locate and install/update '%s'", pkg)
-            packages["retry"].append(p)
+    found, packages["retry"] = _resolve_packages(package_names, version, arch)
+    _install_packages(found)
+    packages["success"].extend(found)
 
     if packages["retry"] and not cache_refreshed:
         logger.info("updating the apt-cache and retrying installation of failed packages.")
         update()
 
-        for p in packages["retry"]:
-            pkg, success = _add(p, version, arch)
-            if success:
-                packages["success"].append(pkg)
-            else:
-                packages["failed"].append(p)
+        found, packages["failed"] = _resolve_packages(packages["retry"], version, arch)
+        _install_packages(found)
+        packages["success"].extend(found)
 
     if packages["failed"]:
         raise PackageError("Failed to install packages: {}".format(", ".join(packages["failed"])))
@@ -779,27 +1266,48 @@ def add_package(
     return packages["success"] if len(packages["success"]) > 1 else packages["success"][0]
 
 
-def _add(
-    name: str,
+def _resolve_packages(
+    package_names: List[str],
     version: Optional[str] = "",
     arch: Optional[str] = "",
-) -> Tuple[Union[DebianPackage, str], bool]:
-    """Adds a package.
+) -> Tuple[List[DebianPackage], List[str]]:
+    """Locates packages on the system or in the apt cache.
 
     Args:
-        name: the name(s) of the package(s)
+        package_names: the names of the packages
         version: an (Optional) version as a string. Defaults to the latest known
-        arch: an optional architecture for the package
+        arch: an optional architecture for the packages
 
-    Returns: a tuple of `DebianPackage` if found, or a :str: if it is not, and
-        a boolean indicating success
+    Returns: a tuple of the `DebianPackage`s found, and the names of those not found
     """
-    try:
-        pkg = DebianPackage.from_system(name, version, arch)
-        pkg.ensure(state=PackageState.Present)
-        return pkg, True
-    except PackageNotFoundError:
-        return name, False
+    found = []
+    missing = []
+    for name in package_names:
+        try:
+            found.append(DebianPackage.from_system(name, version, arch))
+        except PackageNotFoundError:
+            logger.warning("failed to locate and install/update '%s'", name)
+            missing.append(name)
+    return found, missing
+
+
+def _install_packages(packages: List[DebianPackage]) -> None:
+    """Installs the packages that are not yet present, in a single apt transaction.
+
+    Raises:
+        PackageError if the transaction fails
+    """
+    pending = [pkg for pkg in packages if not pkg.present]
+    if not pending:
+        return
+
+    DebianPackage._apt(
+        "install",
+        ["{}={}".format(pkg.name, pkg.version) for pkg in pending],
+        optargs=["--option=Dpkg::Options::=--force-confold"],
+    )
+    for pkg in pending:
+        pkg._state = PackageState.Present
 
 
 def remove_package(
@@ -821,20 +1329,223 @@ def remove_package(
 
     for p in package_names:
         try:
-            pkg = DebianPackage.from_installed_package(p)
-            pkg.ensure(state=PackageState.Absent)
-            packages.append(pkg)
+            packages.append(DebianPackage.from_installed_package(p))
         except PackageNotFoundError:
             logger.info("package '%s' was requested for removal, but it was not installed.", p)
 
+    if packages:
+        DebianPackage._apt(
+            "remove", ["{}={}".format(pkg.name, pkg.version) for pkg in packages]
+        )
+        for pkg in packages:
+            pkg._state = PackageState.Absent
+
     # the list of packages will be empty when no package is removed
     logger.debug("packages: '%s'", packages)
     return packages[0] if len(packages) == 1 else packages
 
 
-def update() -> None:
-    """Updates the apt cache via `apt-get update`."""
-    check_call(["apt-get", "update"], stderr=PIPE, stdout=PIPE)
+def _get_mtime(path: str) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def get_cache_age() -> Optional[float]:
+    """Returns the seconds since the package indexes were last refreshed.
+
+    The refresh time is the latest change to the lists directory or `pkgcache.bin`,
+    which `apt-get update` rewrites. Returns None if the indexes were never refreshed,
+    or if a source was changed after the last refresh.
+    """
+    refreshed = [
+        mtime for mtime in map(_get_mtime, (APT_LISTS_DIR, APT_PKGCACHE_FILE)) if mtime
+    ]
+    if not refreshed or not glob.glob(os.path.join(APT_LISTS_DIR, "*_Packages*")):
+        return None
+
+    sources = list(APT_SOURCES)
+    for sources_dir in APT_SOURCES[1:]:
+        sources.extend(glob.glob(os.path.join(sources_dir, "*")))
+    if any(mtime > max(refreshed) for mtime in map(_get_mtime, sources) if mtime):
+        return None
+
+    return max(0.0, time.time() - max(refreshed))
+
+
+def _is_cache_fresh(max_age: Optional[float]) -> bool:
+    if max_age is None:
+        return False
+    age = get_cache_age()
+    if age is not None and age <= max_age:
+        logger.debug("package indexes refreshed %ds ago, skipping update", age)
+        return True
+    return False
+
+
+def update(max_age: Optional[float] = None) -> bool:
+    """Updates the apt cache via `apt-get update`.
+
+    Args:
+        max_age: an (Optional) age in seconds under which the package indexes are
+            considered fresh, and are not refreshed
+
+    Returns: whether the package indexes were refreshed
+    """
+    if _is_cache_fresh(max_age):
+        return False
+
+    _observed(check_call, ["apt-get", "update"], stderr=PIPE, stdout=PIPE)
+    return True
+
+
+def update_source(
+    source: Union["DebianRepository", str], max_age: Optional[float] = None, lean: bool = False
+) -> bool:
+    """Refreshes the package indexes of a single source via `apt-get update`.
+
+    apt's source list is scoped to the one file, so other sources are neither fetched
+    nor have their indexes cleaned up.
+
+    Args:
+        source: a `DebianRepository`, or the path of a `.list` or `.sources` file
+        max_age: an (Optional) age in seconds under which the package indexes are
+            considered fresh, and are not refreshed, like `update`. Any refresh,
+            full or of a single source, counts, as does any change to the sources.
+        lean: whether to only fetch the `Packages` indexes, skipping translations,
+            Contents and other index targets that package management never reads
+
+    Returns: whether the package indexes were refreshed
+    """
+    if _is_cache_fresh(max_age):
+        return False
+
+    filename = source.filename if isinstance(source, DebianRepository) else source
+    optargs = list(APT_LEAN_UPDATE_OPTIONS) if lean else []
+    # Other sources' lists aren't stale just because they are out of scope.
+    optargs += [
+        "-o",
+        "APT::Get::List-Cleanup=0",
+        "-o",
+        "Dir::Etc::sourcelist={}".format(os.path.abspath(filename)),
+        "-o",
+        "Dir::Etc::sourceparts=-",
+    ]
+    _observed(check_call, ["apt-get", *optargs, "update"], stderr=PIPE, stdout=PIPE)
+    return True
+
+
+ARMOR_BEGIN = "-----BEGIN PGP PUBLIC KEY BLOCK-----"
+ARMOR_END = "-----END PGP PUBLIC KEY BLOCK-----"
+PUBLIC_KEY_PACKET = 6
+
+
+def _make_crc24_table() -> List[int]:
+    table = []
+    for byte in range(256):
+        crc = byte << 16
+        for _ in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= 0x1864CFB
+        table.append(crc & 0xFFFFFF)
+    return table
+
+
+_CRC24_TABLE = _make_crc24_table()
+
+
+def _crc24(data: bytes) -> int:
+    """Returns the CRC-24 of `data`, as used by OpenPGP armor (RFC 4880, 6.1)."""
+    crc = 0xB704CE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFF) ^ _CRC24_TABLE[(crc >> 16) ^ byte]
+    return crc
+
+
+def _dearmor(key_asc: str) -> Optional[bytes]:
+    """Decodes an ASCII armored public key block, like `gpg --dearmor`.
+
+    Returns None if the armor can't be decoded, or if its checksum doesn't match, so
+    that `gpg` can have the final say.
+    """
+    try:
+        body = key_asc[key_asc.index(ARMOR_BEGIN) + len(ARMOR_BEGIN) : key_asc.index(ARMOR_END)]
+    except ValueError:
+        return None
+
+    lines = [line.strip() for line in body.strip().splitlines()]
+    # Skip armor headers, like `Comment: ...`; base64 has no colons.
+    while lines and ":" in lines[0]:
+        lines.pop(0)
+    checksum = lines.pop()[1:] if lines and lines[-1].startswith("=") else None
+    try:
+        data = base64.b64decode("".join(lines), validate=True)
+        crc = base64.b64decode(checksum, validate=True) if checksum is not None else None
+    except ValueError:
+        return None
+    if not data or (crc is not None and crc != _crc24(data).to_bytes(3, "big")):
+        return None
+    return data
+
+
+def _read_packets(data: bytes) -> Iterable[Tuple[int, bytes]]:
+    """Yields the tag and body of each OpenPGP packet in `data` (RFC 4880, 4.2).
+
+    Raises:
+        ValueError if `data` isn't a well-formed packet stream, or uses partial body
+        lengths, which keys don't.
+    """
+    offset = 0
+    while offset < len(data):
+        header = data[offset]
+        if not header & 0x80:
+            raise ValueError("Not an OpenPGP packet header")
+        if header & 0x40:
+            tag = header & 0x3F
+            first = data[offset + 1]
+            if first < 192:
+                length, offset = first, offset + 2
+            elif first < 224:
+                length, offset = ((first - 192) << 8) + data[offset + 2] + 192, offset + 3
+            elif first == 255:
+                length, offset = int.from_bytes(data[offset + 2 : offset + 6], "big"), offset + 6
+            else:
+                raise ValueError("Partial body lengths are not supported")
+        else:
+            tag = (header >> 2) & 0x0F
+            length_type = header & 0x03
+            if length_type == 3:
+                raise ValueError("Indeterminate lengths are not supported")
+            size = 1 << length_type
+            length = int.from_bytes(data[offset + 1 : offset + 1 + size], "big")
+            offset += 1 + size
+        if offset + length > len(data):
+            raise ValueError("Truncated OpenPGP packet")
+        yield tag, data[offset : offset + length]
+        offset += length
+
+
+def _get_fingerprint(key_gpg: bytes) -> Optional[str]:
+    """Returns the fingerprint of the primary key in `key_gpg`, as `gpg` prints it.
+
+    Only v4 keys are handled: None is returned for other keys, or for anything that
+    doesn't parse, so that `gpg` can have the final say.
+    """
+    try:
+        packets = list(_read_packets(key_gpg))
+    except (ValueError, IndexError):
+        return None
+    if not packets:
+        return None
+
+    tag, body = packets[0]
+    if tag != PUBLIC_KEY_PACKET or not body or body[0] != 4 or len(body) > 0xFFFF:
+        return None
+    # RFC 4880, 12.2: the SHA-1 of 0x99, the two-octet packet length, and the packet.
+    digest = hashlib.sha1(b"\x99" + len(body).to_bytes(2, "big") + body)
+    return digest.hexdigest().upper()
 
 
 class InvalidSourceError(Error):
@@ -1022,18 +1733,9 @@ class DebianRepository:
             # we trust its validation better than our own. eg. handling
             # comments before the key.
             logger.debug("PGP key found (looks like ASCII Armor format)")
-            if (
-                "-----BEGIN PGP PUBLIC KEY BLOCK-----" in key
-                and "-----END PGP PUBLIC KEY BLOCK-----" in key
-            ):
-                logger.debug("Writing provided PGP key in the binary format")
-                key_bytes = key.encode("utf-8")
-                key_name = self._get_keyid_by_gpg_key(key_bytes)
-                key_gpg = self._dearmor_gpg_key(key_bytes)
-                self._gpg_key_filename = "/etc/apt/trusted.gpg.d/{}.gpg".format(key_name)
-                self._write_apt_gpg_keyfile(key_name=self._gpg_key_filename, key_material=key_gpg)
-            else:
-                raise GPGKeyError("ASCII armor markers missing from GPG key")
+            self._gpg_key_filename, key_gpg = self.read_armored_key(key)
+            logger.debug("Writing provided PGP key in the binary format")
+            self._write_apt_gpg_keyfile(key_name=self._gpg_key_filename, key_material=key_gpg)
         else:
             logger.warning(
                 "PGP key found (looks like Radix64 format). "
@@ -1047,10 +1749,36 @@ class DebianRepository:
             # gpg
             key_asc = self._get_key_by_keyid(key)
             # write the key in GPG format so that apt-key list shows it
-            key_gpg = self._dearmor_gpg_key(key_asc.encode("utf-8"))
+            key_gpg = _dearmor(key_asc) or self._dearmor_gpg_key(key_asc.encode("utf-8"))
             self._gpg_key_filename = "/etc/apt/trusted.gpg.d/{}.gpg".format(key)
             self._write_apt_gpg_keyfile(key_name=key, key_material=key_gpg)
 
+    @staticmethod
+    def read_armored_key(key: str) -> Tuple[str, bytes]:
+        """Read an ASCII Armor key like `import_key` does, without writing it.
+
+        Args:
+          key: A GPG key in ASCII armor format, including BEGIN and END markers
+
+        Returns:
+          The path `import_key` writes the key to, and the binary key material
+
+        Raises:
+          GPGKeyError if the armor markers are missing or the key can't be read
+        """
+        key = key.strip()
+        if ARMOR_BEGIN not in key or ARMOR_END not in key:
+            raise GPGKeyError("ASCII armor markers missing from GPG key")
+
+        key_gpg = _dearmor(key)
+        key_name = key_gpg and _get_fingerprint(key_gpg)
+        if not key_name:
+            # Keys that can't be read here, e.g. v5 keys, are left to gpg.
+            key_bytes = key.encode("utf-8")
+            key_name = DebianRepository._get_keyid_by_gpg_key(key_bytes)
+            key_gpg = DebianRepository._dearmor_gpg_key(key_bytes)
+        return "/etc/apt/trusted.gpg.d/{}.gpg".format(key_name), key_gpg
+
     @staticmethod
     def _get_keyid_by_gpg_key(key_material: bytes) -> str:
         """Get a GPG key fingerprint by GPG key material.
@@ -1061,7 +1789,8 @@ class DebianRepository:
         """
         # Use the same gpg command for both Xenial and Bionic
         cmd = ["gpg", "--with-colons", "--with-fingerprint"]
-        ps = subprocess.run(
+        ps = _observed(
+            subprocess.run,
             cmd,
             stdout=PIPE,
             stderr=PIPE,
@@ -1111,7 +1840,7 @@ class DebianRepository:
         )
         curl_cmd = ["curl", keyserver_url.format(keyid)]
         # use proxy server settings in order to retrieve the key
-        return check_output(curl_cmd).decode()
+        return _observed(check_output, curl_cmd).decode()
 
     @staticmethod
     def _dearmor_gpg_key(key_asc: bytes) -> bytes:
@@ -1126,7 +1855,9 @@ class DebianRepository:
         Raises:
           GPGKeyError
         """
-        ps = subprocess.run(["gpg", "--dearmor"], stdout=PIPE, stderr=PIPE, input=key_asc)
+        ps = _observed(
+            subprocess.run, ["gpg", "--dearmor"], stdout=PIPE, stderr=PIPE, input=key_asc
+        )
         out, err = ps.stdout, ps.stderr.decode()
         if "gpg: no valid OpenPGP data found." in err:
             raise GPGKeyError(
@@ -1144,7 +1875,16 @@ class DebianRepository:
         Args:
           key_name: A key name to use for a key file (could be a fingerprint)
           key_material: A GPG key material (binary)
+
+        The file is left untouched if it already holds `key_material`.
         """
+        try:
+            with open(key_name, "rb") as keyf:
+                if keyf.read() == key_material:
+                    return
+        except OSError:
+            pass
+
         with open(key_name, "wb") as keyf:
             keyf.write(key_material)
 
@@ -1170,13 +1910,17 @@ class RepositoryMapping(Mapping):
         # Repositories that we're adding -- used to implement mode param
         self.default_file = "/etc/apt/sources.list"
 
-        # read sources.list if it exists
+        # read sources.list if it exists, then sources.list.d. Files without any valid
+        # repository line (e.g. a commented-out sources.list on deb822 systems) are skipped
+        source_files = glob.glob("/etc/apt/sources.list.d/*.list")
         if os.path.isfile(self.default_file):
-            self.load(self.default_file)
+            source_files.insert(0, self.default_file)
 
-        # read sources.list.d
-        for file in glob.iglob("/etc/apt/sources.list.d/*.list"):
-            self.load(file)
+        for file in source_files:
+            try:
+                self.load(file)
+            except InvalidSourceError:
+                logger.debug("skipped '%s' without any valid repository line", file)
 
     def __contains__(self, key: str) -> bool:
         """Magic method for checking presence of repo in mapping."""
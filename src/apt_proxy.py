@@ -0,0 +1,121 @@
+# See LICENSE file for licensing details.
+
+"""
+Send APT through a proxy, like a site-local apt-cacher-ng or squid cache, with an
+`apt.conf.d` drop-in. APT reads it on every run, so it covers the package installs
+and index refreshes of the charm and of the apt library, as well as those of
+unattended-upgrades.
+"""
+
+import os
+import subprocess
+import time
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from files import write_file_if_changed
+from hook_stats import observe_command
+
+APT_PROXY_CONF = "/etc/apt/apt.conf.d/99landscapeproxy"
+
+CACHE_HEADERS = ("X-Cache", "X-Cache-Lookup", "Age", "Via")
+"""Response headers of caching proxies that tell whether a download was cached."""
+
+PROBE_TIMEOUT = 5
+
+UNSAFE_CHARACTERS = ('"', ";", "\n")
+"""Characters that would end an APT configuration value or statement early."""
+
+
+class InvalidProxyOption(ValueError):
+    pass
+
+
+def get_no_proxy_hosts(no_proxy: Optional[str]) -> List[str]:
+    """Return the hosts of a comma-separated `no_proxy` list."""
+    return [host.strip() for host in (no_proxy or "").split(",") if host.strip()]
+
+
+def render_proxy_conf(
+    http_proxy: Optional[str], https_proxy: Optional[str], no_proxy: Optional[str]
+) -> str:
+    """
+    Return the APT configuration sending downloads through the proxies, except from
+    the comma-separated `no_proxy` hosts, or an empty string without proxies.
+
+    Raise `InvalidProxyOption` for values that would break out of the configuration.
+    """
+    hosts = get_no_proxy_hosts(no_proxy)
+    for value in (http_proxy, https_proxy, *hosts):
+        if value and any(char in value for char in UNSAFE_CHARACTERS):
+            raise InvalidProxyOption(f"Invalid APT proxy option: {value!r}")
+
+    lines = []
+    for scheme, proxy in (("http", http_proxy), ("https", https_proxy)):
+        if not proxy:
+            continue
+        lines.append(f'Acquire::{scheme}::Proxy "{proxy}";')
+        lines.extend(f'Acquire::{scheme}::Proxy::{host} "DIRECT";' for host in hosts)
+    return "".join(f"{line}\n" for line in lines)
+
+
+def write_proxy_conf(content: str) -> bool:
+    """
+    Write `content` to the drop-in, or remove it if `content` is empty, and return
+    whether it changed.
+    """
+    if not content:
+        if not os.path.exists(APT_PROXY_CONF):
+            return False
+        os.remove(APT_PROXY_CONF)
+        return True
+
+    return write_file_if_changed(APT_PROXY_CONF, content)
+
+
+def get_package_uri(package: str) -> Optional[str]:
+    """Return the URI APT downloads the candidate of `package` from."""
+    command = ["apt-get", "--print-uris", "-qq", "download", package]
+    start = time.monotonic()
+    process = subprocess.run(command, capture_output=True, text=True)
+    observe_command(
+        command,
+        time.monotonic() - start,
+        returncode=process.returncode,
+        output_bytes=len(process.stdout),
+    )
+    if process.returncode != 0:
+        return None
+
+    # Each line is: 'URI' filename size hash
+    for line in process.stdout.splitlines():
+        if line.startswith("'"):
+            return line.split("'")[1]
+    return None
+
+
+def is_proxied(uri: str, no_proxy: Optional[str]) -> bool:
+    """Return whether APT downloads `uri` through a proxy that can cache it."""
+    parsed = urlparse(uri)
+    # HTTPS downloads are tunnelled through the proxy, which can't see them.
+    if parsed.scheme != "http":
+        return False
+    return parsed.hostname not in get_no_proxy_hosts(no_proxy)
+
+
+def probe_cache(uri: str, proxy: str) -> str:
+    """
+    Ask `proxy` for the headers of `uri`, before APT downloads it, and return those
+    telling whether it is cached, e.g. `pre-download probe: X-Cache: HIT from cache`.
+    This is what the proxy reports for the probe, not for the download itself.
+    """
+    # Only the upgrade action needs it.
+    import urllib.request
+
+    scheme = uri.partition(":")[0]
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({scheme: proxy}))
+    request = urllib.request.Request(uri, method="HEAD")
+    with opener.open(request, timeout=PROBE_TIMEOUT) as response:
+        headers = response.headers
+    found = [f"{name}: {headers[name]}" for name in CACHE_HEADERS if name in headers]
+    return f"pre-download probe: {', '.join(found) or 'no cache headers'}"
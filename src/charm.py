@@ -4,40 +4,112 @@
 # Learn more at: https://juju.is/docs/sdk
 
 import base64
-import configparser
+import functools
+import hashlib
+import io
+import json
 import logging
 import os
 import re
 import socket
 import subprocess
 import sys
+import time
 import traceback
-from typing import Any, Mapping
+from typing import Any, Mapping, Optional
 
-from charms.operator_libs_linux.v0 import apt
 from ops.charm import CharmBase
 from ops.framework import StoredState
 from ops.main import main
-from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus
+from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus, WaitingStatus
+
+import tracing
+from apt_proxy import (
+    APT_PROXY_CONF,
+    InvalidProxyOption,
+    get_package_uri,
+    is_proxied,
+    probe_cache,
+    render_proxy_conf,
+    write_proxy_conf,
+)
+from client_state import (
+    BROKER_PERSIST_FILENAME,
+    DEFAULT_DATA_PATH,
+    read_registration_state,
+)
+from command_output import (
+    CHUNK_BYTES,
+    OutputCapture,
+    open_output_log,
+    set_debug_output,
+)
+from facts import FactCache, get_file_stamp
+from files import write_file_if_changed
+from hook_profiling import (
+    format_profile,
+    list_profiles,
+    read_memory_profile,
+    run_profiled,
+    set_profile_mode,
+)
+from hook_stats import HookStats, get_hook_name, observe_command, phase
+from lazy_import import lazy_import
+from planner import ChangeAction, plan_config_change
+from ppa import SOURCES_DIR, ensure_ppa_repository, find_ppa_source
+from registration import format_time, get_registration_due, get_retry_delay
+from rolling import (
+    GRANTED_KEY,
+    PEER_RELATION,
+    REQUESTED_KEY,
+    grant_tokens,
+    queue_position,
+)
+
+# Only some hooks manage packages or parse client.conf.
+apt = lazy_import(
+    "charms.operator_libs_linux.v0.apt",
+    on_load=lambda module: module.add_command_observer(observe_command),
+)
+configparser = lazy_import("configparser")
 
 logger = logging.getLogger(__name__)
 
 APT_CONF_OVERRIDE = "/etc/apt/apt.conf.d/99landscapeoverride"
+APT_CONF_OVERRIDE_CONTENT = 'APT::Periodic::Unattended-Upgrade "0";'
 CERT_FILE = "/etc/ssl/certs/landscape_server_ca.crt"
 CLIENT_CONF_FILE = "/etc/landscape/client.conf"
 CLIENT_CONFIG_CMD = "/usr/bin/landscape-config"
+DPKG_STATUS_FILE = "/var/lib/dpkg/status"
 CLIENT_PACKAGE = "landscape-client"
+WATCHED_PACKAGES = (CLIENT_PACKAGE, "landscape-common", "python3-landscape-client")
 
 CHARM_ONLY_CONFIGS = {
     "ppa",
+    "ppa-key",
     "disable-unattended-upgrades",
     "additional-client-configuration",
+    "profile-hooks",
+    "tracing-endpoint",
+    "registration-window",
+    "registration-retry-max",
+    "rolling-max-concurrent",
+    "apt-http-proxy",
+    "apt-https-proxy",
+    "apt-no-proxy",
+    "debug-output",
 }
 """
 Configuration values that are only meaningful for the charm and should not be passed
 through to Landscape client.
 """
 
+DIAGNOSTIC_CONFIGS = {"profile-hooks", "tracing-endpoint", "debug-output"}
+"""Charm-only options that change how the charm is observed, not what it sets up."""
+
+SECRET_CLIENT_KEYS = {"registration_key"}
+"""Client configuration keys whose values must not be kept in stored state."""
+
 
 class ClientCharmError(Exception):
     pass
@@ -59,13 +131,13 @@ def log_info(text, event=None):
         event.log(text)
 
 
-def write_certificate(certificate, filename):
+def write_certificate(certificate, filename) -> bool:
     """
     @param certificate Text of the certificate, base64 encoded.
     @param filename Full path to file to write
+    @return Whether the file changed.
     """
-    with open(filename, "wb") as file:
-        file.write(base64.b64decode(certificate))
+    return write_file_if_changed(filename, base64.b64decode(certificate))
 
 
 def parse_ssl_arg(value):
@@ -77,7 +149,8 @@ def parse_ssl_arg(value):
     b64_prefix = "base64:"
     if value.startswith(b64_prefix) or len(value) > 4096:
         value = re.sub("^" + b64_prefix, "", value)
-        write_certificate(value, CERT_FILE)
+        if write_certificate(value, CERT_FILE):
+            log_info("Certificate {} updated".format(CERT_FILE))
         value = CERT_FILE
     else:
         if not os.path.isfile(value):
@@ -99,48 +172,111 @@ def get_modified_env_vars():
     return env_vars
 
 
-def process_helper(args, hide_errors=False, env=get_modified_env_vars()):
+@functools.lru_cache(maxsize=None)
+def get_process_env_vars():
+    """Return the environment of spawned commands, prepared on first use."""
+    return get_modified_env_vars()
+
+
+def process_helper(args, hide_errors=False, env=None):
     """
     Grabs all outputs and exceptions from subprocess and look for
     keywords that indicate failure and return if successful or not
     If hide errors flag is enabled, then suppresses output, which
     is used for commands that are expected to return non-zero
+    Only the head and tail of the output are kept and logged; with the
+    `debug-output` option, all of it is also appended to the output log.
     """
     log_info(args)
+    if env is None:
+        env = get_process_env_vars()
+    start = time.monotonic()
     try:
         p = subprocess.Popen(
-            args, stderr=subprocess.STDOUT, stdout=subprocess.PIPE, text=True, env=env
+            args, stderr=subprocess.STDOUT, stdout=subprocess.PIPE, env=env
         )
     except Exception:
         log_error(traceback.format_exc())
         return False
-    output, error = p.communicate()
-    if p.returncode != 0 or "Failure" in output:
+    output = OutputCapture(marker=b"Failure")
+    chunks = iter(lambda: p.stdout.read1(CHUNK_BYTES), b"")
+    try:
+        with open_output_log(args) as output_log:
+            output.mirror = output_log
+            for chunk in chunks:
+                output.feed(chunk)
+    except OSError:
+        log_error(traceback.format_exc())
+    finally:
+        # Whatever the output log did, read the rest so the command doesn't block
+        # on a full pipe, and reap it.
+        output.mirror = None
+        for chunk in chunks:
+            output.feed(chunk)
+        p.stdout.close()
+        p.wait()
+    observe_command(
+        args,
+        time.monotonic() - start,
+        returncode=p.returncode,
+        output_bytes=output.total,
+    )
+    if p.returncode != 0 or output.found:
         if not hide_errors:
-            log_error("".join(traceback.format_stack()))
-            log_error(output)
-            log_error(error)
+            log_error(f"{args[0]} failed with exit code {p.returncode}:")
+            log_error(output.text())
         return False
     else:
-        log_info(output)
+        log_info(output.text())
         return True
 
 
-def merge_client_config(conf_file: str, client_config: Mapping[str, Any]):
+def read_client_config(conf_file: str) -> dict[str, str]:
+    """
+    Return the raw values of the [client] section in `conf_file`, or an empty
+    dictionary if the file or the section is missing.
+    """
+    config = configparser.ConfigParser()
+    config.read(conf_file)
+    if not config.has_section("client"):
+        return {}
+
+    return {key: config.get("client", key, raw=True) for key in config["client"]}
+
+
+def redact_client_config(client_config: Mapping[str, Any]) -> dict[str, Any]:
+    """
+    Replace the values of `SECRET_CLIENT_KEYS` in `client_config` with their digest,
+    so that they can be cached and compared without being kept.
+    """
+    return {
+        key: (
+            hashlib.sha256(str(value).encode()).hexdigest()
+            if key in SECRET_CLIENT_KEYS and value
+            else value
+        )
+        for key, value in client_config.items()
+    }
+
+
+def merge_client_config(conf_file: str, client_config: Mapping[str, Any]) -> bool:
     """
     Read the contents of the [client] section in `conf_file` and merge `client_config`,
-    overwriting existing values.
+    overwriting existing values. Return whether the file changed.
     """
     config = configparser.ConfigParser()
     config.read(conf_file)
 
     config["client"].update({k: str(v) for k, v in client_config.items() if v})
 
-    with open(conf_file, "w") as configfile:
-        config.write(configfile)
+    content = io.StringIO()
+    config.write(content)
+    # client.conf holds the registration key.
+    changed = write_file_if_changed(conf_file, content.getvalue(), mode=0o600)
 
     c = {s: dict(config[s]) for s in config.sections()}
     logger.info(f"Client configuration merged. Current value: {c}")
+    return changed
 
 
 def get_additional_client_configuration(
@@ -207,6 +343,25 @@ def create_client_config(
     return client_config
 
 
+def get_config_digest(
+    juju_config: Mapping[str, Any],
+    client_config: Mapping[str, Any],
+) -> str:
+    """
+    Return a canonical digest of the effective configuration: the Landscape client
+    configuration created by `create_client_config` plus the charm-only options.
+    """
+    effective_config = {
+        "client": dict(client_config),
+        "charm": {
+            key: juju_config.get(key)
+            for key in sorted(CHARM_ONLY_CONFIGS - DIAGNOSTIC_CONFIGS)
+        },
+    }
+    serialized = json.dumps(effective_config, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
 class LandscapeClientCharm(CharmBase):
     """Charm the service."""
 
@@ -221,13 +376,79 @@ class LandscapeClientCharm(CharmBase):
         )
         self.framework.observe(self.on.upgrade_action, self._upgrade)
         self.framework.observe(self.on.register_action, self._register)
-        self._stored.set_default(things=[])
+        self.framework.observe(self.on.plan_config_action, self._plan_config)
+        self.framework.observe(self.on.fact_stats_action, self._fact_stats)
+        self.framework.observe(self.on.update_status, self._on_update_status)
+        self.framework.observe(self.on.hook_stats_action, self._hook_stats)
+        self.framework.observe(self.on.fetch_profile_action, self._fetch_profile)
+        self.framework.observe(self.framework.on.pre_commit, self._on_pre_commit)
+        self.framework.observe(
+            self.on[PEER_RELATION].relation_changed, self._on_rolling_changed
+        )
+        self.framework.observe(
+            self.on[PEER_RELATION].relation_departed, self._on_rolling_changed
+        )
+        self.framework.observe(self.on.leader_elected, self._on_rolling_changed)
+        self._stored.set_default(
+            things=[],
+            config_digest=None,
+            certificate_digest=None,
+            ppa_digest=None,
+            facts={},
+            fact_stats={},
+            packages={},
+            packages_stamp=None,
+            hook_stats={},
+            registration_due=None,
+            registration_attempts=0,
+            registration_forced=False,
+            registration_window=None,
+            rolling_pending={},
+        )
+        self.facts = FactCache(self._stored.facts, self._stored.fact_stats)
+        self.hook_stats = HookStats(self._stored.hook_stats)
 
-    def add_ppa(self):
-        landscape_ppa = self.config.get("ppa")
-        if landscape_ppa:
-            self.unit.status = MaintenanceStatus("Adding client PPA..")
+    @phase("add-ppa")
+    def add_ppa(self) -> bool:
+        """
+        Set up the configured PPA, if any, and return whether the package indexes
+        were refreshed.
 
+        Nothing is done if the PPA was already set up with the same configuration and
+        its source is still on disk. With `ppa-key`, the source and key are written
+        natively; otherwise `add-apt-repository` fetches the key from Launchpad.
+        """
+        landscape_ppa = self.config.get("ppa")
+        if not landscape_ppa:
+            return False
+
+        ppa_key = self.config.get("ppa-key") or ""
+        ppa_digest = hashlib.sha256(f"{landscape_ppa}\n{ppa_key}".encode()).hexdigest()
+        ppa_source_fact = f"ppa-source:{landscape_ppa}"
+        ppa_source = self.facts.get(
+            ppa_source_fact,
+            lambda: find_ppa_source(landscape_ppa),
+            source=SOURCES_DIR,
+        )
+        if ppa_digest == self._stored.ppa_digest and ppa_source:
+            log_info(f"PPA {landscape_ppa} already set up.")
+            return False
+
+        self.unit.status = MaintenanceStatus("Adding client PPA..")
+        # Only a full refresh cleans up the lists of a PPA this one replaces.
+        replaced = self._stored.ppa_digest not in (None, ppa_digest)
+        self._stored.ppa_digest = None
+        self.facts.invalidate(ppa_source_fact)
+
+        if ppa_key:
+            try:
+                refreshed = ensure_ppa_repository(landscape_ppa, ppa_key)
+                if refreshed and (replaced or not self.refresh_ppa_indexes()):
+                    apt.update()
+            except (apt.Error, subprocess.CalledProcessError, OSError):
+                log_error(traceback.format_exc())
+                raise ClientCharmError("Failed to add PPA!")
+        else:
             # add-apt-repository doesn't use the proxy configuration from apt
             # or juju. If we find any juju_proxy setting or application config,
             # add the classic http(s)_proxy to the env. Only necessary for this
@@ -257,95 +478,592 @@ class LandscapeClientCharm(CharmBase):
                 ["add-apt-repository", "-y", landscape_ppa], env=add_apt_repository_env
             ):
                 raise ClientCharmError("Failed to add PPA!")
+            refreshed = True
+
+        self._stored.ppa_digest = ppa_digest
+        return refreshed
+
+    @phase("refresh-ppa-indexes")
+    def refresh_ppa_indexes(self, max_age: Optional[int] = None) -> bool:
+        """
+        Refresh only the package indexes of the configured PPA, unless they were
+        refreshed less than `max_age` seconds ago, and return whether it was found.
+        Other sources don't provide client builds.
+        """
+        landscape_ppa = self.config.get("ppa")
+        if not landscape_ppa:
+            return False
+
+        ppa_source = self.facts.get(
+            f"ppa-source:{landscape_ppa}",
+            lambda: find_ppa_source(landscape_ppa),
+            source=SOURCES_DIR,
+        )
+        if not ppa_source:
+            return False
+
+        log_info(f"Refreshing package indexes of {ppa_source}...")
+        try:
+            if not apt.update_source(ppa_source, max_age=max_age, lean=True):
+                log_info(f"Package indexes refreshed less than {max_age}s ago")
+        except subprocess.CalledProcessError:
+            log_error(traceback.format_exc())
+            return False
+        return True
+
+    def installed_client_version(self) -> Optional[str]:
+        """Return the installed version of the client package, if it is installed."""
 
+        def lookup():
+            try:
+                package = apt.DebianPackage.from_installed_package(CLIENT_PACKAGE)
+            except apt.PackageNotFoundError:
+                return None
+            return str(package.version)
+
+        return self.facts.get("client-version", lookup, source=DPKG_STATUS_FILE)
+
+    @phase("install-client")
     def install_landscape_client(self):
+        """
+        Install the client package, refreshing all package indexes and trying once
+        more if that fails: refreshing only the PPA's indexes can leave the client's
+        dependencies unresolvable, e.g. on a fresh unit.
+        """
         self.unit.status = MaintenanceStatus("Installing landscape client..")
         try:
             apt.add_package(CLIENT_PACKAGE)
+            return
+        except Exception:
+            log_error(traceback.format_exc())
+
+        log_info("Refreshing all package indexes and retrying the install...")
+        try:
+            apt.update()
+            apt.add_package(CLIENT_PACKAGE)
         except Exception:
             log_error(traceback.format_exc())
             raise ClientCharmError("Failed to install client!")
 
-    def set_client_config(self):
+    def get_client_config(self) -> dict:
         """
         Gets and processes the landscape client config args
         from the charm configuration
         """
-        client_config = create_client_config(
+        return create_client_config(
             juju_config=self.config,
             default_computer_title=socket.gethostname(),
         )
+
+    @phase("write-client-config")
+    def set_client_config(self, client_config: Mapping[str, Any]) -> bool:
         log_info(client_config)
-        merge_client_config(CLIENT_CONF_FILE, client_config)
+        return merge_client_config(CLIENT_CONF_FILE, client_config)
+
+    def config_applied(self, client_config: Mapping[str, Any]) -> bool:
+        """
+        Check, without spawning anything or writing any file, that the on-disk state
+        still agrees with `client_config` and the charm-only options.
+        """
+        if not os.path.exists(CLIENT_CONFIG_CMD):
+            return False
+
+        if self.config.get("disable-unattended-upgrades"):
+            if not self.apt_conf_override_applied():
+                return False
+        elif os.path.exists(APT_CONF_OVERRIDE):
+            return False
+
+        if not self.apt_proxy_applied():
+            return False
+
+        current = self.read_client_config()
+        if not current:
+            return False
+
+        return all(
+            current.get(key) == str(value)
+            for key, value in redact_client_config(client_config).items()
+            if value
+        )
+
+    def read_client_config(self) -> dict[str, str]:
+        """
+        Return the [client] section of `client.conf`, parsed once per change, with
+        secrets redacted by `redact_client_config`.
+        """
+        return self.facts.get(
+            "client-config",
+            lambda: redact_client_config(read_client_config(CLIENT_CONF_FILE)),
+            source=CLIENT_CONF_FILE,
+        )
 
+    def apt_conf_override_applied(self) -> bool:
+        expected = hashlib.sha256(APT_CONF_OVERRIDE_CONTENT.encode()).hexdigest()
+        return self.facts.file_digest(APT_CONF_OVERRIDE) == expected
+
+    def get_apt_proxy_conf(self) -> str:
+        try:
+            return render_proxy_conf(
+                self.config.get("apt-http-proxy"),
+                self.config.get("apt-https-proxy"),
+                self.config.get("apt-no-proxy"),
+            )
+        except InvalidProxyOption as exc:
+            raise ClientCharmError(str(exc)) from exc
+
+    def apt_proxy_applied(self) -> bool:
+        content = self.get_apt_proxy_conf()
+        expected = hashlib.sha256(content.encode()).hexdigest() if content else None
+        return self.facts.file_digest(APT_PROXY_CONF) == expected
+
+    def apply_apt_proxy(self):
+        """Point APT at the proxies of the `apt-*-proxy` options, if any."""
+        try:
+            if write_proxy_conf(self.get_apt_proxy_conf()):
+                log_info("Updated the APT proxy configuration")
+        except OSError:
+            log_error(traceback.format_exc())
+            raise ClientCharmError("Failed to configure the APT proxy!")
+
+    def probe_package_cache(self) -> Optional[str]:
+        """
+        Return whether the APT proxy has the client package candidate cached, as
+        told by its caching headers to a probe made before the download, or None if
+        APT doesn't download it through a caching proxy.
+        """
+        proxy = self.config.get("apt-http-proxy")
+        if not proxy:
+            return None
+        uri = get_package_uri(CLIENT_PACKAGE)
+        if not uri or not is_proxied(uri, self.config.get("apt-no-proxy")):
+            return None
+        try:
+            return probe_cache(uri, proxy)
+        except OSError as exc:
+            return f"unknown ({exc})"
+
+    def get_certificate_digest(self, client_config: Mapping[str, Any]) -> Optional[str]:
+        """Return the digest of the client's SSL certificate, if it uses one."""
+        certificate = client_config.get("ssl_public_key")
+        return self.facts.file_digest(certificate) if certificate else None
+
+    @phase("is-registered")
     def is_registered(self):
-        return process_helper([CLIENT_CONFIG_CMD, "--is-registered"], hide_errors=True)
+        """
+        Read the registration state persisted by the client, falling back to
+        `landscape-config --is-registered` if its format isn't recognised.
+        """
+        data_path = self.read_client_config().get("data_path")
+
+        def lookup():
+            registered = read_registration_state(data_path)
+            if registered is not None:
+                return registered
+
+            return process_helper(
+                [CLIENT_CONFIG_CMD, "--is-registered"], hide_errors=True
+            )
 
+        persist_file = os.path.join(
+            data_path or DEFAULT_DATA_PATH, BROKER_PERSIST_FILENAME
+        )
+        return self.facts.get("registered", lookup, source=persist_file)
+
+    @phase("register")
     def send_registration(self):
+        self.facts.invalidate("registered")
         if process_helper([CLIENT_CONFIG_CMD, "--silent"]):
             self.unit.status = ActiveStatus("Client registered!")
         else:
             raise ClientCharmError("Registration failed!")
 
-    def run_landscape_client(self):
+    def request_registration(self, force: bool = False):
+        """
+        Register the client once this unit's slot in `registration-window` opens,
+        or right away if there is no window. Pending registrations are sent from
+        `update-status`, and failed ones are retried from there with backoff.
+
+        Unless `force` is set, e.g. to register with a new account, a pending
+        registration is dropped if the client got registered in the meantime.
+        """
+        if self._stored.registration_due is None:
+            self._stored.registration_due = get_registration_due(
+                self.unit.name, self.config.get("registration-window") or 0
+            )
+            self._stored.registration_forced = force
+        elif force:
+            self._stored.registration_forced = True
+
+        due = self._stored.registration_due
+        if time.time() < due:
+            log_info(f"Registration deferred until {format_time(due)}")
+            self.unit.status = WaitingStatus(
+                f"Registration scheduled for {format_time(due)}"
+            )
+            return
+
+        self._stored.registration_due = None
+        if not self._stored.registration_forced and self.is_registered():
+            log_info("Client registered meanwhile, registration dropped")
+            self._stored.registration_attempts = 0
+            self.unit.status = ActiveStatus("Client registered!")
+            return
+
+        try:
+            self.send_registration()
+        except ClientCharmError:
+            self.schedule_registration_retry()
+            return
+        self._stored.registration_attempts = 0
+        self._stored.registration_forced = False
+
+    def update_registration_window(self):
+        """
+        Move a pending registration to this unit's slot of `registration-window`,
+        if the window changed. Retries keep their backoff.
+        """
+        window = self.config.get("registration-window") or 0
+        if window == self._stored.registration_window:
+            return
+
+        self._stored.registration_window = window
+        if (
+            self._stored.registration_due is not None
+            and not self._stored.registration_attempts
+        ):
+            self._stored.registration_due = get_registration_due(self.unit.name, window)
+            log_info(
+                f"Registration rescheduled for {format_time(self._stored.registration_due)}"
+            )
+
+    def schedule_registration_retry(self):
+        attempts = self._stored.registration_attempts + 1
+        delay = get_retry_delay(attempts, self.config.get("registration-retry-max"))
+        due = time.time() + delay
+        self._stored.registration_attempts = attempts
+        self._stored.registration_due = due
+        log_error(f"Registration attempt {attempts} failed, retrying in {delay:.0f}s")
+        self.unit.status = WaitingStatus(
+            f"Registration attempt {attempts} failed, retrying at {format_time(due)}"
+        )
+
+    @phase("apply-client-config")
+    def run_landscape_client(
+        self, client_config: Mapping[str, Any], certificate_changed: bool = False
+    ):
+        """
+        Apply `client_config` with the cheapest sufficient action for the keys that
+        changed, registering the client if it is not registered yet. The client is
+        also restarted if its SSL certificate changed, since it only reads it on start.
+        """
         self.unit.status = MaintenanceStatus("Configuring landscape client..")
-        self.set_client_config()
-        if self.is_registered():
-            process_helper(["systemctl", "restart", "landscape-client"])
-            self.unit.status = ActiveStatus("Client config updated!")
+        plan = plan_config_change(
+            self.read_client_config(), redact_client_config(client_config)
+        )
+        log_info(f"Configuration change needs {plan.action}: {list(plan.changes)}")
+
+        written = False
+        if plan.action > ChangeAction.NOOP:
+            written = self.set_client_config(client_config)
+
+        if plan.action is ChangeAction.REREGISTER or not self.is_registered():
+            self.request_registration(force=plan.action is ChangeAction.REREGISTER)
+            return
+
+        restart = plan.action is ChangeAction.RESTART and written
+        if plan.action is ChangeAction.RESTART and not written:
+            log_info("client.conf already up to date, not restarting")
+        if restart or certificate_changed:
+            if self.acquire_rolling_token("restart"):
+                try:
+                    self.restart_client()
+                finally:
+                    self.release_rolling_token()
+            return
+        self.unit.status = ActiveStatus("Client config updated!")
+
+    def restart_client(self):
+        process_helper(["systemctl", "restart", "landscape-client"])
+        self.unit.status = ActiveStatus("Client config updated!")
+
+    def get_rolling_requests(self, relation) -> dict:
+        """Return when each unit requested a rolling token, by unit name."""
+        requests = {}
+        for unit in (self.unit, *relation.units):
+            requested = relation.data[unit].get(REQUESTED_KEY)
+            if requested:
+                requests[unit.name] = float(requested)
+        return requests
+
+    def get_rolling_holders(self, relation) -> list:
+        """Return the units the leader granted a rolling token to."""
+        return json.loads(relation.data[self.app].get(GRANTED_KEY, "[]"))
+
+    def acquire_rolling_token(self, operation: str, **params) -> bool:
+        """
+        Return whether `operation` can run now, in which case the caller releases
+        the token once done. With `rolling-max-concurrent` set, this unit must hold
+        a rolling token: otherwise, `operation` is queued with `params` and run once
+        the leader grants one.
+        """
+        relation = self.model.get_relation(PEER_RELATION)
+        if relation is None or not self.config.get("rolling-max-concurrent"):
+            return True
+
+        if not relation.data[self.unit].get(REQUESTED_KEY):
+            relation.data[self.unit][REQUESTED_KEY] = str(time.time())
+            self.grant_rolling_tokens()
+        if self.unit.name in self.get_rolling_holders(relation):
+            return True
+
+        self._stored.rolling_pending[operation] = params
+        log_info(f"Queued {operation} until this unit is granted a rolling token")
+        self.update_rolling_status()
+        return False
+
+    def release_rolling_token(self):
+        """Release the rolling token of this unit, once its queued operations ran."""
+        relation = self.model.get_relation(PEER_RELATION)
+        if relation is None or not relation.data[self.unit].get(REQUESTED_KEY):
+            return
+        if self._stored.rolling_pending:
+            # Releases the token once done.
+            self.run_rolling_operations()
+            return
+        del relation.data[self.unit][REQUESTED_KEY]
+        self.grant_rolling_tokens()
+
+    def grant_rolling_tokens(self):
+        """
+        As the leader, hand out free rolling tokens to the oldest requests. Requests
+        left from before `rolling-max-concurrent` was unset are all granted.
+
+        The application status is only set while tokens are requested or held, since
+        Juju no longer derives it from the units once the leader sets it.
+        """
+        relation = self.model.get_relation(PEER_RELATION)
+        if relation is None or not self.unit.is_leader():
+            return
+
+        requests = self.get_rolling_requests(relation)
+        holders = self.get_rolling_holders(relation)
+        if not requests and not holders:
+            return
+
+        limit = self.config.get("rolling-max-concurrent") or len(requests)
+        granted = grant_tokens(requests, holders, limit)
+        if granted != holders:
+            relation.data[self.app][GRANTED_KEY] = json.dumps(granted)
+        if requests:
+            queued = len(requests) - len(granted)
+            self.app.status = MaintenanceStatus(
+                f"Rolling upgrades and restarts: {len(granted)} running, {queued} queued"
+            )
         else:
-            self.send_registration()
+            # The queue just emptied.
+            self.app.status = ActiveStatus()
+
+    def run_rolling_operations(self):
+        """Run the queued operations once this unit holds a rolling token."""
+        relation = self.model.get_relation(PEER_RELATION)
+        if relation is None or not self._stored.rolling_pending:
+            return
+        if self.unit.name not in self.get_rolling_holders(relation):
+            return
+
+        pending = {
+            operation: dict(params)
+            for operation, params in self._stored.rolling_pending.items()
+        }
+        self._stored.rolling_pending = {}
+        try:
+            if "upgrade" in pending:
+                results = self.upgrade_client(pending["upgrade"].get("max-age"))
+                log_info(f"Rolling upgrade done: {results}")
+            if "restart" in pending:
+                self.restart_client()
+        except Exception as exc:
+            log_error(traceback.format_exc())
+            self.unit.status = BlockedStatus(str(exc))
+        finally:
+            self.release_rolling_token()
+
+    def update_rolling_status(self):
+        """Show the position of this unit in the rolling queue, while it waits."""
+        relation = self.model.get_relation(PEER_RELATION)
+        pending = sorted(self._stored.rolling_pending)
+        if relation is None or not pending:
+            return
+        requests = self.get_rolling_requests(relation)
+        granted = self.get_rolling_holders(relation)
+        if self.unit.name in requests and self.unit.name not in granted:
+            position = queue_position(requests, granted, self.unit.name)
+            self.unit.status = WaitingStatus(
+                f"Queued for {' and '.join(pending)}, {position} units ahead"
+            )
+
+    def _on_rolling_changed(self, _):
+        self.grant_rolling_tokens()
+        self.run_rolling_operations()
+        self.update_rolling_status()
 
     def _on_install(self, _):
         try:
-            self.add_ppa()
+            self.apply_apt_proxy()
+            if not self.add_ppa():
+                self.refresh_ppa_indexes()
             self.install_landscape_client()
         except ClientCharmError as exc:
             self.unit.status = BlockedStatus(str(exc))
 
     def _on_config_changed(self, _):
+        self.grant_rolling_tokens()
+        self.update_registration_window()
+        try:
+            set_profile_mode(self.config.get("profile-hooks"))
+            tracing.set_endpoint(self.config.get("tracing-endpoint"))
+            set_debug_output(self.config.get("debug-output"))
+        except OSError:
+            log_error(traceback.format_exc())
+
+        try:
+            client_config = self.get_client_config()
+        except ClientCharmError as exc:
+            self._stored.config_digest = None
+            self.unit.status = BlockedStatus(str(exc))
+            return
+
+        config_digest = get_config_digest(self.config, client_config)
+        certificate_digest = self.get_certificate_digest(client_config)
+        certificate_changed = certificate_digest != self._stored.certificate_digest
+        if (
+            config_digest == self._stored.config_digest
+            and not certificate_changed
+            and self.config_applied(client_config)
+        ):
+            log_info("Configuration unchanged, nothing to do.")
+            return
+        self._stored.config_digest = None
+
         if self.config.get("disable-unattended-upgrades"):
-            log_info("Disabling unattended-upgrades via APT config...")
-            with open(APT_CONF_OVERRIDE, "w") as override_fp:
-                override_fp.write('APT::Periodic::Unattended-Upgrade "0";')
+            if not self.apt_conf_override_applied():
+                log_info("Disabling unattended-upgrades via APT config...")
+                write_file_if_changed(APT_CONF_OVERRIDE, APT_CONF_OVERRIDE_CONTENT)
         elif os.path.exists(APT_CONF_OVERRIDE):
             log_info("Enabling unattended-upgrades via APT config...")
             os.remove(APT_CONF_OVERRIDE)
 
-        try:
-            apt.DebianPackage.from_installed_package(CLIENT_PACKAGE)
-        except apt.PackageNotFoundError:
+        if not self.installed_client_version():
             log_error("Landscape client package not installed.")
             return
         try:
+            self.apply_apt_proxy()
             self.add_ppa()
-            self.run_landscape_client()
+            self.run_landscape_client(
+                client_config, certificate_changed=certificate_changed
+            )
         except ClientCharmError as exc:
             self.unit.status = BlockedStatus(str(exc))
+            return
+
+        self._stored.config_digest = config_digest
+        self._stored.certificate_digest = certificate_digest
+
+    def _on_update_status(self, event):
+        if self._stored.registration_due is not None:
+            self.request_registration()
+
+        self.check_packages(event)
+
+    @phase("check-packages")
+    def check_packages(self, event):
+        """
+        Notice client packages changed out-of-band, e.g. by unattended-upgrades, and
+        verify the configuration is still applied if they did.
+        """
+        stamp = get_file_stamp(DPKG_STATUS_FILE)
+        if stamp is not None and stamp == self._stored.packages_stamp:
+            return
+
+        snapshot = apt.PackageSnapshot.take(WATCHED_PACKAGES)
+        previous = self._stored.packages
+        self._stored.packages = snapshot.to_dict()
+        self._stored.packages_stamp = stamp
+        if not previous:
+            return
+
+        diff = apt.PackageSnapshot.from_dict(previous).diff(snapshot)
+        if not diff:
+            return
+
+        log_info(f"Client packages changed: {sorted(diff.names())}")
+        self._stored.config_digest = None
+        self._on_config_changed(event)
 
     def _on_relation_departed(self, _):
         """Disable landscape client when relation is broken"""
         self.unit.status = MaintenanceStatus("Disabling landscape client..")
+        self._stored.config_digest = None
         process_helper([CLIENT_CONFIG_CMD, "--silent", "--disable"])
 
+    @phase("upgrade")
+    def upgrade_client(self, max_age: Optional[int] = None, event=None) -> dict:
+        """
+        Upgrade the client if a newer version is available, and return the
+        versions before and after, and the time it took.
+        """
+        started = time.monotonic()
+        if not self.add_ppa() and not self.refresh_ppa_indexes(max_age):
+            apt.update(max_age=max_age)
+
+        previous = self.installed_client_version()
+        pkg = apt.DebianPackage.from_apt_cache(CLIENT_PACKAGE)
+        candidate = str(pkg.version)
+        # The candidate is never "installed", so `ensure` would always reinstall it
+        # and restart the client.
+        installed = previous and apt.Version.from_string(previous)
+        cache_status = None
+        if installed and installed >= apt.Version.from_string(candidate):
+            log_info(f"Already at {previous}, nothing to upgrade", event=event)
+            current = previous
+        else:
+            log_info("Upgrading landscape client..", event=event)
+            cache_status = self.probe_package_cache()
+            pkg.ensure(state=apt.PackageState.Latest)
+            self.facts.invalidate("client-version")
+            current = self.installed_client_version()
+            log_info("Upgraded to {}...".format(current), event=event)
+        results = {
+            "previous-version": previous or "",
+            "candidate-version": candidate,
+            "installed-version": current or "",
+            "upgraded": current != previous,
+            "duration": f"{time.monotonic() - started:.1f}s",
+        }
+        if cache_status:
+            results["cache-status"] = cache_status
+        return results
+
     def _upgrade(self, event):
         if isinstance(self.unit.status, MaintenanceStatus):
             log_error("Please wait until charm is ready before upgrading.", event=event)
             return
 
-        self.add_ppa()
-        apt.update()
+        max_age = event.params.get("max-age")
+        if not self.acquire_rolling_token("upgrade", **{"max-age": max_age}):
+            log_info("Queued until a rolling upgrade slot is free", event=event)
+            event.set_results({"queued": True})
+            return
 
         try:
-            log_info("Upgrading landscape client..", event=event)
-            pkg = apt.DebianPackage.from_apt_cache(CLIENT_PACKAGE)
-            pkg.ensure(state=apt.PackageState.Latest)
-            installed = apt.DebianPackage.from_installed_package(CLIENT_PACKAGE)
-            log_info("Upgraded to {}...".format(installed.version), event=event)
+            event.set_results(self.upgrade_client(max_age, event=event))
         except Exception as exc:
             log_error("Could not upgrade landscape client!", event=event)
             log_error(traceback.format_exc(), event=event)
             self.unit.status = BlockedStatus(str(exc))
+        finally:
+            self.release_rolling_token()
 
     def _register(self, event):
         if isinstance(self.unit.status, MaintenanceStatus):
@@ -356,6 +1074,9 @@ class LandscapeClientCharm(CharmBase):
 
         try:
             log_info("Registering landscape client..", event=event)
+            self._stored.registration_due = None
+            self._stored.registration_attempts = 0
+            self._stored.registration_forced = False
             self.send_registration()
             log_info("Registration successful!", event=event)
         except Exception as exc:
@@ -363,6 +1084,65 @@ class LandscapeClientCharm(CharmBase):
             log_error(traceback.format_exc(), event=event)
             self.unit.status = BlockedStatus(str(exc))
 
+    def _plan_config(self, event):
+        """Report what applying the current configuration would do, without doing it."""
+        try:
+            client_config = self.get_client_config()
+        except ClientCharmError as exc:
+            log_error(str(exc), event=event)
+            return
+
+        plan = plan_config_change(
+            self.read_client_config(), redact_client_config(client_config)
+        )
+        log_info(f"Configuration change needs {plan.action}", event=event)
+        event.set_results({"action": str(plan.action), "changes": plan.describe()})
+
+    def _on_pre_commit(self, _):
+        self.hook_stats.save(get_hook_name())
+
+    def _hook_stats(self, event):
+        """Report the durations of hooks, their phases and the commands they spawn."""
+        event.set_results(
+            {
+                "stats": "\n".join(
+                    f"{k}: {v}" for k, v in self.hook_stats.summary().items()
+                )
+            }
+        )
+
+    def _fetch_profile(self, event):
+        """Report the top entries of the latest saved profile of a hook."""
+        profiles = list_profiles(event.params.get("hook"))
+        if not profiles:
+            event.fail("No profile saved. Set profile-hooks to profile hooks.")
+            return
+
+        results = {
+            "profile": profiles[0],
+            "stats": format_profile(profiles[0], event.params.get("limit", 25)),
+        }
+        memory = read_memory_profile(profiles[0])
+        if memory:
+            results["memory"] = memory
+        event.set_results(results)
+
+    def _fact_stats(self, event):
+        """Report how often each cached system fact was reused or recomputed."""
+        stats = self.facts.stats()
+        event.set_results(
+            {
+                "facts": "\n".join(
+                    f"{name}: hits={counts['hits']} misses={counts['misses']}"
+                    for name, counts in sorted(stats.items())
+                )
+            }
+        )
+
 
 if __name__ == "__main__":
-    main(LandscapeClientCharm)
+    # Traces are exported from here rather than on pre-commit, which ops skips when
+    # a handler raises.
+    hook = get_hook_name()
+    with tracing.trace_dispatch(hook, **{"juju.hook": hook}):
+        run_profiled(lambda: main(LandscapeClientCharm), hook)
@@ -0,0 +1,135 @@
+# See LICENSE file for licensing details.
+
+"""
+Read Landscape client's persisted state in-process, instead of spawning
+`landscape-config`.
+
+The client broker persists its state in `<data-path>/broker.bpickle`. Depending on
+the client version, this file is either a Python pickle or a `bpickle` stream. Both
+only ever contain plain containers, strings and numbers, so neither needs to import
+anything from landscape-client to be read.
+"""
+
+import codecs
+import io
+import os
+import pickle
+from typing import Any, Optional, Tuple
+
+DEFAULT_DATA_PATH = "/var/lib/landscape/client/"
+BROKER_PERSIST_FILENAME = "broker.bpickle"
+
+
+class UnknownStateFormat(Exception):
+    pass
+
+
+class _PlainUnpickler(pickle.Unpickler):
+    """Unpickler that refuses to load anything but built-in containers and scalars."""
+
+    # Protocol 2 pickles encode bytes through `_codecs.encode`.
+    SAFE_CLASSES = {("_codecs", "encode"): codecs.encode}
+
+    def find_class(self, module, name):
+        if (module, name) in self.SAFE_CLASSES:
+            return self.SAFE_CLASSES[(module, name)]
+        raise UnknownStateFormat(f"Unexpected class in client state: {module}.{name}")
+
+
+def _loads_bpickle(data: bytes, pos: int) -> Tuple[Any, int]:
+    """Decode the `bpickle` value starting at `pos`, returning it and its end."""
+    code = data[pos : pos + 1]
+
+    if code == b"n":
+        return None, pos + 1
+    if code == b"b":
+        return data[pos + 1 : pos + 2] == b"1", pos + 2
+    if code in (b"i", b"f"):
+        end = data.index(b";", pos)
+        raw = data[pos + 1 : end]
+        return (int(raw) if code == b"i" else float(raw)), end + 1
+    if code in (b"s", b"u"):
+        start = data.index(b":", pos) + 1
+        end = start + int(data[pos + 1 : start - 1])
+        raw = data[start:end]
+        return (raw.decode("utf-8") if code == b"u" else raw), end
+    if code in (b"l", b"t", b"d"):
+        items = []
+        pos += 1
+        while data[pos : pos + 1] != b";":
+            item, pos = _loads_bpickle(data, pos)
+            items.append(item)
+        if code == b"d":
+            return dict(zip(items[::2], items[1::2])), pos + 1
+        return (items if code == b"l" else tuple(items)), pos + 1
+
+    raise UnknownStateFormat(f"Unknown bpickle type code {code!r} at {pos}")
+
+
+def load_persist(data: bytes) -> dict:
+    """
+    Decode the contents of a client persist file.
+
+    Raise `UnknownStateFormat` if `data` is not a pickle or bpickle dictionary.
+    """
+    try:
+        if data.startswith(b"\x80"):
+            persist = _PlainUnpickler(io.BytesIO(data)).load()
+        elif data.startswith(b"d"):
+            persist, end = _loads_bpickle(data, 0)
+            if end != len(data):
+                raise UnknownStateFormat("Trailing data after client state")
+        else:
+            raise UnknownStateFormat("Client state is neither pickle nor bpickle")
+    except (ValueError, IndexError, EOFError, pickle.UnpicklingError) as e:
+        raise UnknownStateFormat(f"Corrupt client state: {e}") from e
+
+    if not isinstance(persist, dict):
+        raise UnknownStateFormat("Client state is not a dictionary")
+    return persist
+
+
+def _get(mapping: Any, key: str) -> Any:
+    """Get `key` from a persisted dictionary, whose keys may be str or bytes."""
+    if not isinstance(mapping, dict):
+        return None
+    if key in mapping:
+        return mapping[key]
+    return mapping.get(key.encode())
+
+
+_registration_cache: dict[str, Tuple[Tuple[int, int], bool]] = {}
+"""Registration state per persist file, keyed on the file's mtime and size."""
+
+
+def read_registration_state(data_path: Optional[str] = None) -> Optional[bool]:
+    """
+    Return whether the client persisted under `data_path` is registered, i.e. has a
+    secure ID, like `landscape-config --is-registered` does.
+
+    Return None if the persisted state cannot be read or its format isn't recognised,
+    in which case the caller should ask `landscape-config` instead.
+    """
+    filename = os.path.join(data_path or DEFAULT_DATA_PATH, BROKER_PERSIST_FILENAME)
+
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return False
+    except OSError:
+        return None
+
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cached = _registration_cache.get(filename)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    try:
+        with open(filename, "rb") as persist_file:
+            persist = load_persist(persist_file.read())
+    except (OSError, UnknownStateFormat):
+        return None
+
+    registered = bool(_get(_get(persist, "registration"), "secure-id"))
+    _registration_cache[filename] = (stamp, registered)
+    return registered
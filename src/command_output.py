@@ -0,0 +1,124 @@
+# See LICENSE file for licensing details.
+
+"""
+Capture the output of commands in bounded memory: its head and tail, and how much
+was dropped in between, so that large outputs don't flood the unit's logs.
+
+The full output can be kept in a rotating file for debugging, by the `debug-output`
+option, which the charm mirrors to a marker file.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Optional, Sequence
+
+from files import write_file_if_changed
+
+STATE_DIR = "/var/lib/landscape-client-charm"
+DEBUG_MARKER = os.path.join(STATE_DIR, "debug-output")
+LOG_DIR = "/var/log/landscape-client-charm"
+LOG_MAX_BYTES = 10 * 2**20
+"""Size past which the output log is rotated, keeping one previous file."""
+
+HEAD_BYTES = 4096
+TAIL_BYTES = 4096
+CHUNK_BYTES = 65536
+
+
+class OutputCapture:
+    """
+    Keep the first `head_bytes` and last `tail_bytes` of an output fed in chunks,
+    and whether `marker` appeared anywhere in it, also across chunks.
+    """
+
+    def __init__(
+        self,
+        marker: bytes = b"",
+        head_bytes: int = HEAD_BYTES,
+        tail_bytes: int = TAIL_BYTES,
+        mirror: Optional[BinaryIO] = None,
+    ):
+        self.marker = marker
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.mirror = mirror
+        self.total = 0
+        self.found = False
+        self._head = b""
+        self._tail = b""
+        self._carry = b""
+
+    def feed(self, chunk: bytes):
+        if self.mirror is not None:
+            self.mirror.write(chunk)
+        if self.marker and not self.found:
+            # Also look at the end of the previous chunk, for markers split in two.
+            searched = self._carry + chunk
+            self.found = self.marker in searched
+            self._carry = searched[max(0, len(searched) - len(self.marker) + 1) :]
+
+        self.total += len(chunk)
+        room = self.head_bytes - len(self._head)
+        if room > 0:
+            self._head += chunk[:room]
+            chunk = chunk[room:]
+        if chunk:
+            self._tail = (self._tail + chunk)[-self.tail_bytes :]
+
+    @property
+    def dropped(self) -> int:
+        return self.total - len(self._head) - len(self._tail)
+
+    def text(self) -> str:
+        head = self._head.decode(errors="replace")
+        tail = self._tail.decode(errors="replace")
+        if self.dropped:
+            return f"{head}\n[... {self.dropped} of {self.total} bytes dropped ...]\n{tail}"
+        return head + tail
+
+
+def get_debug_output() -> bool:
+    return os.path.exists(DEBUG_MARKER)
+
+
+def set_debug_output(enabled: bool):
+    """Keep the full output of the following commands in the output log, or stop."""
+    if not enabled:
+        if os.path.exists(DEBUG_MARKER):
+            os.remove(DEBUG_MARKER)
+        return
+
+    os.makedirs(STATE_DIR, exist_ok=True)
+    write_file_if_changed(DEBUG_MARKER, "")
+
+
+def get_output_log() -> str:
+    """Return the output log of this unit, e.g. `commands-landscape-client-0.log`."""
+    unit = os.environ.get("JUJU_UNIT_NAME", "unknown").replace("/", "-")
+    return os.path.join(LOG_DIR, f"commands-{unit}.log")
+
+
+@contextmanager
+def open_output_log(command: Sequence[str]) -> Iterator[Optional[BinaryIO]]:
+    """
+    Yield the output log, headed for `command`, if debug output is on, or None.
+    The log is rotated once it grows past `LOG_MAX_BYTES`.
+    """
+    if not get_debug_output():
+        yield None
+        return
+
+    path = get_output_log()
+    os.makedirs(LOG_DIR, exist_ok=True)
+    try:
+        if os.path.getsize(path) > LOG_MAX_BYTES:
+            os.replace(path, path + ".1")
+    except OSError:
+        pass
+
+    with open(path, "ab") as log:
+        started = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        log.write(f"=== {started} {' '.join(map(str, command))}\n".encode())
+        yield log
+        log.write(b"\n")
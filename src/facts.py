@@ -0,0 +1,110 @@
+# See LICENSE file for licensing details.
+
+"""
+Cache facts about the system, within a dispatch and across dispatches.
+"""
+
+import hashlib
+import logging
+import os
+from collections.abc import Mapping, MutableMapping, MutableSequence
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def get_file_stamp(filename: str) -> Optional[list]:
+    """Return the mtime and size of `filename`, or None if it does not exist."""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _plain(value: Any) -> Any:
+    """Copy a value read from stored state into plain dicts and lists."""
+    if isinstance(value, Mapping):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, MutableSequence):
+        return [_plain(item) for item in value]
+    return value
+
+
+class FactCache:
+    """
+    Facts are computed on a miss and then reused until their invalidation source
+    changes. The source is either a file, whose mtime and size are compared, or None
+    for facts that the charm invalidates explicitly after changing them.
+
+    Facts with a file source are kept in `store`, the charm's stored state, so they
+    are reused across dispatches. Facts without one only live for the current
+    dispatch. Values must be simple types that stored state can hold, and must not
+    be secrets, since stored state is kept in plain text.
+
+    Hits and misses are counted per fact in `stats`, across dispatches.
+    """
+
+    def __init__(self, store: MutableMapping, stats: MutableMapping):
+        self._store = store
+        self._stats = stats
+        self._dispatch_facts = {}
+
+    def get(
+        self,
+        name: str,
+        compute: Callable[[], Any],
+        source: Optional[str] = None,
+    ) -> Any:
+        stamp = get_file_stamp(source) if source else None
+
+        entry = self._dispatch_facts.get(name)
+        if entry is None and name in self._store:
+            entry = _plain(self._store[name])
+
+        if (
+            entry is not None
+            and entry["source"] == source
+            and (source is None or entry["stamp"] == stamp)
+        ):
+            self._count(name, "hits")
+            return entry["value"]
+
+        self._count(name, "misses")
+        entry = {"source": source, "stamp": stamp, "value": compute()}
+        self._dispatch_facts[name] = entry
+        if source:
+            self._store[name] = entry
+        elif name in self._store:
+            del self._store[name]
+
+        return entry["value"]
+
+    def invalidate(self, name: str):
+        """Forget a fact, after the charm changed what it describes."""
+        self._dispatch_facts.pop(name, None)
+        if name in self._store:
+            del self._store[name]
+
+    def file_digest(self, filename: str) -> Optional[str]:
+        """Return the SHA-256 digest of `filename`, or None if it can't be read."""
+        if get_file_stamp(filename) is None:
+            return None
+
+        def compute():
+            try:
+                with open(filename, "rb") as digest_file:
+                    return hashlib.sha256(digest_file.read()).hexdigest()
+            except OSError:
+                return None
+
+        return self.get(f"digest:{filename}", compute, source=filename)
+
+    def _count(self, name: str, counter: str):
+        counts = _plain(self._stats.get(name)) or {"hits": 0, "misses": 0}
+        counts[counter] += 1
+        self._stats[name] = counts
+
+    def stats(self) -> dict:
+        """Return the hit and miss counts of each fact."""
+        return _plain(self._stats)
@@ -0,0 +1,68 @@
+# See LICENSE file for licensing details.
+
+"""
+Write the files the charm owns atomically, and only when their content changes, so
+that callers know whether a service needs a restart or indexes a refresh.
+"""
+
+import hashlib
+import os
+import tempfile
+from typing import Optional, Union
+
+
+def _file_digest(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def write_file_if_changed(
+    path: str, content: Union[str, bytes], mode: int = 0o644
+) -> bool:
+    """
+    Write `content`, encoded as UTF-8 if it is a string, to `path` unless the file
+    already holds it, and return whether the file changed.
+
+    The content goes to a temporary file next to `path`, which is synced to disk and
+    then renamed over `path`, so that `path` is never seen truncated, even if the hook
+    is killed. An existing file keeps its mode and owner; a new one gets `mode`.
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    if _file_digest(path) == hashlib.sha256(content).hexdigest():
+        return False
+
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        stat = None
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if stat is None:
+            os.chmod(tmp_path, mode)
+        else:
+            os.chmod(tmp_path, stat.st_mode & 0o7777)
+            try:
+                os.chown(tmp_path, stat.st_uid, stat.st_gid)
+            except PermissionError:
+                pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    return True
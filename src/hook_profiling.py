@@ -0,0 +1,136 @@
+# See LICENSE file for licensing details.
+
+"""
+Profile hook dispatches on demand, with `cProfile` and optionally `tracemalloc`.
+
+Profiling is switched on for a unit by the `profile-hooks` option, which the charm
+mirrors to a marker file so that it can be checked before the framework starts,
+or for a single dispatch by the `LANDSCAPE_CHARM_PROFILE` environment variable.
+"""
+
+import glob
+import io
+import logging
+import os
+import time
+from typing import Callable, List, Optional
+
+from files import write_file_if_changed
+from lazy_import import lazy_import
+
+cProfile = lazy_import("cProfile")
+pstats = lazy_import("pstats")
+tracemalloc = lazy_import("tracemalloc")
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = "/var/lib/landscape-client-charm/profiles"
+PROFILE_MARKER = "enabled"
+PROFILE_ENV = "LANDSCAPE_CHARM_PROFILE"
+PROFILE_MODES = ("cpu", "memory")
+"""`cpu` profiles with `cProfile`; `memory` also takes a `tracemalloc` snapshot."""
+
+PROFILE_RETENTION = 20
+"""Number of profiles kept; older ones are removed."""
+
+MEMORY_TOP_N = 25
+
+
+def get_profile_mode() -> Optional[str]:
+    """Return the profiling mode of this dispatch, or None if it isn't profiled."""
+    mode = os.environ.get(PROFILE_ENV)
+    if mode is None:
+        try:
+            with open(os.path.join(PROFILE_DIR, PROFILE_MARKER)) as marker:
+                mode = marker.read().strip()
+        except OSError:
+            return None
+
+    return mode if mode in PROFILE_MODES else None
+
+
+def set_profile_mode(mode: Optional[str]):
+    """
+    Profile the following dispatches in `mode`, or stop profiling them. The marker
+    is only written when the mode changes.
+    """
+    marker = os.path.join(PROFILE_DIR, PROFILE_MARKER)
+    if mode not in PROFILE_MODES:
+        if os.path.exists(marker):
+            os.remove(marker)
+        return
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    write_file_if_changed(marker, mode)
+
+
+def list_profiles(hook: Optional[str] = None) -> List[str]:
+    """Return the saved profiles, optionally of `hook` only, newest first."""
+    profiles = sorted(glob.glob(os.path.join(PROFILE_DIR, "*.pstats")), reverse=True)
+    if hook:
+        profiles = [p for p in profiles if p.endswith(f"-{hook}.pstats")]
+    return profiles
+
+
+def _prune_profiles():
+    for profile in list_profiles()[PROFILE_RETENTION:]:
+        for filename in (profile, profile[: -len(".pstats")] + ".memory.txt"):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+
+def run_profiled(dispatch: Callable[[], None], hook: str):
+    """Run `dispatch`, profiling it if profiling is switched on."""
+    mode = get_profile_mode()
+    if mode is None:
+        dispatch()
+        return
+
+    if mode == "memory":
+        tracemalloc.start()
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        dispatch()
+    finally:
+        profile.disable()
+        try:
+            save_profile(profile, hook, mode)
+        except OSError:
+            logger.exception("Could not save the profile of this dispatch")
+        if mode == "memory":
+            tracemalloc.stop()
+
+
+def save_profile(profile, hook: str, mode: str) -> str:
+    """Write `profile` under `PROFILE_DIR` and return its path."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{time.time_ns()}-{hook}"
+    path = os.path.join(PROFILE_DIR, f"{name}.pstats")
+    profile.dump_stats(path)
+
+    if mode == "memory":
+        snapshot = tracemalloc.take_snapshot()
+        with open(os.path.join(PROFILE_DIR, f"{name}.memory.txt"), "w") as memory:
+            for stat in snapshot.statistics("lineno")[:MEMORY_TOP_N]:
+                memory.write(f"{stat}\n")
+
+    _prune_profiles()
+    return path
+
+
+def format_profile(path: str, limit: int) -> str:
+    """Return the top `limit` entries of the profile at `path`, by cumulative time."""
+    stream = io.StringIO()
+    stats = pstats.Stats(path, stream=stream)
+    stats.sort_stats("cumulative").print_stats(limit)
+    return stream.getvalue().strip()
+
+
+def read_memory_profile(path: str) -> Optional[str]:
+    """Return the `tracemalloc` top allocations saved with the profile at `path`."""
+    try:
+        with open(path[: -len(".pstats")] + ".memory.txt") as memory:
+            return memory.read().strip()
+    except OSError:
+        return None
@@ -0,0 +1,135 @@
+# See LICENSE file for licensing details.
+
+"""
+Time hooks, the phases of their handlers and the commands they spawn, and keep
+bounded histograms of the timings across dispatches.
+
+Timings of the current dispatch are collected in this module, so that code with no
+access to the charm, like the apt library's command observer, can record them. They
+are folded into the histograms kept in stored state at the end of the dispatch.
+"""
+
+import math
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, List, MutableMapping, Optional, Sequence, Tuple
+
+import tracing
+
+STARTED = time.monotonic()
+"""When this dispatch started, or close enough: the charm imports this module early."""
+
+BUCKETS = 20
+"""Bucket `i` counts durations up to 2**i milliseconds; the last one, longer ones."""
+
+_phases: List[Tuple[str, float]] = []
+_commands: List[Tuple[str, float]] = []
+
+
+def _bucket(milliseconds: float) -> int:
+    if milliseconds <= 1:
+        return 0
+    return min(BUCKETS - 1, math.ceil(math.log2(milliseconds)))
+
+
+@contextmanager
+def phase(name: str):
+    """
+    Time a phase of the current dispatch, and trace it as a span. Also usable as a
+    decorator.
+    """
+    start = time.monotonic()
+    try:
+        with tracing.span(name):
+            yield
+    finally:
+        _phases.append((name, time.monotonic() - start))
+
+
+def observe_command(
+    command: Sequence[str],
+    seconds: float,
+    returncode: Optional[int] = None,
+    output_bytes: Optional[int] = None,
+):
+    """Record a command spawned by the current dispatch, and trace it as a span."""
+    name = os.path.basename(command[0]) if command else ""
+    _commands.append((name, seconds))
+    tracing.record_span(
+        f"exec {name}",
+        seconds,
+        error=isinstance(returncode, int) and returncode != 0,
+        **{
+            "process.command_line": " ".join(map(str, command)),
+            "process.exit_code": returncode if isinstance(returncode, int) else None,
+            "process.output_bytes": output_bytes,
+        },
+    )
+
+
+def get_hook_name() -> str:
+    """Return the name of the dispatched hook or action, e.g. `update-status`."""
+    return os.path.basename(os.environ.get("JUJU_DISPATCH_PATH", "")) or "unknown"
+
+
+def _percentile(histogram: dict, fraction: float) -> float:
+    """Return the upper bound of the bucket holding the `fraction` percentile."""
+    wanted = fraction * histogram["count"]
+    seen = 0
+    for bucket, count in enumerate(histogram["buckets"]):
+        seen += count
+        if count and seen >= wanted:
+            return min(float(2**bucket), histogram["max"])
+    return histogram["max"]
+
+
+class HookStats:
+    """
+    Histograms of hook, phase and command durations, kept in `store`, the charm's
+    stored state, by `hook:<name>`, `phase:<name>` and `command:<name>` keys.
+    """
+
+    def __init__(self, store: MutableMapping):
+        self._store = store
+
+    def record(self, key: str, seconds: float, spawns: int = 0):
+        milliseconds = seconds * 1000
+        histogram = self._store.get(key) or {
+            "count": 0,
+            "spawns": 0,
+            "max": 0.0,
+            "buckets": [0] * BUCKETS,
+        }
+        buckets = list(histogram["buckets"])
+        buckets[_bucket(milliseconds)] += 1
+        self._store[key] = {
+            "count": histogram["count"] + 1,
+            "spawns": histogram["spawns"] + spawns,
+            "max": max(histogram["max"], round(milliseconds, 3)),
+            "buckets": buckets,
+        }
+
+    def save(self, hook: str):
+        """Fold the timings of the current dispatch, of `hook`, into the histograms."""
+        for name, seconds in _phases:
+            self.record(f"phase:{name}", seconds)
+        for name, seconds in _commands:
+            self.record(f"command:{name}", seconds, spawns=1)
+        self.record(f"hook:{hook}", time.monotonic() - STARTED, spawns=len(_commands))
+        _phases.clear()
+        _commands.clear()
+
+    def summary(self) -> Dict[str, str]:
+        """Return p50, p95 and max milliseconds and spawn counts, by key."""
+        summary = {}
+        for key in sorted(self._store):
+            histogram = self._store[key]
+            summary[key] = (
+                f"count={histogram['count']} "
+                f"p50={_percentile(histogram, 0.5):g}ms "
+                f"p95={_percentile(histogram, 0.95):g}ms "
+                f"max={histogram['max']:g}ms "
+                f"spawns={histogram['spawns']}"
+            )
+        return summary
@@ -0,0 +1,70 @@
+# See LICENSE file for licensing details.
+
+"""
+Import modules on first attribute access, so hooks that don't use them don't pay
+for loading them.
+"""
+
+import importlib.abc
+import importlib.machinery
+import importlib.util
+import sys
+from types import ModuleType
+from typing import Callable, Dict, Optional
+
+_lazy_specs: Dict[str, importlib.machinery.ModuleSpec] = {}
+"""Specs of the modules imported lazily, by name, to find those not loaded yet."""
+
+
+class _OnLoadLoader(importlib.abc.Loader):
+    """Loader that calls back once the module it wraps has been executed."""
+
+    def __init__(self, loader, on_load: Callable[[ModuleType], None]):
+        self.loader = loader
+        self.on_load = on_load
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.loader.exec_module(module)
+        self.on_load(module)
+
+
+def lazy_import(
+    name: str, on_load: Optional[Callable[[ModuleType], None]] = None
+) -> ModuleType:
+    """
+    Return module `name`, deferring its execution until one of its attributes is
+    first used. Modules that are already imported are returned as they are.
+
+    `on_load` is called with the module once it is executed, e.g. to register hooks
+    with it, so that doing so doesn't load it. That holds for a module that another
+    caller imported lazily too, as long as it isn't loaded yet.
+    """
+    if name in sys.modules:
+        module = sys.modules[name]
+        if on_load:
+            # `type()` doesn't trigger the load: the module only becomes a plain
+            # module once it is loaded.
+            if name in _lazy_specs and type(module) is not ModuleType:
+                spec = _lazy_specs[name]
+                spec.loader = _OnLoadLoader(spec.loader, on_load)
+            else:
+                on_load(module)
+        return module
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+
+    if on_load:
+        spec.loader = _OnLoadLoader(spec.loader, on_load)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    # The lazy loader points the spec back at the wrapped loader, which runs on load.
+    _lazy_specs[name] = spec
+    return module
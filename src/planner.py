@@ -0,0 +1,102 @@
+# See LICENSE file for licensing details.
+
+"""
+Plan the cheapest action that applies a change to the Landscape client configuration.
+"""
+
+from enum import IntEnum
+from typing import Any, Dict, Mapping, NamedTuple, Optional, Tuple
+
+
+class ChangeAction(IntEnum):
+    """Actions needed to apply a configuration change, from cheapest to costliest."""
+
+    NOOP = 0
+    FILE_ONLY = 1
+    RESTART = 2
+    REREGISTER = 3
+
+    def __str__(self):
+        return {
+            ChangeAction.NOOP: "no-op",
+            ChangeAction.FILE_ONLY: "file-only",
+            ChangeAction.RESTART: "restart",
+            ChangeAction.REREGISTER: "re-register",
+        }[self]
+
+
+KEY_ACTIONS = {
+    "account_name": ChangeAction.REREGISTER,
+    "computer_title": ChangeAction.RESTART,
+    "data_path": ChangeAction.REREGISTER,
+    "exchange_interval": ChangeAction.RESTART,
+    "http_proxy": ChangeAction.RESTART,
+    "https_proxy": ChangeAction.RESTART,
+    "include_manager_plugins": ChangeAction.RESTART,
+    "log_dir": ChangeAction.RESTART,
+    "log_level": ChangeAction.RESTART,
+    "ping_interval": ChangeAction.RESTART,
+    "ping_url": ChangeAction.RESTART,
+    "registration_key": ChangeAction.FILE_ONLY,
+    "script_users": ChangeAction.RESTART,
+    "ssl_public_key": ChangeAction.RESTART,
+    "stagger_launch": ChangeAction.FILE_ONLY,
+    "tags": ChangeAction.FILE_ONLY,
+    "url": ChangeAction.REREGISTER,
+    "urgent_exchange_interval": ChangeAction.RESTART,
+}
+"""
+Action needed when a Landscape client configuration key changes.
+
+`registration_key` and `stagger_launch` are only read when registering or starting the
+client, and `tags` are picked up by the client's tag monitor, so rewriting the file is
+enough for them. Identity-defining keys need a new registration.
+"""
+
+DEFAULT_KEY_ACTION = ChangeAction.RESTART
+"""Action for keys not in `KEY_ACTIONS`, e.g. from `additional-client-configuration`."""
+
+
+def get_key_action(key: str) -> ChangeAction:
+    return KEY_ACTIONS.get(key, DEFAULT_KEY_ACTION)
+
+
+class ConfigPlan(NamedTuple):
+    """The changed keys, as `(old, new)` values, and the action that applies them."""
+
+    action: ChangeAction
+    changes: Dict[str, Tuple[Optional[str], str]]
+
+    def describe(self) -> str:
+        """Return one `key: action` line per changed key."""
+        return "\n".join(
+            f"{key}: {get_key_action(key)}" for key in sorted(self.changes)
+        )
+
+
+def plan_config_change(
+    previous: Mapping[str, str],
+    new: Mapping[str, Any],
+) -> ConfigPlan:
+    """
+    Diff the `previous` client configuration, as read from `client.conf`, against
+    the `new` one, as created by `create_client_config`, and return the cheapest
+    sufficient action.
+
+    Empty values in `new` are never written to `client.conf`, so they are not changes.
+    """
+    changes = {}
+    for key, value in new.items():
+        if not value:
+            continue
+
+        new_value = str(value)
+        old_value = previous.get(key)
+        if old_value != new_value:
+            changes[key] = (old_value, new_value)
+
+    action = max(
+        (get_key_action(key) for key in changes),
+        default=ChangeAction.NOOP,
+    )
+    return ConfigPlan(action, changes)
@@ -0,0 +1,163 @@
+# See LICENSE file for licensing details.
+
+"""
+Set up the Landscape client PPA natively, without `add-apt-repository`.
+
+`add-apt-repository` asks Launchpad for the PPA signing key and refreshes every
+package index on the machine. When the key is provided in the charm configuration,
+the source and key can be written directly, and only when they differ from disk.
+"""
+
+import glob
+import logging
+import os
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from files import write_file_if_changed
+from lazy_import import lazy_import
+
+apt = lazy_import("charms.operator_libs_linux.v0.apt")
+
+logger = logging.getLogger(__name__)
+
+LAUNCHPAD_PPA_URI = "https://ppa.launchpadcontent.net/{}/{}/ubuntu"
+OS_RELEASE_FILE = "/etc/os-release"
+SOURCES_DIR = "/etc/apt/sources.list.d"
+
+
+def get_release_codename() -> str:
+    """Return the codename of the running release, e.g. `jammy`."""
+    release = {}
+    with open(OS_RELEASE_FILE) as os_release:
+        for line in os_release:
+            key, _, value = line.strip().partition("=")
+            release[key] = value.strip("\"'")
+
+    codename = release.get("VERSION_CODENAME") or release.get("UBUNTU_CODENAME")
+    if not codename:
+        raise apt.InvalidSourceError(f"No release codename in {OS_RELEASE_FILE}")
+    return codename
+
+
+def get_ppa_uri_path(ppa: str) -> Optional[str]:
+    """
+    Return the part of the archive URI that identifies `ppa`, for either a
+    `ppa:owner/name` shortcut or a `sources.list` line, or None if `ppa` is neither.
+
+    The host is left out because older releases use `ppa.launchpad.net`.
+    """
+    if ppa.startswith("ppa:"):
+        owner, _, name = ppa[len("ppa:") :].partition("/")
+        return f"/{owner}/{name or 'ppa'}/ubuntu"
+
+    try:
+        return apt.DebianRepository.from_repo_line(ppa, write_file=False).uri
+    except apt.InvalidSourceError:
+        return None
+
+
+def get_ppa_repo_line(ppa: str, codename: str) -> str:
+    """Return the `sources.list` line for `ppa`, expanding `ppa:owner/name` shortcuts."""
+    if not ppa.startswith("ppa:"):
+        return ppa
+
+    owner, _, name = ppa[len("ppa:") :].partition("/")
+    return f"deb {LAUNCHPAD_PPA_URI.format(owner, name or 'ppa')} {codename} main"
+
+
+def get_source_uris(line: str) -> List[str]:
+    """
+    Return the archive URIs of a `sources.list` line or of the `URIs` field of a
+    deb822 `.sources` stanza, or an empty list for other lines.
+    """
+    if line.startswith("URIs:"):
+        return line[len("URIs:") :].split()
+
+    fields = line.split()
+    if not fields or fields[0] not in ("deb", "deb-src"):
+        return []
+
+    fields = fields[1:]
+    # Skip the options, e.g. `[arch=amd64 signed-by=/etc/apt/keyrings/key.gpg]`.
+    if fields and fields[0].startswith("["):
+        while fields and not fields[0].endswith("]"):
+            fields = fields[1:]
+        fields = fields[1:]
+    return fields[:1]
+
+
+def uri_matches(uri: str, uri_path: str) -> bool:
+    """Return whether `uri` is the archive identified by `get_ppa_uri_path`."""
+    if uri_path.startswith("/"):
+        uri = urlparse(uri).path
+    return uri.rstrip("/") == uri_path.rstrip("/")
+
+
+def find_ppa_source(ppa: str) -> Optional[str]:
+    """Return the source file that enables `ppa`, if any."""
+    uri_path = get_ppa_uri_path(ppa)
+    if not uri_path:
+        return None
+
+    for filename in sorted(
+        glob.glob(os.path.join(SOURCES_DIR, "*.list"))
+        + glob.glob(os.path.join(SOURCES_DIR, "*.sources"))
+    ):
+        try:
+            with open(filename) as source_file:
+                for line in source_file:
+                    uris = get_source_uris(line.strip())
+                    if any(uri_matches(uri, uri_path) for uri in uris):
+                        return filename
+        except OSError:
+            continue
+
+    return None
+
+
+def render_repo_line(repo, key_file: str) -> str:
+    """Return the `sources.list` line enabling `repo`, signed by `key_file`."""
+    options = dict(repo.options or {}, **{"signed-by": key_file})
+    options_str = " ".join(f"{k}={v}" for k, v in sorted(options.items()))
+    return (
+        f"{repo.repotype} [{options_str}] {repo.uri} {repo.release} "
+        f"{' '.join(repo.groups)}\n"
+    )
+
+
+def ensure_ppa_repository(ppa: str, key: str) -> bool:
+    """
+    Write `key` and a source enabling `ppa`, each only when it differs from what is
+    on disk. Return whether the source changed, in which case package indexes need
+    a refresh.
+
+    Both files are written atomically here, rather than by the apt library, so that
+    a killed hook never leaves apt with a truncated source or key.
+
+    A `.sources` file previously written for `ppa` by `add-apt-repository` is replaced,
+    since apt refuses the same source with conflicting keys.
+    """
+    repo = apt.DebianRepository.from_repo_line(
+        get_ppa_repo_line(ppa, get_release_codename()), write_file=False
+    )
+    key_file, key_material = apt.DebianRepository.read_armored_key(key)
+    if write_file_if_changed(key_file, key_material):
+        logger.info(f"Wrote {key_file} for {ppa}")
+
+    existing_file = find_ppa_source(ppa)
+    if existing_file and existing_file.endswith(".list"):
+        filename = existing_file
+    else:
+        filename = os.path.join(SOURCES_DIR, os.path.basename(repo.filename))
+
+    changed = write_file_if_changed(filename, render_repo_line(repo, key_file))
+    if changed:
+        logger.info(f"Wrote {filename} for {ppa}")
+
+    if existing_file and existing_file != filename:
+        logger.info(f"Removing {existing_file}, replaced by {filename}")
+        os.remove(existing_file)
+        changed = True
+
+    return changed
@@ -0,0 +1,53 @@
+# See LICENSE file for licensing details.
+
+"""
+Schedule client registrations so that units deployed together don't all register
+with the Landscape server at once.
+"""
+
+import hashlib
+import random
+import time
+from typing import Optional
+
+RETRY_BASE_DELAY = 60
+"""Delay, in seconds, bounding the first retry of a failed registration."""
+
+
+def get_registration_slot(unit_name: str, window: float) -> float:
+    """
+    Return the offset, in seconds within `window`, of the registration slot of
+    `unit_name`. Slots are spread uniformly over the window, and a unit always gets
+    the same one.
+    """
+    if window <= 0:
+        return 0.0
+
+    digest = hashlib.sha256(unit_name.encode()).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64 * window
+
+
+def get_registration_due(
+    unit_name: str, window: float, requested: Optional[float] = None
+) -> float:
+    """Return when a registration requested at `requested`, or now, may be sent."""
+    if requested is None:
+        requested = time.time()
+    return requested + get_registration_slot(unit_name, window)
+
+
+def get_retry_delay(
+    attempt: int, max_delay: float, base_delay: float = RETRY_BASE_DELAY
+) -> float:
+    """
+    Return how long to wait before retrying after `attempt` failed registrations:
+    exponential backoff capped at `max_delay`, with full jitter, so that units that
+    failed together don't retry together.
+    """
+    ceiling = min(max_delay, base_delay * 2 ** min(attempt - 1, 32))
+    return random.uniform(0, ceiling)
+
+
+def format_time(timestamp: float) -> str:
+    """Format a timestamp for unit status messages."""
+    return time.strftime("%H:%M:%S UTC", time.gmtime(timestamp))
@@ -0,0 +1,47 @@
+# See LICENSE file for licensing details.
+
+"""
+Roll client upgrades and restarts across the units of the application, so that only
+`rolling-max-concurrent` of them pull packages from the mirror or reconnect to the
+Landscape server at once.
+
+Units request a token by setting `REQUESTED_KEY`, with the time of the request, in
+their data of the peer relation. The leader grants tokens to the oldest requests and
+lists the holders under `GRANTED_KEY` in the application data. A unit runs its queued
+operations once it is listed, then releases its token by clearing its request.
+"""
+
+from typing import List, Mapping, Sequence
+
+PEER_RELATION = "rolling"
+REQUESTED_KEY = "rolling-requested"
+GRANTED_KEY = "rolling-granted"
+
+
+def _queue(requests: Mapping[str, float], holders: Sequence[str]) -> List[str]:
+    """Return the units waiting for a token, in the order they'll get one."""
+    return sorted(
+        (unit for unit in requests if unit not in holders),
+        key=lambda unit: (requests[unit], unit),
+    )
+
+
+def grant_tokens(
+    requests: Mapping[str, float], granted: Sequence[str], limit: int
+) -> List[str]:
+    """
+    Return the units that hold a token, given the time of each unit's request and the
+    units that were granted one so far. Tokens of units that no longer request one
+    are released, and free tokens go to the oldest requests.
+    """
+    holders = [unit for unit in granted if unit in requests]
+    free = max(0, limit - len(holders))
+    return holders + _queue(requests, holders)[:free]
+
+
+def queue_position(
+    requests: Mapping[str, float], granted: Sequence[str], unit: str
+) -> int:
+    """Return how many units will get a token before `unit`, which waits for one."""
+    queue = _queue(requests, granted)
+    return queue.index(unit) if unit in queue else 0
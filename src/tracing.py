@@ -0,0 +1,268 @@
+# See LICENSE file for licensing details.
+
+"""
+Trace hook dispatches as OpenTelemetry spans: one root span per dispatch, with child
+spans for the phases of its handlers and the commands they spawn.
+
+Spans are exported at the end of the dispatch to the OTLP/HTTP endpoint set by the
+`tracing-endpoint` option, by a detached process so that hooks never wait on the
+collector. Spans that can't be exported are appended to a local JSON-lines file.
+
+This module only uses the standard library and the charm's `files` module, which
+does too, so that it can run as the exporter without the charm's dependencies.
+"""
+
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from files import write_file_if_changed
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "landscape-client-charm"
+STATE_DIR = "/var/lib/landscape-client-charm"
+ENDPOINT_FILE = os.path.join(STATE_DIR, "tracing-endpoint")
+FALLBACK_FILE = "/var/log/landscape-client-charm/traces.jsonl"
+FALLBACK_MAX_BYTES = 10 * 2**20
+"""Size past which the fallback file is rotated, keeping one previous file."""
+
+EXPORT_TIMEOUT = 5
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def _new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+
+_trace_id = _new_id(16)
+_root_span_id = _new_id(8)
+_started_ns = time.time_ns()
+_parents: List[str] = [_root_span_id]
+_spans: List[dict] = []
+
+
+def _attributes(attributes: Dict[str, Any]) -> List[dict]:
+    """Encode attributes as OTLP key-values, skipping unset ones."""
+    encoded = []
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            encoded_value = {"boolValue": value}
+        elif isinstance(value, int):
+            encoded_value = {"intValue": str(value)}
+        elif isinstance(value, float):
+            encoded_value = {"doubleValue": value}
+        else:
+            encoded_value = {"stringValue": str(value)}
+        encoded.append({"key": key, "value": encoded_value})
+    return encoded
+
+
+def _make_span(
+    name: str,
+    span_id: str,
+    parent_id: Optional[str],
+    start_ns: int,
+    end_ns: int,
+    attributes: Dict[str, Any],
+    error: bool = False,
+) -> dict:
+    span = {
+        "traceId": _trace_id,
+        "spanId": span_id,
+        "name": name,
+        "kind": 1,
+        "startTimeUnixNano": str(start_ns),
+        "endTimeUnixNano": str(end_ns),
+        "attributes": _attributes(attributes),
+        "status": {"code": STATUS_ERROR if error else STATUS_OK},
+    }
+    if parent_id:
+        span["parentSpanId"] = parent_id
+    return span
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Trace an operation as a child of the current span. The yielded attributes can
+    be added to until the operation ends.
+    """
+    span_id = _new_id(8)
+    parent_id = _parents[-1]
+    start_ns = time.time_ns()
+    _parents.append(span_id)
+    error = False
+    try:
+        yield attributes
+    except BaseException as e:
+        error = True
+        attributes["exception.type"] = type(e).__name__
+        raise
+    finally:
+        _parents.pop()
+        _spans.append(
+            _make_span(
+                name, span_id, parent_id, start_ns, time.time_ns(), attributes, error
+            )
+        )
+
+
+def record_span(name: str, seconds: float, error: bool = False, **attributes):
+    """Trace an operation of the current span that just ended, after `seconds`."""
+    end_ns = time.time_ns()
+    _spans.append(
+        _make_span(
+            name,
+            _new_id(8),
+            _parents[-1],
+            end_ns - int(seconds * 1e9),
+            end_ns,
+            attributes,
+            error,
+        )
+    )
+
+
+def get_endpoint() -> Optional[str]:
+    try:
+        with open(ENDPOINT_FILE) as endpoint_file:
+            return endpoint_file.read().strip() or None
+    except OSError:
+        return None
+
+
+def set_endpoint(endpoint: Optional[str]):
+    """
+    Export the spans of the following dispatches to `endpoint`, or stop tracing. The
+    endpoint file is only written when the endpoint changes.
+    """
+    if not endpoint:
+        if os.path.exists(ENDPOINT_FILE):
+            os.remove(ENDPOINT_FILE)
+        return
+
+    os.makedirs(STATE_DIR, exist_ok=True)
+    write_file_if_changed(ENDPOINT_FILE, endpoint)
+
+
+def finish(hook: str, error: bool = False, **attributes) -> dict:
+    """End the trace of this dispatch and return it as an OTLP/JSON request."""
+    root = _make_span(
+        hook, _root_span_id, None, _started_ns, time.time_ns(), attributes, error
+    )
+    spans = [root, *_spans]
+    _spans.clear()
+
+    resource = {
+        "service.name": SERVICE_NAME,
+        "juju.unit": os.environ.get("JUJU_UNIT_NAME"),
+    }
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": _attributes(resource)},
+                "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}],
+            }
+        ]
+    }
+
+
+def export(hook: str, error: bool = False, **attributes):
+    """
+    Hand the trace of this dispatch to a detached exporter, if tracing is on, and
+    return without waiting for it.
+    """
+    endpoint = get_endpoint()
+    trace = finish(hook, error, **attributes)
+    if not endpoint:
+        return
+
+    os.makedirs(STATE_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="trace-", suffix=".json", dir=STATE_DIR)
+    with os.fdopen(fd, "w") as trace_file:
+        json.dump(trace, trace_file)
+
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), endpoint, path],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+        close_fds=True,
+    )
+
+
+@contextmanager
+def trace_dispatch(hook: str, **attributes):
+    """
+    Trace the dispatch of `hook` as the root span, and export it once the dispatch
+    ends, also if it raises, in which case the root span has an error status.
+    """
+    error = False
+    try:
+        yield attributes
+    except SystemExit as e:
+        error = bool(e.code)
+        raise
+    except BaseException as e:
+        error = True
+        attributes["exception.type"] = type(e).__name__
+        raise
+    finally:
+        try:
+            export(hook, error, **attributes)
+        except OSError:
+            logger.exception("Could not export the trace of this dispatch")
+
+
+def write_fallback(trace: dict):
+    """Append the spans of `trace` to the JSON-lines fallback file, one per line."""
+    os.makedirs(os.path.dirname(FALLBACK_FILE), exist_ok=True)
+    try:
+        if os.path.getsize(FALLBACK_FILE) > FALLBACK_MAX_BYTES:
+            os.replace(FALLBACK_FILE, FALLBACK_FILE + ".1")
+    except OSError:
+        pass
+
+    with open(FALLBACK_FILE, "a") as fallback:
+        for resource_spans in trace["resourceSpans"]:
+            for scope_spans in resource_spans["scopeSpans"]:
+                for span in scope_spans["spans"]:
+                    fallback.write(json.dumps(span, sort_keys=True) + "\n")
+
+
+def send_trace(endpoint: str, path: str):
+    """Post the trace saved at `path` to `endpoint`, or keep it locally if that fails."""
+    # Only the exporter process needs it.
+    import urllib.request
+
+    with open(path) as trace_file:
+        trace = json.load(trace_file)
+    try:
+        request = urllib.request.Request(
+            endpoint,
+            data=json.dumps(trace).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=EXPORT_TIMEOUT):
+            pass
+    except Exception:
+        write_fallback(trace)
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    send_trace(*sys.argv[1:3])
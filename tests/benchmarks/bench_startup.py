@@ -0,0 +1,94 @@
+# See LICENSE file for licensing details.
+"""
+Measure cold hook dispatch time of the charm, from interpreter start to exit, for
+an event the charm doesn't observe and for `update-status`, which it does.
+
+Each dispatch runs `src/charm.py` in a fresh interpreter, like Juju does, against a
+scratch charm directory and stub hook tools. The charm's own import time is
+reported separately, with `python -X importtime`.
+
+Run with: python tests/benchmarks/bench_startup.py [runs]
+"""
+
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Hook tools the framework may call while dispatching; they all succeed quietly.
+HOOK_TOOLS = {
+    "juju-log": "",
+    "is-leader": "false",
+    "config-get": "{}",
+    "status-get": '{"status": "active", "message": ""}',
+    "status-set": "",
+    "application-version-set": "",
+}
+
+
+def make_unit_dir(tmp_dir: str) -> dict:
+    charm_dir = os.path.join(tmp_dir, "charm")
+    os.mkdir(charm_dir)
+    for name in ("metadata.yaml", "actions.yaml", "config.yaml"):
+        shutil.copy(os.path.join(ROOT, name), charm_dir)
+
+    tools_dir = os.path.join(tmp_dir, "tools")
+    os.mkdir(tools_dir)
+    for tool, output in HOOK_TOOLS.items():
+        path = os.path.join(tools_dir, tool)
+        with open(path, "w") as tool_file:
+            tool_file.write(f"#!/bin/sh\necho '{output}'\n")
+        os.chmod(path, 0o755)
+
+    return {
+        **os.environ,
+        "PATH": f"{tools_dir}:{os.environ['PATH']}",
+        "PYTHONPATH": f"{ROOT}/lib:{ROOT}/src",
+        "JUJU_CHARM_DIR": charm_dir,
+        "JUJU_UNIT_NAME": "landscape-client/0",
+        "JUJU_MODEL_NAME": "bench",
+        "JUJU_VERSION": "3.4.0",
+    }
+
+
+def dispatch(env: dict, hook: str) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, os.path.join(ROOT, "src", "charm.py")],
+        env={**env, "JUJU_DISPATCH_PATH": f"hooks/{hook}"},
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+def import_time(env: dict) -> int:
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import charm"],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    return int(output.splitlines()[-1].split("|")[1])
+
+
+def main(runs: int = 10):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = make_unit_dir(tmp_dir)
+        print(f"import charm: {import_time(env) / 1000:8.1f} ms")
+        for hook in ("leader-settings-changed", "update-status"):
+            times = [dispatch(env, hook) for _ in range(runs)]
+            print(
+                f"{hook:24} median {statistics.median(times) * 1000:8.1f} ms, "
+                f"min {min(times) * 1000:8.1f} ms over {runs} runs"
+            )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,60 @@
+# See LICENSE file for licensing details.
+"""
+Compare sorting package versions through their precomputed keys against parsing
+both versions on every comparison, as `apt.Version` used to.
+
+Run with: PYTHONPATH=lib python tests/benchmarks/bench_version.py [count]
+"""
+
+import functools
+import random
+import sys
+import timeit
+
+from charms.operator_libs_linux.v0 import apt
+
+
+def synthetic_versions(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    suffixes = ["", "~rc1", "+dfsg", "ubuntu1", "~ppa1", "build2"]
+    return [
+        "{}{}.{}.{}{}-{}ubuntu{}".format(
+            f"{rng.randint(1, 2)}:" if rng.random() < 0.1 else "",
+            rng.randint(0, 30),
+            rng.randint(0, 12),
+            rng.randint(0, 99),
+            rng.choice(suffixes),
+            rng.randint(0, 5),
+            rng.randint(0, 9),
+        )
+        for _ in range(count)
+    ]
+
+
+def compare_parsing(first: str, second: str) -> int:
+    return apt.compare_many(first, [second])[0]
+
+
+def main(count: int = 20000):
+    versions = synthetic_versions(count)
+
+    keyed = min(timeit.repeat(lambda: apt.sort_versions(versions), number=1, repeat=3))
+    parsing = min(
+        timeit.repeat(
+            lambda: sorted(versions, key=functools.cmp_to_key(compare_parsing)),
+            number=1,
+            repeat=3,
+        )
+    )
+    newest = min(timeit.repeat(lambda: apt.max_version(versions), number=1, repeat=3))
+
+    print(f"{count} versions")
+    print(f"sort, parsing per comparison: {parsing * 1000:8.1f} ms")
+    print(
+        f"sort, precomputed keys:       {keyed * 1000:8.1f} ms ({parsing / keyed:.1f}x)"
+    )
+    print(f"max_version:                  {newest * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,103 @@
+# See LICENSE file for licensing details.
+"""
+Compare `apt.Version` ordering against `dpkg --compare-versions`, which is the
+reference implementation, on realistic and adversarial versions.
+
+Every pair of a generated corpus is compared by both. Mismatches are reported,
+along with the cost of a comparison in each implementation. Exits non-zero on
+any mismatch.
+
+Run with: PYTHONPATH=lib python tests/benchmarks/fuzz_version.py [count] [seed]
+"""
+
+import itertools
+import random
+import subprocess
+import sys
+import time
+
+from charms.operator_libs_linux.v0 import apt
+
+REALISTIC = [
+    "23.02-0ubuntu1",
+    "23.02-0ubuntu1~22.04.1",
+    "1:24.02-0ubuntu5",
+    "24.02+git6437-0ubuntu1~ppa1",
+    "2.0.5-1build2",
+    "1.21.1ubuntu2.3",
+    "0.9.8~rc1-1",
+    "3.1.0+dfsg-1ubuntu0.1",
+]
+
+# Characters that dpkg gives a special meaning to, or that sort unusually.
+ALPHABET = "~+.-:abzAZ019"
+
+
+def adversarial_version(rng: random.Random) -> str:
+    def revision(length):
+        chars = [
+            rng.choice(ALPHABET.replace("-", "").replace(":", ""))
+            for _ in range(length)
+        ]
+        return "".join(chars)
+
+    # Versions must start with a digit for dpkg not to warn about them.
+    version = str(rng.randint(0, 3)) + revision(rng.randint(0, 6))
+    if rng.random() < 0.5:
+        version += "-" + revision(rng.randint(1, 4))
+    if rng.random() < 0.2:
+        version = "{}:{}".format(rng.randint(0, 10), version)
+    return version
+
+
+def corpus(count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    versions = list(REALISTIC)
+    while len(versions) < count:
+        versions.append(adversarial_version(rng))
+    return versions
+
+
+def dpkg_compare(first: str, second: str) -> int:
+    for operator, result in (("lt", -1), ("eq", 0)):
+        if (
+            subprocess.call(["dpkg", "--compare-versions", first, operator, second])
+            == 0
+        ):
+            return result
+    return 1
+
+
+def main(count: int = 60, seed: int = 0) -> int:
+    versions = corpus(count, seed)
+    pairs = list(itertools.combinations(versions, 2))
+
+    start = time.perf_counter()
+    parsed = {version: apt.Version.from_string(version) for version in versions}
+    expected_native = [
+        apt.compare_many(parsed[first], [parsed[second]])[0] for first, second in pairs
+    ]
+    native = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected_dpkg = [dpkg_compare(first, second) for first, second in pairs]
+    dpkg = time.perf_counter() - start
+
+    mismatches = [
+        (pair, ours, theirs)
+        for pair, ours, theirs in zip(pairs, expected_native, expected_dpkg)
+        if ours != theirs
+    ]
+    for (first, second), ours, theirs in mismatches:
+        print(f"MISMATCH {first!r} vs {second!r}: Version={ours} dpkg={theirs}")
+
+    print(
+        f"{len(pairs)} pairs from {len(versions)} versions, {len(mismatches)} mismatches"
+    )
+    print(f"Version: {native / len(pairs) * 1e6:10.2f} us per comparison")
+    print(f"dpkg:    {dpkg / len(pairs) * 1e6:10.2f} us per comparison")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,579 @@
+# See LICENSE file for licensing details.
+import gzip
+import hashlib
+import itertools
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from charms.operator_libs_linux.v0 import apt
+
+DPKG_STATUS = """\
+Package: landscape-client
+Status: install ok installed
+Priority: optional
+Architecture: amd64
+Version: 1:24.02-0ubuntu5
+Description: The Landscape administration system client
+ A description line long enough to break any column-based parsing of `dpkg -l`,
+ Version: 0.0 which is not a field.
+
+Package: libfoo
+Status: install ok installed
+Architecture: amd64
+Version: 1.0
+
+Package: libfoo
+Status: install ok installed
+Architecture: i386
+Version: 1.0
+
+Package: removed
+Status: deinstall ok config-files
+Architecture: amd64
+Version: 2.0
+
+Package: dpkg
+Status: install ok installed
+Architecture: amd64
+Version: 1.21.1
+"""
+
+
+class TestDpkgStatus(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.status_file = os.path.join(tmpdir, "status")
+        self.write_status(DPKG_STATUS)
+        mock.patch.object(apt, "DPKG_STATUS_FILE", new=self.status_file).start()
+        mock.patch.object(
+            apt, "DPKG_UPDATES_DIR", new=os.path.join(tmpdir, "updates")
+        ).start()
+        mock.patch.dict(apt._dpkg_status_cache, {"stamp": None, "index": {}}).start()
+        mock.patch.object(apt, "_system_architecture", new="").start()
+        self.check_output_mock = mock.patch.object(apt, "check_output").start()
+        self.addCleanup(mock.patch.stopall)
+
+    def write_status(self, content, mtime=1000):
+        with open(self.status_file, "w") as status_file:
+            status_file.write(content)
+        os.utime(self.status_file, (mtime, mtime))
+
+    def test_from_installed_package(self):
+        pkg = apt.DebianPackage.from_installed_package("landscape-client")
+        self.assertEqual("1:24.02-0ubuntu5", str(pkg.version))
+        self.assertEqual("amd64", pkg.arch)
+        self.assertEqual(apt.PackageState.Present, pkg.state)
+        self.check_output_mock.assert_not_called()
+
+    def test_from_installed_package_arch(self):
+        pkg = apt.DebianPackage.from_installed_package("libfoo:i386")
+        self.assertEqual("i386", pkg.arch)
+        with self.assertRaises(apt.PackageNotFoundError):
+            apt.DebianPackage.from_installed_package("libfoo", arch="arm64")
+
+    def test_not_installed(self):
+        for package in ("removed", "unknown"):
+            with self.assertRaises(apt.PackageNotFoundError):
+                apt.DebianPackage.from_installed_package(package)
+
+    def test_from_installed_packages(self):
+        installed = apt.DebianPackage.from_installed_packages(
+            ["dpkg", "removed", "landscape-client"]
+        )
+        self.assertEqual(["dpkg", "landscape-client"], sorted(installed))
+
+    def test_index_reused_until_changed(self):
+        with mock.patch.object(
+            apt, "_parse_dpkg_status", wraps=apt._parse_dpkg_status
+        ) as parse_mock:
+            apt.DebianPackage.from_installed_package("dpkg")
+            apt.DebianPackage.from_installed_package("landscape-client")
+            self.assertEqual(1, parse_mock.call_count)
+
+            self.write_status(DPKG_STATUS.replace("1.21.1", "1.21.2"), mtime=2000)
+            pkg = apt.DebianPackage.from_installed_package("dpkg")
+            self.assertEqual("1.21.2", str(pkg.version))
+            self.assertEqual(2, parse_mock.call_count)
+
+    def test_pending_updates_fall_back_to_dpkg_query(self):
+        os.mkdir(apt.DPKG_UPDATES_DIR)
+        with open(os.path.join(apt.DPKG_UPDATES_DIR, "0001"), "w"):
+            pass
+        self.check_output_mock.side_effect = [
+            "amd64\n",
+            "install ok installed\t2.0\tamd64\n",
+        ]
+        pkg = apt.DebianPackage.from_installed_package("dpkg")
+        self.assertEqual("2.0", str(pkg.version))
+
+    def test_snapshot_diff(self):
+        before = apt.PackageSnapshot.take()
+        self.assertEqual(5, len(before))
+        self.assertEqual(before, apt.PackageSnapshot.from_dict(before.to_dict()))
+
+        self.write_status(
+            DPKG_STATUS.replace("1:24.02-0ubuntu5", "1:24.04-0ubuntu1").replace(
+                "Package: dpkg", "Package: dpkg-dev"
+            ),
+            mtime=2000,
+        )
+        diff = before.diff(apt.PackageSnapshot.take())
+
+        self.assertEqual(
+            [
+                (
+                    "landscape-client",
+                    "amd64",
+                    ("1:24.02-0ubuntu5", "install ok installed"),
+                    ("1:24.04-0ubuntu1", "install ok installed"),
+                )
+            ],
+            diff.changed,
+        )
+        self.assertEqual(["dpkg-dev"], [row[0] for row in diff.added])
+        self.assertEqual(["dpkg"], [row[0] for row in diff.removed])
+        self.assertFalse(before.diff(before))
+
+    def test_snapshot_limited_to_packages(self):
+        snapshot = apt.PackageSnapshot.take(["libfoo", "unknown"])
+        self.assertEqual(("libfoo", "libfoo"), snapshot.names)
+        self.assertEqual(("amd64", "i386"), snapshot.archs)
+
+
+def packages_list(*stanzas):
+    return "\n".join(
+        "Package: {}\nArchitecture: {}\nVersion: {}\nDescription: x\n multi\n".format(
+            *stanza
+        )
+        for stanza in stanzas
+    )
+
+
+class TestAptLists(unittest.TestCase):
+
+    def setUp(self):
+        self.lists_dir = tempfile.mkdtemp()
+        mock.patch.object(apt, "APT_LISTS_DIR", new=self.lists_dir).start()
+        mock.patch.object(
+            apt, "APT_LISTS_INDEX_FILE", new=os.path.join(self.lists_dir, "index.json")
+        ).start()
+        mock.patch.object(apt, "APT_PREFERENCES", new=()).start()
+        mock.patch.dict(apt._apt_lists_cache, {"files": None}).start()
+        mock.patch.object(apt, "_system_architecture", new="amd64").start()
+        self.check_output_mock = mock.patch.object(apt, "check_output").start()
+        self.addCleanup(mock.patch.stopall)
+
+        self.write_list(
+            "archive_ubuntu_dists_jammy_main_binary-amd64_Packages",
+            packages_list(
+                ("other", "amd64", "1.0"),
+                ("landscape-client", "i386", "30.0"),
+                ("landscape-client", "amd64", "23.02-0ubuntu1"),
+            ),
+        )
+
+    def write_list(self, name, content, opener=open):
+        with opener(os.path.join(self.lists_dir, name), "wt") as f:
+            f.write(content)
+
+    def test_from_apt_cache(self):
+        pkg = apt.DebianPackage.from_apt_cache("landscape-client")
+        self.assertEqual("23.02-0ubuntu1", str(pkg.version))
+        self.assertEqual("amd64", pkg.arch)
+        self.assertEqual(apt.PackageState.Available, pkg.state)
+        self.check_output_mock.assert_not_called()
+
+        with self.assertRaises(apt.PackageNotFoundError):
+            apt.DebianPackage.from_apt_cache("unknown")
+
+    def test_highest_version_selected(self):
+        """The highest version wins, not the first one listed"""
+        self.write_list(
+            "ppa_landscape_ubuntu_dists_jammy_main_binary-amd64_Packages.gz",
+            packages_list(("landscape-client", "amd64", "1:24.02-0ubuntu1")),
+            opener=gzip.open,
+        )
+        pkg = apt.DebianPackage.from_apt_cache("landscape-client")
+        self.assertEqual("1:24.02-0ubuntu1", str(pkg.version))
+
+        pkg = apt.DebianPackage.from_apt_cache(
+            "landscape-client", version="23.02-0ubuntu1"
+        )
+        self.assertEqual("23.02-0ubuntu1", str(pkg.version))
+
+    def test_not_automatic_release(self):
+        """Versions from NotAutomatic releases such as backports are not candidates"""
+        self.write_list(
+            "archive_ubuntu_dists_jammy-backports_InRelease",
+            "Suite: jammy-backports\nNotAutomatic: yes\nButAutomaticUpgrades: yes\n",
+        )
+        self.write_list(
+            "archive_ubuntu_dists_jammy-backports_main_binary-amd64_Packages",
+            packages_list(("landscape-client", "amd64", "24.02-0ubuntu1")),
+        )
+        pkg = apt.DebianPackage.from_apt_cache("landscape-client")
+        self.assertEqual("23.02-0ubuntu1", str(pkg.version))
+
+    def test_index_read_in_chunks(self):
+        """Stanzas are found at the same offsets whatever the chunk boundaries"""
+        filename = os.path.join(
+            self.lists_dir, "archive_ubuntu_dists_jammy_main_binary-amd64_Packages"
+        )
+        with open(filename, "rb") as f:
+            data = f.read()
+        expected = {
+            "other": [0],
+            "landscape-client": [
+                data.index(b"Package: landscape-client"),
+                data.rindex(b"Package: landscape-client"),
+            ],
+        }
+        for chunk_bytes in (1, 7, 10**6):
+            with mock.patch.object(apt, "_LIST_CHUNK_BYTES", new=chunk_bytes):
+                self.assertEqual(expected, apt._index_list_file(filename))
+
+    def test_index_persisted(self):
+        apt.DebianPackage.from_apt_cache("landscape-client")
+        apt._apt_lists_cache["files"] = None
+
+        with mock.patch.object(apt, "_index_list_file") as index_mock:
+            pkg = apt.DebianPackage.from_apt_cache("other")
+
+        index_mock.assert_not_called()
+        self.assertEqual("1.0", str(pkg.version))
+
+    def test_unsupported_compression(self):
+        """Lists that can't be read natively fall back to `apt-cache show`"""
+        self.write_list(
+            "archive_ubuntu_dists_jammy_universe_binary-amd64_Packages.lz4", ""
+        )
+        self.check_output_mock.return_value = packages_list(("other", "amd64", "2.0"))
+        pkg = apt.DebianPackage.from_apt_cache("other")
+        self.assertEqual("2.0", str(pkg.version))
+
+
+class TestBatchTransactions(unittest.TestCase):
+
+    def setUp(self):
+        self.check_call_mock = mock.patch.object(apt, "check_call").start()
+        self.update_mock = mock.patch.object(apt, "update").start()
+        self.from_system_mock = mock.patch.object(
+            apt.DebianPackage, "from_system", side_effect=self.from_system
+        ).start()
+        self.from_installed_package_mock = mock.patch.object(
+            apt.DebianPackage, "from_installed_package", side_effect=self.from_installed
+        ).start()
+        self.addCleanup(mock.patch.stopall)
+        self.available = {"landscape-client": "24.02", "landscape-common": "24.02"}
+        self.installed = {"landscape-common": "23.02"}
+
+    def package(self, name, version, state):
+        return apt.DebianPackage(name, version, "", "amd64", state)
+
+    def from_installed(self, name, version="", arch=""):
+        if name not in self.installed:
+            raise apt.PackageNotFoundError(name)
+        return self.package(name, self.installed[name], apt.PackageState.Present)
+
+    def from_system(self, name, version="", arch=""):
+        try:
+            return self.from_installed(name)
+        except apt.PackageNotFoundError:
+            pass
+        if name not in self.available:
+            raise apt.PackageNotFoundError(name)
+        return self.package(name, self.available[name], apt.PackageState.Available)
+
+    def test_add_packages_in_one_transaction(self):
+        self.installed = {}
+        packages = apt.add_package(["landscape-client", "landscape-common"])
+
+        self.check_call_mock.assert_called_once_with(
+            [
+                "apt-get",
+                "-y",
+                "--option=Dpkg::Options::=--force-confold",
+                "install",
+                "landscape-client=24.02",
+                "landscape-common=24.02",
+            ],
+            stderr=mock.ANY,
+            stdout=mock.ANY,
+        )
+        self.assertEqual(
+            ["landscape-client", "landscape-common"], [p.name for p in packages]
+        )
+        self.assertTrue(all(p.present for p in packages))
+        self.update_mock.assert_not_called()
+
+    def test_installed_packages_skipped(self):
+        pkg = apt.add_package("landscape-common")
+
+        self.assertEqual("23.02", str(pkg.version))
+        self.check_call_mock.assert_not_called()
+
+    def test_missing_packages_retried_after_update(self):
+        self.installed = {}
+        del self.available["landscape-common"]
+
+        def update():
+            self.available["landscape-common"] = "24.02"
+
+        self.update_mock.side_effect = update
+
+        packages = apt.add_package(["landscape-client", "landscape-common"])
+
+        self.update_mock.assert_called_once_with()
+        self.assertEqual(2, self.check_call_mock.call_count)
+        self.assertEqual(
+            ["landscape-client", "landscape-common"], [p.name for p in packages]
+        )
+
+        del self.available["landscape-common"]
+        self.update_mock.side_effect = None
+        with self.assertRaises(apt.PackageError):
+            apt.add_package(["landscape-common"])
+
+    def test_remove_packages_in_one_transaction(self):
+        self.installed = {"landscape-client": "24.02", "landscape-common": "24.02"}
+
+        packages = apt.remove_package(
+            ["landscape-client", "landscape-common", "absent"]
+        )
+
+        self.check_call_mock.assert_called_once_with(
+            [
+                "apt-get",
+                "-y",
+                "remove",
+                "landscape-client=24.02",
+                "landscape-common=24.02",
+            ],
+            stderr=mock.ANY,
+            stdout=mock.ANY,
+        )
+        self.assertFalse(any(p.present for p in packages))
+
+
+class TestUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.lists_dir = os.path.join(self.tmp_dir, "lists")
+        os.mkdir(self.lists_dir)
+        self.sources = os.path.join(self.tmp_dir, "sources.list")
+        with open(self.sources, "w"):
+            pass
+        os.utime(self.sources, (0, 0))
+        with open(os.path.join(self.lists_dir, "archive_jammy_main_Packages"), "w"):
+            pass
+        mock.patch.object(apt, "APT_LISTS_DIR", new=self.lists_dir).start()
+        mock.patch.object(
+            apt, "APT_PKGCACHE_FILE", new=os.path.join(self.tmp_dir, "pkgcache.bin")
+        ).start()
+        mock.patch.object(apt, "APT_SOURCES", new=(self.sources,)).start()
+        self.check_call_mock = mock.patch.object(apt, "check_call").start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_update(self):
+        self.assertTrue(apt.update())
+        self.check_call_mock.assert_called_once_with(
+            ["apt-get", "update"], stderr=mock.ANY, stdout=mock.ANY
+        )
+
+    def test_fresh_indexes_not_refreshed(self):
+        self.assertFalse(apt.update(max_age=60))
+        self.check_call_mock.assert_not_called()
+
+    def test_stale_indexes_refreshed(self):
+        os.utime(self.lists_dir, (1, 1))
+        self.assertTrue(apt.update(max_age=60))
+
+    def test_changed_sources_refreshed(self):
+        os.utime(self.lists_dir, (1, 1))
+        os.utime(self.sources, (2, 2))
+        self.assertIsNone(apt.get_cache_age())
+        self.assertTrue(apt.update(max_age=10**10))
+
+    def test_fresh_source_not_refreshed(self):
+        self.assertFalse(apt.update_source(self.sources, max_age=60))
+        self.check_call_mock.assert_not_called()
+
+        os.utime(self.lists_dir, (1, 1))
+        self.assertTrue(apt.update_source(self.sources, max_age=60))
+
+    def test_lean_update_source(self):
+        apt.update_source(self.sources, lean=True)
+
+        command = self.check_call_mock.call_args.args[0]
+        self.assertEqual("update", command[-1])
+        self.assertIn("Acquire::Languages=none", command)
+        self.assertIn(
+            "Acquire::IndexTargets::deb::Contents-deb::DefaultEnabled=false", command
+        )
+        # The host's copies of the skipped targets, and other sources' lists, stay.
+        self.assertIn("APT::Get::List-Cleanup=0", command)
+
+    def test_update_source(self):
+        apt.update_source(self.sources)
+
+        self.check_call_mock.assert_called_once_with(
+            [
+                "apt-get",
+                "-o",
+                "APT::Get::List-Cleanup=0",
+                "-o",
+                "Dir::Etc::sourcelist={}".format(self.sources),
+                "-o",
+                "Dir::Etc::sourceparts=-",
+                "update",
+            ],
+            stderr=mock.ANY,
+            stdout=mock.ANY,
+        )
+
+
+class TestVersion(unittest.TestCase):
+
+    def test_ordering(self):
+        ordered = [
+            "1.0~~",
+            "1.0~",
+            "1.0",
+            "1.0-1",
+            "1.0-1ubuntu1",
+            "1.0a",
+            "1.0+",
+            "1.0.0",
+            "9:1",
+            "10:0.1",
+        ]
+        self.assertEqual(
+            ordered,
+            [str(v) for v in apt.sort_versions(reversed(ordered))],
+        )
+
+    def test_equal_versions(self):
+        self.assertEqual(apt.Version("1.0", ""), apt.Version("1.00-0", ""))
+        self.assertEqual(hash(apt.Version("1.0", "")), hash(apt.Version("1.00-0", "")))
+        self.assertNotEqual(apt.Version("1.0", ""), apt.Version("1.0", "1"))
+
+    def test_compared_with_other_types(self):
+        version = apt.Version("1.0", "")
+        self.assertNotEqual(version, "1.0")
+        with self.assertRaises(TypeError):
+            version < "1.0"
+        with self.assertRaises(TypeError):
+            version >= 1
+
+    def test_bulk_helpers(self):
+        self.assertEqual("1:0.1", str(apt.max_version(["2.0", "1:0.1", "1.0"])))
+        self.assertEqual(
+            [1, 0, -1], apt.compare_many("1.0", ["1.0~rc1", "1.0", "1.0.1"])
+        )
+
+    @unittest.skipUnless(shutil.which("dpkg"), "dpkg is not available")
+    def test_matches_dpkg(self):
+        versions = ["0", "0~0", "0-0", "1.0", "1.0~rc1", "1:0", "1.0-0~", "1.0a+"]
+        for first, second in itertools.combinations(versions, 2):
+            expected = subprocess.call(
+                ["dpkg", "--compare-versions", first, "lt", second]
+            )
+            self.assertEqual(
+                expected == 0,
+                apt.compare_many(first, [second])[0] < 0,
+                (first, second),
+            )
+
+
+TEST_KEY = """\
+-----BEGIN PGP PUBLIC KEY BLOCK-----
+Comment: Test Key
+
+mDMEatMohhYJKwYBBAHaRw8BAQdAb1Jb3JnWVYW9kE24iIn76FEdOL3EqoWLJndV
+IcMcdQq0G1Rlc3QgS2V5IDx0ZXN0QGV4YW1wbGUuY29tPoiQBBMWCAA4FiEElonI
+bhpCbEBN6VCAUrHuxt+zBKMFAmrTKIYCGwMFCwkIBwIGFQoJCAsCBBYCAwECHgEC
+F4AACgkQUrHuxt+zBKP3ywD+M708lZsDqisFjRReeQgyDOpG+keeOZG9HxqNEZz6
+xAsBAMGwcAk27YmhGQBRTC6Y53bj3DS+bew2RsyfjofgKe4J
+=w/Nr
+-----END PGP PUBLIC KEY BLOCK-----
+"""
+TEST_KEY_FINGERPRINT = "9689C86E1A426C404DE9508052B1EEC6DFB304A3"
+
+
+class TestOpenPGP(unittest.TestCase):
+    def test_fingerprint(self):
+        key_gpg = apt._dearmor(TEST_KEY)
+
+        self.assertEqual(0x98, key_gpg[0])
+        self.assertEqual(TEST_KEY_FINGERPRINT, apt._get_fingerprint(key_gpg))
+
+    def test_bad_checksum(self):
+        self.assertIsNone(apt._dearmor(TEST_KEY.replace("=w/Nr", "=w/Ns")))
+        self.assertIsNone(apt._dearmor("-----BEGIN PGP PUBLIC KEY BLOCK-----"))
+
+    def test_new_format_packets(self):
+        body = b"\x04" + bytes(300)
+        key_gpg = b"\xc6" + bytes(
+            [((len(body) - 192) >> 8) + 192, (len(body) - 192) & 0xFF]
+        )
+        key_gpg += body + b"\xcd\x01x"
+
+        self.assertEqual([(6, body), (13, b"x")], list(apt._read_packets(key_gpg)))
+        self.assertEqual(
+            hashlib.sha1(b"\x99\x01\x2d" + body).hexdigest().upper(),
+            apt._get_fingerprint(key_gpg),
+        )
+
+    def test_unsupported_keys(self):
+        self.assertIsNone(apt._get_fingerprint(b"\x98\x02\x05\x00"))
+        self.assertIsNone(apt._get_fingerprint(b"\x98\x05\x04"))
+        self.assertIsNone(apt._get_fingerprint(b"\xb4\x01x"))
+
+    @mock.patch.object(apt.DebianRepository, "_write_apt_gpg_keyfile")
+    @mock.patch("subprocess.run")
+    def test_import_key(self, run_mock, write_mock):
+        repo = apt.DebianRepository(True, "deb", "http://ppa", "jammy", ["main"])
+
+        repo.import_key(TEST_KEY)
+
+        run_mock.assert_not_called()
+        write_mock.assert_called_once_with(
+            key_name=f"/etc/apt/trusted.gpg.d/{TEST_KEY_FINGERPRINT}.gpg",
+            key_material=apt._dearmor(TEST_KEY),
+        )
+
+    @mock.patch.object(apt.DebianRepository, "_write_apt_gpg_keyfile")
+    @mock.patch.object(apt.DebianRepository, "_dearmor_gpg_key", return_value=b"key")
+    @mock.patch.object(apt.DebianRepository, "_get_keyid_by_gpg_key", return_value="ID")
+    def test_import_key_gpg_fallback(self, keyid_mock, dearmor_mock, write_mock):
+        """Keys that can't be read natively are handed to gpg"""
+        repo = apt.DebianRepository(True, "deb", "http://ppa", "jammy", ["main"])
+        key = TEST_KEY.replace("=w/Nr", "=AAAA")
+
+        repo.import_key(key)
+
+        keyid_mock.assert_called_once_with(key.strip().encode())
+        write_mock.assert_called_once_with(
+            key_name="/etc/apt/trusted.gpg.d/ID.gpg", key_material=b"key"
+        )
+
+    @mock.patch("subprocess.run")
+    def test_read_armored_key(self, run_mock):
+        """The key is read without being written"""
+        self.assertEqual(
+            (
+                f"/etc/apt/trusted.gpg.d/{TEST_KEY_FINGERPRINT}.gpg",
+                apt._dearmor(TEST_KEY),
+            ),
+            apt.DebianRepository.read_armored_key(TEST_KEY),
+        )
+        run_mock.assert_not_called()
+
+        with self.assertRaises(apt.GPGKeyError):
+            apt.DebianRepository.read_armored_key("not a key")
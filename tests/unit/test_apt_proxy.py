@@ -0,0 +1,122 @@
+# See LICENSE file for licensing details.
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import apt_proxy
+from apt_proxy import (
+    InvalidProxyOption,
+    get_package_uri,
+    is_proxied,
+    probe_cache,
+    render_proxy_conf,
+    write_proxy_conf,
+)
+
+
+class TestRenderProxyConf(unittest.TestCase):
+    def test_proxies(self):
+        self.assertEqual(
+            'Acquire::http::Proxy "http://cache:3142";\n'
+            'Acquire::http::Proxy::mirror.internal "DIRECT";\n'
+            'Acquire::http::Proxy::ppa.internal "DIRECT";\n'
+            'Acquire::https::Proxy "http://squid:3128";\n'
+            'Acquire::https::Proxy::mirror.internal "DIRECT";\n'
+            'Acquire::https::Proxy::ppa.internal "DIRECT";\n',
+            render_proxy_conf(
+                "http://cache:3142",
+                "http://squid:3128",
+                "mirror.internal, ppa.internal,",
+            ),
+        )
+
+    def test_no_proxy(self):
+        self.assertEqual("", render_proxy_conf(None, "", "mirror.internal"))
+
+    def test_invalid(self):
+        """Values that would break out of the APT configuration are rejected"""
+        for args in (
+            ('http://cache:3142";Acquire::http::Proxy "http://evil', None, None),
+            (None, "http://squid:3128;", None),
+            ("http://cache:3142", None, 'mirror.internal" "DIRECT'),
+        ):
+            with self.assertRaises(InvalidProxyOption):
+                render_proxy_conf(*args)
+
+
+class TestWriteProxyConf(unittest.TestCase):
+    def setUp(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.conf = os.path.join(tempdir.name, "99landscapeproxy")
+        mock.patch("apt_proxy.APT_PROXY_CONF", self.conf).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_write_if_changed(self):
+        content = 'Acquire::http::Proxy "http://cache:3142";\n'
+
+        self.assertTrue(write_proxy_conf(content))
+        self.assertFalse(write_proxy_conf(content))
+        with open(self.conf) as conf:
+            self.assertEqual(content, conf.read())
+
+    def test_remove(self):
+        self.assertFalse(write_proxy_conf(""))
+        write_proxy_conf('Acquire::http::Proxy "http://cache:3142";\n')
+
+        self.assertTrue(write_proxy_conf(""))
+        self.assertFalse(os.path.exists(self.conf))
+
+
+class TestCacheProbe(unittest.TestCase):
+    @mock.patch("apt_proxy.subprocess.run")
+    def test_get_package_uri(self, run_mock):
+        run_mock.return_value = subprocess.CompletedProcess(
+            [],
+            0,
+            stdout="'http://archive.ubuntu.com/ubuntu/pool/main/l/landscape-client/"
+            "landscape-client_24.02_amd64.deb' landscape-client_24.02_amd64.deb "
+            "1234 SHA512:abc\n",
+        )
+
+        self.assertEqual(
+            "http://archive.ubuntu.com/ubuntu/pool/main/l/landscape-client/"
+            "landscape-client_24.02_amd64.deb",
+            get_package_uri("landscape-client"),
+        )
+        run_mock.assert_called_once_with(
+            ["apt-get", "--print-uris", "-qq", "download", "landscape-client"],
+            capture_output=True,
+            text=True,
+        )
+
+    @mock.patch("apt_proxy.subprocess.run")
+    def test_get_package_uri_error(self, run_mock):
+        run_mock.return_value = subprocess.CompletedProcess([], 100, stdout="")
+
+        self.assertIsNone(get_package_uri("landscape-client"))
+
+    @mock.patch("urllib.request.build_opener")
+    def test_probe_cache(self, build_opener_mock):
+        response = build_opener_mock.return_value.open.return_value.__enter__()
+        response.headers = {"X-Cache": "HIT from squid", "Via": "1.1 squid"}
+
+        self.assertEqual(
+            "pre-download probe: X-Cache: HIT from squid, Via: 1.1 squid",
+            probe_cache("http://archive/pool/x.deb", "http://squid:3128"),
+        )
+        handler = build_opener_mock.call_args.args[0]
+        self.assertEqual({"http": "http://squid:3128"}, handler.proxies)
+        open_call = build_opener_mock.return_value.open.call_args
+        self.assertEqual("HEAD", open_call.args[0].get_method())
+        self.assertEqual(apt_proxy.PROBE_TIMEOUT, open_call.kwargs["timeout"])
+
+    def test_is_proxied(self):
+        """Only plain HTTP downloads from hosts not in no_proxy can be probed"""
+        self.assertTrue(is_proxied("http://archive/pool/x.deb", "mirror.internal"))
+        self.assertFalse(is_proxied("https://archive/pool/x.deb", None))
+        self.assertFalse(
+            is_proxied("http://mirror.internal/pool/x.deb", "ppa, mirror.internal")
+        )
@@ -3,15 +3,17 @@
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 import base64
 import os
+import subprocess
 import tempfile
 import unittest
 from unittest import mock
 
 from charms.operator_libs_linux.v0 import apt
-from ops.model import ActiveStatus, BlockedStatus
+from ops.model import ActiveStatus, BlockedStatus, UnknownStatus, WaitingStatus
 from ops.testing import Harness
 
 import charm
+import hook_stats
 from charm import (
     CLIENT_CONFIG_CMD,
     ClientCharmError,
@@ -19,6 +21,7 @@ from charm import (
     create_client_config,
     get_additional_client_configuration,
     get_modified_env_vars,
+    process_helper,
 )
 
 
@@ -26,6 +29,7 @@ class TestCharm(unittest.TestCase):
     def setUp(self):
         self.harness = Harness(LandscapeClientCharm)
         self.addCleanup(self.harness.cleanup)
+        self.addCleanup(mock.patch.stopall)
 
         self.process_mock = mock.patch("charm.process_helper").start()
         self.apt_mock = mock.patch("charm.apt.add_package").start()
@@ -34,12 +38,23 @@ class TestCharm(unittest.TestCase):
         ).start()
         self.open_mock = mock.patch("builtins.open").start()
         self.open_mock.side_effect = mock.mock_open(read_data="[client]")
+        self.write_mock = mock.patch(
+            "charm.write_file_if_changed", return_value=True
+        ).start()
+
+    def written(self, filename):
+        """Return the content last written to `filename`."""
+        for call in reversed(self.write_mock.call_args_list):
+            if call.args[0] == filename:
+                return call.args[1]
+        self.fail(f"{filename} not written")
 
     def test_install(self):
         self.harness.begin_with_initial_hooks()
         self.apt_mock.assert_called_once_with("landscape-client")
 
-    def test_install_error(self):
+    @mock.patch("charm.apt.update")
+    def test_install_error(self, update_mock):
         self.apt_mock.side_effect = Exception
         self.from_installed_package_mock.side_effect = apt.PackageNotFoundError
         self.harness.begin_with_initial_hooks()
@@ -48,6 +63,30 @@ class TestCharm(unittest.TestCase):
         self.assertEqual(status.message, "Failed to install client!")
         self.assertIsInstance(status, BlockedStatus)
 
+    @mock.patch("charm.apt.update")
+    @mock.patch("charm.apt.update_source")
+    @mock.patch("charm.ensure_ppa_repository", return_value=True)
+    @mock.patch("charm.find_ppa_source", return_value="/etc/apt/sources.list.d/x.list")
+    def test_install_retried_after_full_refresh(
+        self, find_ppa_source_mock, ensure_ppa_mock, update_source_mock, update_mock
+    ):
+        """
+        A failed install after refreshing only the PPA's indexes is retried after a
+        full refresh, since the client's dependencies may not resolve otherwise
+        """
+        self.harness.update_config({"ppa": "ppa:landscape/ppa", "ppa-key": "key"})
+        self.apt_mock.side_effect = [apt.PackageError("unmet dependencies"), None]
+        self.harness.begin()
+
+        self.harness.charm.on.install.emit()
+
+        update_source_mock.assert_called_once()
+        update_mock.assert_called_once_with()
+        self.assertEqual(
+            [mock.call("landscape-client")] * 2, self.apt_mock.call_args_list
+        )
+        self.assertNotIsInstance(self.harness.charm.unit.status, BlockedStatus)
+
     @mock.patch("charm.merge_client_config")
     @mock.patch("charm.LandscapeClientCharm.is_registered", return_value=False)
     def test_run(self, is_registered_mock, merge_client_config_mock):
@@ -72,6 +111,350 @@ class TestCharm(unittest.TestCase):
             ["systemctl", "restart", "landscape-client"]
         )
 
+    @mock.patch("charm.LandscapeClientCharm.config_applied", return_value=True)
+    @mock.patch("charm.LandscapeClientCharm.is_registered", return_value=True)
+    def test_unchanged_config_skipped(self, is_registered_mock, config_applied_mock):
+        """Unchanged configuration does no work when the on-disk state agrees"""
+        self.harness.begin()
+        self.harness.update_config({"computer-title": "hello1"})
+        self.process_mock.reset_mock()
+        self.from_installed_package_mock.reset_mock()
+        self.open_mock.reset_mock()
+
+        self.harness.charm.on.config_changed.emit()
+
+        self.process_mock.assert_not_called()
+        self.from_installed_package_mock.assert_not_called()
+        self.open_mock.assert_not_called()
+        is_registered_mock.assert_called_once_with()
+
+    @mock.patch("charm.LandscapeClientCharm.config_applied", return_value=False)
+    @mock.patch("charm.LandscapeClientCharm.is_registered", return_value=True)
+    def test_unchanged_config_drifted_on_disk(
+        self, is_registered_mock, config_applied_mock
+    ):
+        """Unchanged configuration is applied again if the on-disk state disagrees"""
+        self.harness.begin()
+        self.harness.update_config({"computer-title": "hello1"})
+        self.process_mock.reset_mock()
+
+        self.harness.charm.on.config_changed.emit()
+
+        self.process_mock.assert_called_once_with(
+            ["systemctl", "restart", "landscape-client"]
+        )
+
+    @mock.patch("charm.LandscapeClientCharm.config_applied", return_value=True)
+    @mock.patch("charm.LandscapeClientCharm.is_registered", return_value=True)
+    def test_changed_config_applied(self, is_registered_mock, config_applied_mock):
+        self.harness.begin()
+        self.harness.update_config({"computer-title": "hello1"})
+        self.process_mock.reset_mock()
+
+        self.harness.update_config({"computer-title": "hello2"})
+
+        self.process_mock.assert_called_once_with(
+            ["systemctl", "restart", "landscape-client"]
+        )
+
+    @mock.patch(
+        "charm.LandscapeClientCharm.apt_conf_override_applied", return_value=True
+    )
+    @mock.patch("charm.os.path.exists", return_value=True)
+    def test_config_applied(self, exists_mock, override_applied_mock):
+        self.open_mock.side_effect = mock.mock_open(
+            read_data="[client]\ncomputer_title = hello1"
+        )
+        self.harness.begin()
+        self.harness.update_config({"disable-unattended-upgrades": True})
+
+        self.assertTrue(
+            self.harness.charm.config_applied({"computer_title": "hello1", "tags": ""})
+        )
+        self.assertFalse(
+            self.harness.charm.config_applied({"computer_title": "hello2"})
+        )
+
+    @mock.patch("charm.LandscapeClientCharm.is_registered", return_value=True)
+    def test_unwritten_config_not_restarted(self, is_registered_mock):
+        """No restart if client.conf already holds the changed configuration"""
+        self.write_mock.return_value = False
+        self.harness.begin()
+        self.harness.update_config({"computer-title": "hello1"})
+        self.process_mock.assert_not_called()
+
+    @mock.patch("charm.LandscapeClientCharm.config_applied", return_value=True)
+    @mock.patch("charm.LandscapeClientCharm.is_registered", return_value=True)
+    def test_certificate_change_restarts(self, is_registered_mock, config_applied_mock):
+        """A new certificate restarts the client, even if client.conf is unchanged"""
+        data_b64 = "base64:" + base64.b64encode(b"hello").decode()
+        self.harness.begin()
+        self.harness.update_config({"ssl-public-key": data_b64})
+        self.process_mock.reset_mock()
+
+        with mock.patch.object(
+            self.harness.charm.facts, "file_digest", return_value="new"
+        ):
+            self.harness.charm.on.config_changed.emit()
+
+        self.process_mock.assert_called_once_with(
+            ["systemctl", "restart", "landscape-client"]
+        )
+
+    @mock.patch(
+        "charm.LandscapeClientCharm.apt_conf_override_applied", return_value=True
+    )
+    @mock.patch("charm.os.path.exists", return_value=True)
+    def test_registration_key_not_stored(self, exists_mock, override_applied_mock):
+        """The cached client.conf only holds a digest of the registration key"""
+        self.open_mock.side_effect = mock.mock_open(
+            read_data="[client]\nregistration_key = secret"
+        )
+        self.harness.begin()
+        self.harness.update_config({"disable-unattended-upgrades": True})
+
+        self.assertTrue(
+            self.harness.charm.config_applied({"registration_key": "secret"})
+        )
+        self.assertFalse(
+            self.harness.charm.config_applied({"registration_key": "other"})
+        )
+        self.assertNotIn("secret", str(self.harness.charm._stored.facts))
+
+    @mock.patch("charm.LandscapeClientCharm.is_registered", return_value=True)
+    def test_file_only_change_not_restarted(self, is_registered_mock):
+        """Changing only the tags rewrites client.conf without a restart"""
+        self.open_mock.side_effect = mock.mock_open(
+            read_data="[client]\ncomputer_title = hello1\nstagger_launch = 0.1"
+        )
+        self.harness.begin()
+        self.harness.update_config({"computer-title": "hello1", "tags": "a,b"})
+        self.process_mock.assert_not_called()
+        self.assertIn("tags = a,b", self.written(charm.CLIENT_CONF_FILE))
+        self.assertEqual(
+            self.harness.charm.unit.status.message, "Client config updated!"
+        )
+
+    @mock.patch("charm.LandscapeClientCharm.is_registered", return_value=True)
+    def test_identity_change_reregisters(self, is_registered_mock):
+        """Changing the account name registers again, even if registered"""
+        self.open_mock.side_effect = mock.mock_open(
+            read_data="[client]\naccount_name = old"
+        )
+        self.harness.begin()
+        self.harness.update_config({"account-name": "new"})
+        self.process_mock.assert_called_once_with([CLIENT_CONFIG_CMD, "--silent"])
+        is_registered_mock.assert_not_called()
+
+    def test_action_plan_config(self):
+        self.open_mock.side_effect = mock.mock_open(
+            read_data="[client]\ncomputer_title = hello1\nstagger_launch = 0.1"
+        )
+        self.harness.begin()
+        self.harness.update_config({"computer-title": "hello1", "log-level": "debug"})
+        self.process_mock.reset_mock()
+
+        output = self.harness.run_action("plan-config")
+
+        self.assertEqual(
+            {"action": "restart", "changes": "log_level: restart"}, output.results
+        )
+        self.process_mock.assert_not_called()
+
+    @mock.patch("charm.get_file_stamp")
+    @mock.patch("charm.apt.PackageSnapshot.take")
+    def test_update_status_client_upgraded(self, take_mock, get_file_stamp_mock):
+        """Out-of-band client upgrades are noticed and the configuration verified"""
+        get_file_stamp_mock.return_value = [1, 1]
+        take_mock.return_value = apt.PackageSnapshot(
+            ["landscape-client"], ["amd64"], ["23.02"], ["install ok installed"]
+        )
+        self.harness.begin()
+        with mock.patch.object(self.harness.charm, "_on_config_changed") as config_mock:
+            self.harness.charm.on.update_status.emit()
+            self.harness.charm.on.update_status.emit()
+            take_mock.assert_called_once()
+            config_mock.assert_not_called()
+
+            get_file_stamp_mock.return_value = [2, 2]
+            take_mock.return_value = apt.PackageSnapshot(
+                ["landscape-client"], ["amd64"], ["24.02"], ["install ok installed"]
+            )
+            self.harness.charm.on.update_status.emit()
+            config_mock.assert_called_once()
+
+    @mock.patch.dict(os.environ, {"JUJU_DISPATCH_PATH": "hooks/config-changed"})
+    def test_hook_stats_action(self):
+        hook_stats._phases.clear()
+        hook_stats._commands.clear()
+        self.harness.begin()
+        self.harness.update_config({"computer-title": "hello1"})
+        self.harness.framework.on.pre_commit.emit()
+
+        output = self.harness.run_action("hook-stats")
+
+        stats = output.results["stats"]
+        self.assertIn("hook:config-changed: count=1", stats)
+        self.assertIn("phase:apply-client-config: count=1", stats)
+
+    @mock.patch("charm.format_profile", return_value="stats")
+    @mock.patch("charm.read_memory_profile", return_value=None)
+    @mock.patch("charm.list_profiles")
+    def test_fetch_profile_action(
+        self, list_profiles_mock, read_memory_profile_mock, format_profile_mock
+    ):
+        self.harness.begin()
+        list_profiles_mock.return_value = ["/profiles/1-update-status.pstats"]
+
+        output = self.harness.run_action(
+            "fetch-profile", {"hook": "update-status", "limit": 5}
+        )
+
+        self.assertEqual(
+            {"profile": "/profiles/1-update-status.pstats", "stats": "stats"},
+            output.results,
+        )
+        list_profiles_mock.assert_called_once_with("update-status")
+        format_profile_mock.assert_called_once_with(
+            "/profiles/1-update-status.pstats", 5
+        )
+
+    @mock.patch("charm.time.time", return_value=1000)
+    @mock.patch("charm.get_registration_due", return_value=1300)
+    @mock.patch("charm.LandscapeClientCharm.is_registered", return_value=False)
+    def test_registration_staggered(self, is_registered_mock, due_mock, time_mock):
+        """Registration waits for the unit's slot and is sent from update-status"""
+        self.harness.begin()
+        self.harness.update_config(
+            {"computer-title": "hello1", "registration-window": 600}
+        )
+
+        due_mock.assert_called_once_with("landscape-client/0", 600)
+        self.assertIsInstance(self.harness.charm.unit.status, WaitingStatus)
+        self.assertNotIn(
+            mock.call([CLIENT_CONFIG_CMD, "--silent"]), self.process_mock.mock_calls
+        )
+
+        with mock.patch.object(self.harness.charm, "check_packages"):
+            self.harness.charm.on.update_status.emit()
+            self.process_mock.assert_not_called()
+
+            time_mock.return_value = 1300
+            self.harness.charm.on.update_status.emit()
+
+        self.process_mock.assert_called_once_with([CLIENT_CONFIG_CMD, "--silent"])
+        self.assertEqual(
+            self.harness.charm.unit.status, ActiveStatus("Client registered!")
+        )
+
+    @mock.patch("charm.time.time", return_value=1000)
+    @mock.patch("charm.get_registration_due", return_value=1300)
+    @mock.patch("charm.LandscapeClientCharm.is_registered", return_value=False)
+    def test_deferred_registration_dropped_if_registered(
+        self, is_registered_mock, due_mock, time_mock
+    ):
+        """A deferred registration is not sent if the client registered meanwhile"""
+        self.harness.begin()
+        self.harness.update_config(
+            {"computer-title": "hello1", "registration-window": 600}
+        )
+
+        is_registered_mock.return_value = True
+        time_mock.return_value = 1300
+        with mock.patch.object(self.harness.charm, "check_packages"):
+            self.harness.charm.on.update_status.emit()
+
+        self.assertNotIn(
+            mock.call([CLIENT_CONFIG_CMD, "--silent"]), self.process_mock.mock_calls
+        )
+        self.assertIsNone(self.harness.charm._stored.registration_due)
+        self.assertEqual(
+            self.harness.charm.unit.status, ActiveStatus("Client registered!")
+        )
+
+    @mock.patch("charm.time.time", return_value=1000)
+    @mock.patch("charm.get_registration_due", return_value=1300)
+    @mock.patch("charm.LandscapeClientCharm.is_registered", return_value=False)
+    def test_registration_window_changed(self, is_registered_mock, due_mock, time_mock):
+        """A pending registration moves to the unit's slot of a new window"""
+        self.harness.begin()
+        self.harness.update_config(
+            {"computer-title": "hello1", "registration-window": 600}
+        )
+        self.assertEqual(1300, self.harness.charm._stored.registration_due)
+
+        due_mock.return_value = 1010
+        self.harness.update_config({"registration-window": 20})
+
+        due_mock.assert_called_with("landscape-client/0", 20)
+        self.assertEqual(1010, self.harness.charm._stored.registration_due)
+
+    @mock.patch("charm.time.time", return_value=1000)
+    @mock.patch("charm.get_retry_delay", return_value=90)
+    @mock.patch("charm.LandscapeClientCharm.is_registered", return_value=False)
+    def test_registration_retried(self, is_registered_mock, delay_mock, time_mock):
+        """A failed registration is retried from update-status after a backoff"""
+        self.harness.begin()
+        self.process_mock.side_effect = lambda args, **kwargs: args != [
+            CLIENT_CONFIG_CMD,
+            "--silent",
+        ]
+        self.harness.update_config({"computer-title": "hello1"})
+
+        delay_mock.assert_called_once_with(1, 3600)
+        self.assertEqual(
+            self.harness.charm.unit.status,
+            WaitingStatus("Registration attempt 1 failed, retrying at 00:18:10 UTC"),
+        )
+        self.assertEqual(1, self.harness.charm._stored.registration_attempts)
+
+        self.process_mock.side_effect = None
+        self.process_mock.return_value = True
+        self.process_mock.reset_mock()
+        with mock.patch.object(self.harness.charm, "check_packages"):
+            self.harness.charm.on.update_status.emit()
+            self.process_mock.assert_not_called()
+
+            time_mock.return_value = 1090
+            self.harness.charm.on.update_status.emit()
+
+        self.process_mock.assert_called_once_with([CLIENT_CONFIG_CMD, "--silent"])
+        self.assertEqual(
+            self.harness.charm.unit.status, ActiveStatus("Client registered!")
+        )
+        self.assertEqual(0, self.harness.charm._stored.registration_attempts)
+        self.assertIsNone(self.harness.charm._stored.registration_due)
+
+    def test_fact_stats_action(self):
+        self.harness.begin()
+        self.harness.charm.installed_client_version()
+        self.harness.charm.installed_client_version()
+
+        output = self.harness.run_action("fact-stats")
+
+        self.assertEqual({"facts": "client-version: hits=1 misses=1"}, output.results)
+        self.from_installed_package_mock.assert_called_once_with("landscape-client")
+
+    @mock.patch("charm.read_registration_state", return_value=True)
+    def test_is_registered_native(self, read_registration_state_mock):
+        """Registration state is read in-process, from the configured data path"""
+        self.open_mock.side_effect = mock.mock_open(
+            read_data="[client]\ndata_path = /data/"
+        )
+        self.harness.begin()
+        self.assertTrue(self.harness.charm.is_registered())
+        read_registration_state_mock.assert_called_once_with("/data/")
+        self.process_mock.assert_not_called()
+
+    @mock.patch("charm.read_registration_state", return_value=None)
+    def test_is_registered_fallback(self, read_registration_state_mock):
+        """`landscape-config` is asked if the state format isn't recognised"""
+        self.harness.begin()
+        self.harness.charm.is_registered()
+        self.process_mock.assert_called_once_with(
+            [CLIENT_CONFIG_CMD, "--is-registered"], hide_errors=True
+        )
+
     def test_ppa_added(self):
         self.harness.begin()
         self.harness.update_config({"ppa": "ppa"})
@@ -81,6 +464,85 @@ class TestCharm(unittest.TestCase):
             env=env_variables,
         )
 
+    @mock.patch("charm.apt.update")
+    @mock.patch("charm.ensure_ppa_repository", return_value=True)
+    def test_ppa_added_with_key(self, ensure_ppa_repository_mock, update_mock):
+        """With a key, the PPA is set up natively without add-apt-repository"""
+        self.harness.begin()
+        self.assertFalse(self.harness.charm.add_ppa())
+
+        self.harness.update_config({"ppa": "ppa:landscape/ppa", "ppa-key": "key"})
+
+        ensure_ppa_repository_mock.assert_called_once_with("ppa:landscape/ppa", "key")
+        update_mock.assert_called_once_with()
+        for call in self.process_mock.call_args_list:
+            self.assertNotIn("add-apt-repository", call.args[0])
+
+    @mock.patch("charm.apt.update")
+    @mock.patch("charm.apt.update_source")
+    @mock.patch("charm.ensure_ppa_repository", return_value=True)
+    @mock.patch("charm.find_ppa_source", return_value="/etc/apt/sources.list.d/x.list")
+    def test_ppa_replaced_full_refresh(
+        self, find_ppa_source_mock, ensure_ppa_mock, update_source_mock, update_mock
+    ):
+        """Replacing a PPA refreshes all indexes, to clean up the old PPA's lists"""
+        self.harness.begin()
+        self.harness.update_config({"ppa": "ppa:landscape/a", "ppa-key": "key"})
+        update_source_mock.assert_called_once_with(
+            "/etc/apt/sources.list.d/x.list", max_age=None, lean=True
+        )
+        update_mock.assert_not_called()
+        update_source_mock.reset_mock()
+
+        self.harness.update_config({"ppa": "ppa:landscape/b"})
+
+        update_mock.assert_called_once_with()
+        update_source_mock.assert_not_called()
+
+    @mock.patch("charm.apt.update")
+    @mock.patch("charm.apt.update_source")
+    @mock.patch("charm.find_ppa_source", return_value="/etc/apt/sources.list.d/x.list")
+    def test_action_upgrade_refreshes_ppa_only(
+        self, find_ppa_source_mock, update_source_mock, update_mock
+    ):
+        """With a PPA, the upgrade action only refreshes the PPA's indexes"""
+        self.harness.update_config({"ppa": "ppa:landscape/ppa"})
+        self.harness.begin()
+        self.harness.charm.unit.status = ActiveStatus("Active")
+        with mock.patch.object(self.harness.charm, "add_ppa", return_value=False):
+            self.harness.charm._upgrade(mock.Mock(params={}))
+
+        update_source_mock.assert_called_once_with(
+            "/etc/apt/sources.list.d/x.list", max_age=None, lean=True
+        )
+        update_mock.assert_not_called()
+
+        update_source_mock.reset_mock()
+        with mock.patch.object(self.harness.charm, "add_ppa", return_value=False):
+            self.harness.charm._upgrade(mock.Mock(params={"max-age": 600}))
+
+        update_source_mock.assert_called_once_with(
+            "/etc/apt/sources.list.d/x.list", max_age=600, lean=True
+        )
+        update_mock.assert_not_called()
+
+    @mock.patch("charm.find_ppa_source", return_value="/etc/apt/sources.list.d/x.list")
+    def test_ppa_not_added_again(self, find_ppa_source_mock):
+        """The same PPA is not set up again while its source is on disk"""
+        self.harness.begin()
+        self.harness.update_config({"ppa": "ppa:landscape/ppa"})
+        self.process_mock.reset_mock()
+
+        self.assertFalse(self.harness.charm.add_ppa())
+
+        self.process_mock.assert_not_called()
+        find_ppa_source_mock.return_value = None
+        self.harness.charm.facts.invalidate("ppa-source:ppa:landscape/ppa")
+        self.assertTrue(self.harness.charm.add_ppa())
+        self.process_mock.assert_called_once_with(
+            ["add-apt-repository", "-y", "ppa:landscape/ppa"], env=mock.ANY
+        )
+
     def test_ppa_error(self):
         self.harness.begin()
         self.process_mock.return_value = False
@@ -149,7 +611,7 @@ class TestCharm(unittest.TestCase):
         data_b64 = "base64:" + base64.b64encode(data).decode()
         self.harness.update_config({"ssl-public-key": data_b64})
 
-        self.open_mock().write.assert_called_once_with(data)
+        self.assertEqual(data, self.written(charm.CERT_FILE))
 
     def test_ssl_cert_invalid_file(self):
         self.harness.begin()
@@ -167,17 +629,204 @@ class TestCharm(unittest.TestCase):
             [CLIENT_CONFIG_CMD, "--silent", "--disable"]
         )
 
-    def test_action_upgrade(self):
+    @mock.patch("charm.apt.update")
+    @mock.patch("charm.apt.DebianPackage.from_apt_cache")
+    def test_action_upgrade(self, from_apt_cache_mock, update_mock):
         self.harness.begin()
         self.harness.charm.unit.status = ActiveStatus("Active")
-        event = mock.Mock()
-        with mock.patch("charm.apt") as apt_mock:
-            pkg_mock = mock.Mock()
-            apt_mock.DebianPackage.from_apt_cache.return_value = pkg_mock
+        self.from_installed_package_mock.return_value.version = apt.Version(
+            "23.02-0ubuntu1", ""
+        )
+        pkg_mock = from_apt_cache_mock.return_value
+        pkg_mock.version = apt.Version("24.02-0ubuntu1", "")
+
+        def ensure(state):
+            self.from_installed_package_mock.return_value.version = pkg_mock.version
+
+        pkg_mock.ensure.side_effect = ensure
+        event = mock.Mock(params={})
+        self.harness.charm._upgrade(event)
+
+        from_apt_cache_mock.assert_called_once_with("landscape-client")
+        pkg_mock.ensure.assert_called_once_with(state=apt.PackageState.Latest)
+        results = event.set_results.call_args.args[0]
+        self.assertEqual("23.02-0ubuntu1", results["previous-version"])
+        self.assertEqual("24.02-0ubuntu1", results["candidate-version"])
+        self.assertEqual("24.02-0ubuntu1", results["installed-version"])
+        self.assertTrue(results["upgraded"])
+        self.assertIn("duration", results)
+
+    @mock.patch("charm.apt.update")
+    @mock.patch("charm.apt.DebianPackage.from_apt_cache")
+    def test_action_upgrade_current(self, from_apt_cache_mock, update_mock):
+        """Nothing is installed when the client is already at the candidate version"""
+        self.harness.begin()
+        self.harness.charm.unit.status = ActiveStatus("Active")
+        self.from_installed_package_mock.return_value.version = apt.Version(
+            "24.02-0ubuntu1", "1"
+        )
+        from_apt_cache_mock.return_value.version = apt.Version("24.02-0ubuntu1", "1")
+        event = mock.Mock(params={})
+        self.harness.charm._upgrade(event)
+
+        from_apt_cache_mock.return_value.ensure.assert_not_called()
+        results = event.set_results.call_args.args[0]
+        self.assertEqual("1:24.02-0ubuntu1", results["previous-version"])
+        self.assertEqual("1:24.02-0ubuntu1", results["installed-version"])
+        self.assertFalse(results["upgraded"])
+        self.assertIsInstance(self.harness.charm.unit.status, ActiveStatus)
+
+    @mock.patch("charm.probe_cache", return_value="X-Cache: HIT from squid")
+    @mock.patch("charm.get_package_uri", return_value="http://archive/pool/x.deb")
+    @mock.patch("charm.apt.update")
+    @mock.patch("charm.apt.DebianPackage.from_apt_cache")
+    def test_action_upgrade_cache_status(
+        self, from_apt_cache_mock, update_mock, get_package_uri_mock, probe_cache_mock
+    ):
+        """The upgrade action reports whether the APT proxy had the package cached"""
+        self.harness.update_config({"apt-http-proxy": "http://squid:3128"})
+        self.harness.begin()
+        self.harness.charm.unit.status = ActiveStatus("Active")
+        self.from_installed_package_mock.side_effect = apt.PackageNotFoundError
+        from_apt_cache_mock.return_value.version = apt.Version("24.02", "")
+
+        output = self.harness.run_action("upgrade")
+
+        probe_cache_mock.assert_called_once_with(
+            "http://archive/pool/x.deb", "http://squid:3128"
+        )
+        self.assertEqual("X-Cache: HIT from squid", output.results["cache-status"])
+
+    @mock.patch("charm.probe_cache")
+    @mock.patch("charm.get_package_uri")
+    def test_probe_package_cache_skipped(self, get_package_uri_mock, probe_cache_mock):
+        """Downloads tunnelled through the proxy, or not through it, aren't probed"""
+        self.harness.update_config(
+            {
+                "apt-http-proxy": "http://squid:3128",
+                "apt-https-proxy": "http://squid:3128",
+                "apt-no-proxy": "mirror.internal",
+            }
+        )
+        self.harness.begin()
+
+        for uri in ("https://archive/pool/x.deb", "http://mirror.internal/x.deb"):
+            get_package_uri_mock.return_value = uri
+            self.assertIsNone(self.harness.charm.probe_package_cache())
+        probe_cache_mock.assert_not_called()
+
+    @mock.patch("charm.write_proxy_conf", return_value=True)
+    def test_apt_proxy_invalid(self, write_proxy_conf_mock):
+        """Proxy options that would break out of the APT configuration block"""
+        self.harness.begin()
+        self.harness.update_config({"apt-http-proxy": 'http://cache:3142";'})
+
+        write_proxy_conf_mock.assert_not_called()
+        self.assertIsInstance(self.harness.charm.unit.status, BlockedStatus)
+        self.assertIn(
+            "Invalid APT proxy option", self.harness.charm.unit.status.message
+        )
+
+    @mock.patch("charm.write_proxy_conf", return_value=True)
+    def test_apt_proxy(self, write_proxy_conf_mock):
+        """The APT proxy drop-in follows the apt-*-proxy options"""
+        self.harness.begin()
+        self.harness.update_config(
+            {"apt-http-proxy": "http://cache:3142", "apt-no-proxy": "mirror.internal"}
+        )
+
+        write_proxy_conf_mock.assert_called_with(
+            'Acquire::http::Proxy "http://cache:3142";\n'
+            'Acquire::http::Proxy::mirror.internal "DIRECT";\n'
+        )
+
+    @mock.patch("charm.LandscapeClientCharm.upgrade_client", return_value={})
+    def test_action_upgrade_rolling(self, upgrade_client_mock):
+        """Units queue their upgrade until the leader grants them a rolling token"""
+        rel_id = self.harness.add_relation("rolling", "landscape-client")
+        self.harness.add_relation_unit(rel_id, "landscape-client/1")
+        self.harness.update_config({"rolling-max-concurrent": 1})
+        self.harness.update_relation_data(
+            rel_id, "landscape-client/1", {"rolling-requested": "1.0"}
+        )
+        self.harness.update_relation_data(
+            rel_id, "landscape-client", {"rolling-granted": '["landscape-client/1"]'}
+        )
+        self.harness.begin()
+        self.harness.charm.unit.status = ActiveStatus("Active")
+
+        output = self.harness.run_action("upgrade", {"max-age": 600})
+
+        self.assertEqual({"queued": True}, output.results)
+        upgrade_client_mock.assert_not_called()
+        self.assertEqual(
+            self.harness.charm.unit.status,
+            WaitingStatus("Queued for upgrade, 0 units ahead"),
+        )
+        unit_data = self.harness.get_relation_data(rel_id, "landscape-client/0")
+        self.assertIn("rolling-requested", unit_data)
+
+        self.harness.update_relation_data(
+            rel_id, "landscape-client", {"rolling-granted": '["landscape-client/0"]'}
+        )
+
+        upgrade_client_mock.assert_called_once_with(600)
+        self.assertNotIn("rolling-requested", unit_data)
+
+    def test_rolling_disabled_leaves_app_alone(self):
+        """Without rolling-max-concurrent, the leader writes no tokens or status"""
+        self.harness.set_leader(True)
+        rel_id = self.harness.add_relation("rolling", "landscape-client")
+        self.harness.add_relation_unit(rel_id, "landscape-client/1")
+        self.harness.begin()
+        self.harness.update_config({"computer-title": "hello1"})
+        self.harness.update_relation_data(rel_id, "landscape-client/1", {"x": "y"})
+
+        app_data = self.harness.get_relation_data(rel_id, "landscape-client")
+        self.assertNotIn("rolling-granted", app_data)
+        self.assertIsInstance(self.harness.model.app.status, UnknownStatus)
+
+    @mock.patch("charm.LandscapeClientCharm.upgrade_client", return_value={})
+    def test_rolling_leader_grants_tokens(self, upgrade_client_mock):
+        """The leader grants tokens as they are released, including to itself"""
+        self.harness.set_leader(True)
+        rel_id = self.harness.add_relation("rolling", "landscape-client")
+        self.harness.add_relation_unit(rel_id, "landscape-client/1")
+        self.harness.update_config({"rolling-max-concurrent": 1})
+        self.harness.begin()
+        self.harness.charm.unit.status = ActiveStatus("Active")
+        self.harness.update_relation_data(
+            rel_id, "landscape-client/1", {"rolling-requested": "1.0"}
+        )
+        app_data = self.harness.get_relation_data(rel_id, "landscape-client")
+        self.assertEqual('["landscape-client/1"]', app_data["rolling-granted"])
+
+        output = self.harness.run_action("upgrade")
+        self.assertEqual({"queued": True}, output.results)
+        upgrade_client_mock.assert_not_called()
+
+        self.harness.update_relation_data(
+            rel_id, "landscape-client/1", {"rolling-requested": ""}
+        )
+
+        upgrade_client_mock.assert_called_once_with(None)
+        self.assertEqual("[]", app_data["rolling-granted"])
+        self.assertEqual(ActiveStatus(), self.harness.model.app.status)
+
+    @mock.patch("charm.apt.update")
+    def test_action_upgrade_update(self, update_mock):
+        """Indexes are only refreshed when the PPA setup did not already do it"""
+        self.harness.begin()
+        self.harness.charm.unit.status = ActiveStatus("Active")
+        event = mock.Mock(params={"max-age": 600})
+        with mock.patch.object(self.harness.charm, "add_ppa", return_value=False):
             self.harness.charm._upgrade(event)
+        update_mock.assert_called_once_with(max_age=600)
 
-        self.assertEqual(apt_mock.DebianPackage.from_apt_cache.call_count, 1)
-        self.assertEqual(pkg_mock.ensure.call_count, 1)
+        update_mock.reset_mock()
+        with mock.patch.object(self.harness.charm, "add_ppa", return_value=True):
+            self.harness.charm._upgrade(event)
+        update_mock.assert_not_called()
 
     def test_action_register(self):
         self.harness.begin()
@@ -198,7 +847,9 @@ class TestCharm(unittest.TestCase):
         self.harness.charm.run_landscape_client = mock.Mock()
         self.harness.update_config({"disable-unattended-upgrades": True})
 
-        self.open_mock.assert_called_once_with(charm.APT_CONF_OVERRIDE, "w")
+        self.write_mock.assert_called_once_with(
+            charm.APT_CONF_OVERRIDE, charm.APT_CONF_OVERRIDE_CONTENT
+        )
 
         self.harness.update_config({"disable-unattended-upgrades": False})
 
@@ -213,7 +864,7 @@ class TestCharm(unittest.TestCase):
         )
         self.harness.begin()
         self.harness.update_config({"ping-url": "url"})
-        text = "".join([call.args[0] for call in self.open_mock().write.mock_calls])
+        text = self.written(charm.CLIENT_CONF_FILE)
         self.assertIn("account_name = onward", text)
         self.assertIn("ping_url = url", text)
 
@@ -364,3 +1015,45 @@ class TestGetAddtionalClientConfiguration(unittest.TestCase):
         }
         expected = {"somevalue": "somekey"}
         self.assertEqual(expected, get_additional_client_configuration(juju_config))
+
+
+class TestProcessHelper(unittest.TestCase):
+    @mock.patch("charm.log_info")
+    @mock.patch("charm.log_error")
+    def test_large_output(self, log_error_mock, log_info_mock):
+        """Only the head and tail of a large output are logged"""
+        script = "head -c 100000 /dev/zero | tr '\\0' x; echo Failure"
+
+        self.assertFalse(process_helper(["sh", "-c", script]))
+
+        logged = log_error_mock.call_args.args[0]
+        self.assertLess(len(logged), 10000)
+        self.assertIn("bytes dropped", logged)
+        self.assertTrue(logged.endswith("Failure\n"))
+
+    @mock.patch("charm.log_info")
+    @mock.patch("charm.log_error")
+    @mock.patch("charm.open_output_log", side_effect=PermissionError())
+    def test_output_log_error(
+        self, open_output_log_mock, log_error_mock, log_info_mock
+    ):
+        """The command is still read and reaped if its output log can't be opened"""
+        processes = []
+        popen = subprocess.Popen
+
+        def spawn(*args, **kwargs):
+            processes.append(popen(*args, **kwargs))
+            return processes[-1]
+
+        with mock.patch("subprocess.Popen", side_effect=spawn):
+            self.assertTrue(process_helper(["echo", "hello"]))
+
+        log_error_mock.assert_called_once()
+        log_info_mock.assert_called_with("hello\n")
+        self.assertTrue(processes[0].stdout.closed)
+        self.assertEqual(0, processes[0].returncode)
+
+    @mock.patch("charm.log_info")
+    def test_success(self, log_info_mock):
+        self.assertTrue(process_helper(["echo", "hello"]))
+        log_info_mock.assert_called_with("hello\n")
@@ -0,0 +1,76 @@
+# See LICENSE file for licensing details.
+import os
+import pickle
+import tempfile
+import unittest
+
+from client_state import (
+    BROKER_PERSIST_FILENAME,
+    UnknownStateFormat,
+    load_persist,
+    read_registration_state,
+)
+
+REGISTERED_BPICKLE = b"du12:registrationdu9:secure-idu6:abc123;;"
+
+
+class TestLoadPersist(unittest.TestCase):
+
+    def test_bpickle(self):
+        data = b"du1:ali1;f1.5;b0nu1:xs3:abct;;u1:bb1;"
+        self.assertEqual(
+            {"a": [1, 1.5, False, None, "x", b"abc", ()], "b": True},
+            load_persist(data),
+        )
+
+    def test_pickle(self):
+        data = pickle.dumps({"registration": {"secure-id": b"abc"}}, protocol=2)
+        self.assertEqual({"registration": {"secure-id": b"abc"}}, load_persist(data))
+
+    def test_pickle_with_class_rejected(self):
+        data = pickle.dumps({"when": unittest.TestCase}, protocol=2)
+        with self.assertRaises(UnknownStateFormat):
+            load_persist(data)
+
+    def test_unknown_format(self):
+        for data in (b"", b"garbage", b"du12:registrat"):
+            with self.assertRaises(UnknownStateFormat):
+                load_persist(data)
+
+
+class TestReadRegistrationState(unittest.TestCase):
+
+    def setUp(self):
+        self.data_path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.data_path, BROKER_PERSIST_FILENAME)
+
+    def write_persist(self, data, mtime):
+        with open(self.filename, "wb") as persist_file:
+            persist_file.write(data)
+        os.utime(self.filename, (mtime, mtime))
+
+    def test_missing_state_not_registered(self):
+        self.assertFalse(read_registration_state(self.data_path))
+
+    def test_registered(self):
+        self.write_persist(REGISTERED_BPICKLE, 1000)
+        self.assertTrue(read_registration_state(self.data_path))
+
+    def test_no_secure_id(self):
+        self.write_persist(b"du12:registrationd;;", 1000)
+        self.assertFalse(read_registration_state(self.data_path))
+
+    def test_unknown_format(self):
+        self.write_persist(b"not a persist file", 1000)
+        self.assertIsNone(read_registration_state(self.data_path))
+
+    def test_cache_invalidated_by_mtime(self):
+        self.write_persist(REGISTERED_BPICKLE, 1000)
+        self.assertTrue(read_registration_state(self.data_path))
+
+        # Same size and mtime: the cached state is reused.
+        self.write_persist(REGISTERED_BPICKLE.replace(b"abc123", b"\x00" * 6), 1000)
+        self.assertTrue(read_registration_state(self.data_path))
+
+        self.write_persist(b"du12:registrationd;;", 2000)
+        self.assertFalse(read_registration_state(self.data_path))
@@ -0,0 +1,107 @@
+# See LICENSE file for licensing details.
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import command_output
+from command_output import OutputCapture, open_output_log, set_debug_output
+
+
+class TestOutputCapture(unittest.TestCase):
+    def test_small_output(self):
+        output = OutputCapture(head_bytes=8, tail_bytes=8)
+        output.feed(b"hello ")
+        output.feed(b"world")
+
+        self.assertEqual("hello world", output.text())
+        self.assertEqual(11, output.total)
+        self.assertEqual(0, output.dropped)
+
+    def test_head_and_tail(self):
+        output = OutputCapture(head_bytes=4, tail_bytes=4)
+        for chunk in (b"abc", b"defgh", b"ijklmnop", b"qr"):
+            output.feed(chunk)
+
+        self.assertEqual(10, output.dropped)
+        self.assertEqual("abcd\n[... 10 of 18 bytes dropped ...]\nopqr", output.text())
+
+    def test_marker_across_chunks(self):
+        output = OutputCapture(marker=b"Failure", head_bytes=2, tail_bytes=2)
+        for chunk in (b"x" * 100, b"Fa", b"i", b"lure", b"y" * 100):
+            output.feed(chunk)
+
+        self.assertTrue(output.found)
+
+    def test_no_marker(self):
+        output = OutputCapture(marker=b"Failure")
+        for chunk in (b"Fail", b"ed", b"lure"):
+            output.feed(chunk)
+
+        self.assertFalse(output.found)
+
+    def test_mirror(self):
+        mirror = mock.Mock()
+        output = OutputCapture(head_bytes=1, tail_bytes=1, mirror=mirror)
+        output.feed(b"abc")
+
+        mirror.write.assert_called_once_with(b"abc")
+
+
+class TestOutputLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.addCleanup(mock.patch.stopall)
+        mock.patch.object(command_output, "LOG_DIR", self.tmp_dir).start()
+        mock.patch.object(
+            command_output,
+            "DEBUG_MARKER",
+            os.path.join(self.tmp_dir, "state", "debug-output"),
+        ).start()
+        mock.patch.object(
+            command_output, "STATE_DIR", os.path.join(self.tmp_dir, "state")
+        ).start()
+        mock.patch.dict(os.environ, {"JUJU_UNIT_NAME": "landscape-client/0"}).start()
+        self.log = os.path.join(self.tmp_dir, "commands-landscape-client-0.log")
+
+    def test_disabled(self):
+        with open_output_log(["true"]) as log:
+            self.assertIsNone(log)
+
+    def test_enabled(self):
+        set_debug_output(True)
+        with open_output_log(["echo", "hi"]) as log:
+            log.write(b"hi\n")
+
+        with open(self.log) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines[0].startswith("=== "))
+        self.assertTrue(lines[0].endswith(" echo hi"))
+        self.assertEqual("hi", lines[1])
+
+        set_debug_output(False)
+        with open_output_log(["true"]) as log:
+            self.assertIsNone(log)
+
+    def test_enabled_unchanged(self):
+        """The marker isn't rewritten when debug output stays on"""
+        set_debug_output(True)
+        inode = os.stat(command_output.DEBUG_MARKER).st_ino
+
+        set_debug_output(True)
+
+        self.assertEqual(inode, os.stat(command_output.DEBUG_MARKER).st_ino)
+
+    @mock.patch.object(command_output, "LOG_MAX_BYTES", 10)
+    def test_rotated(self):
+        set_debug_output(True)
+        with open(self.log, "w") as f:
+            f.write("x" * 11)
+
+        with open_output_log(["true"]):
+            pass
+
+        with open(self.log + ".1") as f:
+            self.assertEqual("x" * 11, f.read())
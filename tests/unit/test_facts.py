@@ -0,0 +1,59 @@
+# See LICENSE file for licensing details.
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from facts import FactCache
+
+
+class TestFactCache(unittest.TestCase):
+    def setUp(self):
+        self.store = {}
+        self.stats = {}
+        self.facts = FactCache(self.store, self.stats)
+        self.compute = mock.Mock(return_value="value")
+
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.filename = os.path.join(tmp_dir.name, "source")
+        with open(self.filename, "w") as source_file:
+            source_file.write("one")
+
+    def test_reused_within_dispatch(self):
+        self.assertEqual("value", self.facts.get("fact", self.compute))
+        self.assertEqual("value", self.facts.get("fact", self.compute))
+
+        self.compute.assert_called_once_with()
+        self.assertEqual({}, self.store)
+        self.assertEqual({"fact": {"hits": 1, "misses": 1}}, self.facts.stats())
+
+    def test_reused_across_dispatches_until_source_changes(self):
+        self.facts.get("fact", self.compute, source=self.filename)
+
+        facts = FactCache(self.store, self.stats)
+        facts.get("fact", self.compute, source=self.filename)
+        self.compute.assert_called_once_with()
+
+        with open(self.filename, "w") as source_file:
+            source_file.write("three")
+        FactCache(self.store, self.stats).get(
+            "fact", self.compute, source=self.filename
+        )
+        self.assertEqual(2, self.compute.call_count)
+
+    def test_invalidate(self):
+        self.facts.get("fact", self.compute, source=self.filename)
+        self.facts.invalidate("fact")
+        self.facts.get("fact", self.compute, source=self.filename)
+
+        self.assertEqual(2, self.compute.call_count)
+
+    def test_file_digest(self):
+        digest = self.facts.file_digest(self.filename)
+        self.assertEqual(digest, self.facts.file_digest(self.filename))
+
+        with open(self.filename, "w") as source_file:
+            source_file.write("three")
+        self.assertNotEqual(digest, self.facts.file_digest(self.filename))
+        self.assertIsNone(self.facts.file_digest(self.filename + ".missing"))
@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from files import write_file_if_changed
+
+
+class TestWriteFileIfChanged(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, "99override")
+
+    def test_write_if_changed(self):
+        self.assertTrue(write_file_if_changed(self.path, "a\n", mode=0o600))
+        self.assertEqual(0o600, os.stat(self.path).st_mode & 0o7777)
+        inode = os.stat(self.path).st_ino
+
+        self.assertFalse(write_file_if_changed(self.path, b"a\n"))
+        self.assertEqual(inode, os.stat(self.path).st_ino)
+
+        self.assertTrue(write_file_if_changed(self.path, "b\n"))
+        with open(self.path) as f:
+            self.assertEqual("b\n", f.read())
+        self.assertEqual(["99override"], os.listdir(self.tmp_dir))
+
+    def test_mode_preserved(self):
+        with open(self.path, "w") as f:
+            f.write("a\n")
+        os.chmod(self.path, 0o640)
+
+        write_file_if_changed(self.path, "b\n", mode=0o644)
+
+        self.assertEqual(0o640, os.stat(self.path).st_mode & 0o7777)
+
+    def test_failed_write_leaves_file(self):
+        with open(self.path, "w") as f:
+            f.write("a\n")
+
+        with mock.patch("os.fsync", side_effect=OSError):
+            with self.assertRaises(OSError):
+                write_file_if_changed(self.path, "b\n")
+
+        with open(self.path) as f:
+            self.assertEqual("a\n", f.read())
+        self.assertEqual(["99override"], os.listdir(self.tmp_dir))
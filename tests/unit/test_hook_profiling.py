@@ -0,0 +1,77 @@
+# See LICENSE file for licensing details.
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import hook_profiling
+from hook_profiling import (
+    format_profile,
+    get_profile_mode,
+    list_profiles,
+    read_memory_profile,
+    run_profiled,
+    set_profile_mode,
+)
+
+
+def busy():
+    return sorted(str(i) for i in range(1000))
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.profile_dir = os.path.join(tmp_dir.name, "profiles")
+        mock.patch.object(hook_profiling, "PROFILE_DIR", new=self.profile_dir).start()
+        mock.patch.dict(os.environ).start()
+        os.environ.pop(hook_profiling.PROFILE_ENV, None)
+        self.addCleanup(mock.patch.stopall)
+
+    def test_not_profiled_by_default(self):
+        dispatch = mock.Mock()
+        run_profiled(dispatch, "update-status")
+
+        dispatch.assert_called_once_with()
+        self.assertEqual([], list_profiles())
+
+    def test_profile_mode(self):
+        set_profile_mode("memory")
+        self.assertEqual("memory", get_profile_mode())
+
+        os.environ[hook_profiling.PROFILE_ENV] = "cpu"
+        self.assertEqual("cpu", get_profile_mode())
+
+        del os.environ[hook_profiling.PROFILE_ENV]
+        set_profile_mode("")
+        self.assertIsNone(get_profile_mode())
+
+    def test_profile_mode_unchanged(self):
+        """The marker isn't rewritten when the mode doesn't change"""
+        set_profile_mode("cpu")
+        marker = os.path.join(self.profile_dir, hook_profiling.PROFILE_MARKER)
+        inode = os.stat(marker).st_ino
+
+        set_profile_mode("cpu")
+
+        self.assertEqual(inode, os.stat(marker).st_ino)
+
+    def test_profiled(self):
+        set_profile_mode("memory")
+        run_profiled(busy, "config-changed")
+        run_profiled(busy, "update-status")
+
+        profiles = list_profiles("config-changed")
+        self.assertEqual(1, len(profiles))
+        self.assertIn("busy", format_profile(profiles[0], 10))
+        self.assertIsNotNone(read_memory_profile(profiles[0]))
+
+    @mock.patch.object(hook_profiling, "PROFILE_RETENTION", new=2)
+    def test_retention(self):
+        os.environ[hook_profiling.PROFILE_ENV] = "cpu"
+        for _ in range(4):
+            run_profiled(busy, "update-status")
+
+        self.assertEqual(2, len(list_profiles()))
+        self.assertEqual(2, len(os.listdir(self.profile_dir)))
@@ -0,0 +1,50 @@
+# See LICENSE file for licensing details.
+import unittest
+from unittest import mock
+
+import hook_stats
+from hook_stats import HookStats, observe_command, phase
+
+
+class TestHookStats(unittest.TestCase):
+    def setUp(self):
+        self.store = {}
+        self.stats = HookStats(self.store)
+        self.addCleanup(hook_stats._phases.clear)
+        self.addCleanup(hook_stats._commands.clear)
+
+    def test_histogram(self):
+        for milliseconds in (0.5, 3, 3, 5, 100):
+            self.stats.record("phase:x", milliseconds / 1000)
+
+        self.assertEqual(
+            {"phase:x": "count=5 p50=4ms p95=100ms max=100ms spawns=0"},
+            self.stats.summary(),
+        )
+        self.assertEqual(hook_stats.BUCKETS, len(self.store["phase:x"]["buckets"]))
+
+    def test_long_durations_bounded(self):
+        self.stats.record("hook:x", 10**6)
+        self.assertEqual(1, self.store["hook:x"]["buckets"][-1])
+
+    @mock.patch("hook_stats.time")
+    def test_save(self, time_mock):
+        time_mock.monotonic.side_effect = [10.0, 10.5, 11.0, 12.0]
+
+        @phase("slow")
+        def slow():
+            observe_command(["/usr/bin/systemctl", "restart"], 0.2)
+
+        with mock.patch.object(hook_stats, "STARTED", new=9.0):
+            slow()
+            self.stats.save("config-changed")
+
+        summary = self.stats.summary()
+        self.assertEqual(
+            ["command:systemctl", "hook:config-changed", "phase:slow"], list(summary)
+        )
+        self.assertIn("max=500ms", summary["phase:slow"])
+        self.assertIn("max=2000ms spawns=1", summary["hook:config-changed"])
+
+        self.stats.save("config-changed")
+        self.assertIn("count=1", self.stats.summary()["phase:slow"])
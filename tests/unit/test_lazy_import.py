@@ -0,0 +1,57 @@
+# See LICENSE file for licensing details.
+import sys
+import types
+import unittest
+
+from lazy_import import lazy_import
+
+
+class TestLazyImport(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(sys.modules.pop, "colorsys", None)
+        sys.modules.pop("colorsys", None)
+
+    def test_loaded_on_first_use(self):
+        module = lazy_import("colorsys")
+        self.assertIs(sys.modules["colorsys"], module)
+        self.assertIsNot(types.ModuleType, type(module))
+
+        self.assertEqual((0.0, 0.0, 1.0), module.rgb_to_hsv(1, 1, 1))
+        self.assertIs(types.ModuleType, type(module))
+
+    def test_on_load(self):
+        loaded = []
+        module = lazy_import(
+            "colorsys", on_load=lambda module: loaded.append(module.ONE_THIRD)
+        )
+        self.assertEqual([], loaded)
+
+        module.rgb_to_hsv(1, 1, 1)
+        self.assertEqual([1.0 / 3.0], loaded)
+
+        lazy_import("colorsys", on_load=lambda module: loaded.append(module.ONE_SIXTH))
+        self.assertEqual([1.0 / 3.0, 1.0 / 6.0], loaded)
+
+    def test_on_load_already_lazily_imported(self):
+        """on_load waits for the load of a module another caller imported lazily"""
+        loaded = []
+        module = lazy_import("colorsys")
+
+        self.assertIs(
+            module,
+            lazy_import(
+                "colorsys", on_load=lambda module: loaded.append(module.ONE_THIRD)
+            ),
+        )
+        self.assertEqual([], loaded)
+        self.assertIsNot(types.ModuleType, type(module))
+
+        module.rgb_to_hsv(1, 1, 1)
+        self.assertEqual([1.0 / 3.0], loaded)
+
+    def test_already_imported(self):
+        self.assertIs(sys.modules["unittest"], lazy_import("unittest"))
+
+    def test_missing_module(self):
+        with self.assertRaises(ModuleNotFoundError):
+            lazy_import("no_such_module")
@@ -0,0 +1,41 @@
+# See LICENSE file for licensing details.
+import unittest
+
+from planner import ChangeAction, plan_config_change
+
+
+class TestPlanConfigChange(unittest.TestCase):
+
+    def test_unchanged(self):
+        """Identical configuration needs no action"""
+        previous = {"url": "https://landscape/message-system", "ping_interval": "30"}
+        new = {"url": "https://landscape/message-system", "ping_interval": 30}
+        plan = plan_config_change(previous, new)
+        self.assertIs(ChangeAction.NOOP, plan.action)
+        self.assertEqual({}, plan.changes)
+
+    def test_empty_values_ignored(self):
+        """Empty values are not written to client.conf, so they are not changes"""
+        plan = plan_config_change({}, {"tags": "", "log_level": None})
+        self.assertIs(ChangeAction.NOOP, plan.action)
+
+    def test_file_only(self):
+        plan = plan_config_change({"tags": "a"}, {"tags": "a,b"})
+        self.assertIs(ChangeAction.FILE_ONLY, plan.action)
+        self.assertEqual({"tags": ("a", "a,b")}, plan.changes)
+
+    def test_cheapest_sufficient_action(self):
+        """The most disruptive action needed by any changed key is chosen"""
+        plan = plan_config_change(
+            {"tags": "a", "url": "https://old"},
+            {"tags": "b", "log_level": "debug", "url": "https://new"},
+        )
+        self.assertIs(ChangeAction.REREGISTER, plan.action)
+        self.assertEqual(
+            "log_level: restart\ntags: file-only\nurl: re-register", plan.describe()
+        )
+
+    def test_unknown_key_restarts(self):
+        """Keys from additional-client-configuration restart the client"""
+        plan = plan_config_change({}, {"somekey": "someval"})
+        self.assertIs(ChangeAction.RESTART, plan.action)
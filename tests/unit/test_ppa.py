@@ -0,0 +1,147 @@
+# See LICENSE file for licensing details.
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from ppa import (
+    ensure_ppa_repository,
+    find_ppa_source,
+    get_ppa_repo_line,
+    get_release_codename,
+)
+
+
+class TestPPA(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        mock.patch("ppa.SOURCES_DIR", new=self.tmpdir).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def write_source(self, name, content):
+        filename = os.path.join(self.tmpdir, name)
+        with open(filename, "w") as source_file:
+            source_file.write(content)
+        return filename
+
+    def test_get_release_codename(self):
+        os_release = self.write_source(
+            "os-release", 'NAME="Ubuntu"\nVERSION_CODENAME=noble\n'
+        )
+        with mock.patch("ppa.OS_RELEASE_FILE", new=os_release):
+            self.assertEqual("noble", get_release_codename())
+
+    def test_get_ppa_repo_line(self):
+        self.assertEqual(
+            "deb https://ppa.launchpadcontent.net/landscape/self-hosted-beta/ubuntu "
+            "jammy main",
+            get_ppa_repo_line("ppa:landscape/self-hosted-beta", "jammy"),
+        )
+        line = "deb http://mirror/landscape jammy main"
+        self.assertEqual(line, get_ppa_repo_line(line, "jammy"))
+
+    def test_find_ppa_source(self):
+        self.write_source(
+            "other.list", "deb http://archive.ubuntu.com/ubuntu jammy main\n"
+        )
+        self.write_source(
+            "commented.list",
+            "# deb http://ppa.launchpad.net/landscape/self-hosted-beta/ubuntu jammy main\n",
+        )
+        self.assertIsNone(find_ppa_source("ppa:landscape/self-hosted-beta"))
+
+        filename = self.write_source(
+            "landscape-ubuntu-self-hosted-beta-noble.sources",
+            "Types: deb\n"
+            "URIs: https://ppa.launchpadcontent.net/landscape/self-hosted-beta/ubuntu/\n",
+        )
+        self.assertEqual(filename, find_ppa_source("ppa:landscape/self-hosted-beta"))
+        self.assertIsNone(find_ppa_source("not a ppa"))
+
+    def test_find_ppa_source_exact(self):
+        """A PPA whose name extends the wanted one's is not a match"""
+        self.write_source(
+            "latest-stable.list",
+            "deb [signed-by=/etc/apt/keyrings/ls.gpg] "
+            "https://ppa.launchpadcontent.net/landscape/latest-stable/ubuntu jammy main\n",
+        )
+        self.assertIsNone(find_ppa_source("ppa:landscape/latest"))
+        self.assertIsNone(
+            find_ppa_source(
+                "deb https://ppa.launchpadcontent.net/landscape/latest/ubuntu jammy main"
+            )
+        )
+
+        filename = self.write_source(
+            "latest.list",
+            "deb [ arch=amd64 ] http://ppa.launchpad.net/landscape/latest/ubuntu jammy main\n",
+        )
+        self.assertEqual(filename, find_ppa_source("ppa:landscape/latest"))
+
+    def mock_key(self):
+        key_file = os.path.join(self.tmpdir, "landscape.gpg")
+        read_key = mock.patch(
+            "ppa.apt.DebianRepository.read_armored_key",
+            return_value=(key_file, b"key material"),
+        ).start()
+        return read_key, key_file
+
+    @mock.patch("ppa.get_release_codename", return_value="jammy")
+    def test_ensure_ppa_repository(self, codename_mock):
+        """The source and key are written when missing, and the stale source removed"""
+        stale = self.write_source(
+            "landscape-ubuntu-ppa-jammy.sources",
+            "Types: deb\nURIs: https://ppa.launchpadcontent.net/landscape/ppa/ubuntu/\n",
+        )
+        read_key, key_file = self.mock_key()
+
+        self.assertTrue(ensure_ppa_repository("ppa:landscape/ppa", "key"))
+
+        read_key.assert_called_once_with("key")
+        with open(key_file, "rb") as f:
+            self.assertEqual(b"key material", f.read())
+        with open(os.path.join(self.tmpdir, "landscape-ppa-ubuntu-jammy.list")) as f:
+            self.assertEqual(
+                f"deb [signed-by={key_file}] "
+                "https://ppa.launchpadcontent.net/landscape/ppa/ubuntu jammy main\n",
+                f.read(),
+            )
+        self.assertFalse(os.path.exists(stale))
+
+    @mock.patch("ppa.get_release_codename", return_value="jammy")
+    def test_ensure_ppa_repository_unchanged(self, codename_mock):
+        """Nothing is rewritten when the source on disk already matches"""
+        read_key, key_file = self.mock_key()
+        self.assertTrue(ensure_ppa_repository("ppa:landscape/ppa", "key"))
+        inodes = {
+            name: os.stat(os.path.join(self.tmpdir, name)).st_ino
+            for name in os.listdir(self.tmpdir)
+        }
+
+        self.assertFalse(ensure_ppa_repository("ppa:landscape/ppa", "key"))
+
+        self.assertEqual(
+            inodes,
+            {
+                name: os.stat(os.path.join(self.tmpdir, name)).st_ino
+                for name in os.listdir(self.tmpdir)
+            },
+        )
+
+    @mock.patch("ppa.get_release_codename", return_value="jammy")
+    def test_ensure_ppa_repository_existing_list(self, codename_mock):
+        """An existing `.list` source for the PPA is rewritten in place"""
+        existing = self.write_source(
+            "landscape.list",
+            "deb https://ppa.launchpadcontent.net/landscape/ppa/ubuntu jammy main\n",
+        )
+        read_key, key_file = self.mock_key()
+
+        self.assertTrue(ensure_ppa_repository("ppa:landscape/ppa", "key"))
+
+        with open(existing) as f:
+            self.assertIn(f"[signed-by={key_file}]", f.read())
+        self.assertFalse(
+            os.path.exists(os.path.join(self.tmpdir, "landscape-ppa-ubuntu-jammy.list"))
+        )
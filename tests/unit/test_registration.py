@@ -0,0 +1,45 @@
+# See LICENSE file for licensing details.
+import unittest
+from unittest import mock
+
+from registration import get_registration_due, get_registration_slot, get_retry_delay
+
+
+class TestRegistrationSlot(unittest.TestCase):
+    def test_deterministic(self):
+        self.assertEqual(
+            get_registration_slot("landscape-client/3", 600),
+            get_registration_slot("landscape-client/3", 600),
+        )
+
+    def test_spread_over_window(self):
+        slots = [
+            get_registration_slot(f"landscape-client/{i}", 600) for i in range(1000)
+        ]
+
+        self.assertTrue(all(0 <= slot < 600 for slot in slots))
+        # Each tenth of the window gets roughly a tenth of the units.
+        for tenth in range(10):
+            count = sum(1 for slot in slots if tenth * 60 <= slot < (tenth + 1) * 60)
+            self.assertLess(abs(count - 100), 40)
+
+    def test_no_window(self):
+        self.assertEqual(0, get_registration_slot("landscape-client/3", 0))
+        self.assertEqual(1000, get_registration_due("landscape-client/3", 0, 1000))
+
+
+class TestRetryDelay(unittest.TestCase):
+    @mock.patch("registration.random.uniform", side_effect=lambda low, high: high)
+    def test_backoff(self, uniform_mock):
+        self.assertEqual(
+            [60, 120, 240, 480, 960, 1920, 3600, 3600],
+            [get_retry_delay(attempt, 3600) for attempt in range(1, 9)],
+        )
+        self.assertEqual(3600, get_retry_delay(10000, 3600))
+
+    def test_full_jitter(self):
+        delays = [get_retry_delay(4, 3600) for _ in range(1000)]
+
+        self.assertTrue(all(0 <= delay <= 480 for delay in delays))
+        self.assertLess(min(delays), 48)
+        self.assertGreater(max(delays), 432)
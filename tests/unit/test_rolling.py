@@ -0,0 +1,39 @@
+# See LICENSE file for licensing details.
+import unittest
+
+from rolling import grant_tokens, queue_position
+
+
+class TestGrantTokens(unittest.TestCase):
+    def test_oldest_first(self):
+        requests = {"client/0": 30.0, "client/1": 10.0, "client/2": 20.0}
+
+        self.assertEqual(["client/1", "client/2"], grant_tokens(requests, [], 2))
+
+    def test_holders_keep_tokens(self):
+        requests = {"client/0": 30.0, "client/1": 10.0, "client/2": 20.0}
+
+        self.assertEqual(["client/0"], grant_tokens(requests, ["client/0"], 1))
+        self.assertEqual(
+            ["client/0", "client/1"], grant_tokens(requests, ["client/0"], 2)
+        )
+
+    def test_released_tokens_are_granted(self):
+        requests = {"client/1": 10.0, "client/2": 20.0}
+
+        self.assertEqual(["client/1"], grant_tokens(requests, ["client/0"], 1))
+        self.assertEqual([], grant_tokens({}, ["client/0", "client/1"], 1))
+
+    def test_ties_by_name(self):
+        requests = {"client/3": 10.0, "client/2": 10.0}
+
+        self.assertEqual(["client/2"], grant_tokens(requests, [], 1))
+
+
+class TestQueuePosition(unittest.TestCase):
+    def test_position(self):
+        requests = {"client/0": 30.0, "client/1": 10.0, "client/2": 20.0}
+
+        self.assertEqual(0, queue_position(requests, ["client/1"], "client/2"))
+        self.assertEqual(1, queue_position(requests, ["client/1"], "client/0"))
+        self.assertEqual(2, queue_position(requests, [], "client/0"))
@@ -0,0 +1,115 @@
+# See LICENSE file for licensing details.
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import tracing
+
+
+def get_spans(trace):
+    return trace["resourceSpans"][0]["scopeSpans"][0]["spans"]
+
+
+def get_attributes(span):
+    return {a["key"]: list(a["value"].values())[0] for a in span["attributes"]}
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+        mock.patch.object(tracing, "STATE_DIR", new=self.tmp_dir).start()
+        mock.patch.object(
+            tracing, "ENDPOINT_FILE", new=os.path.join(self.tmp_dir, "endpoint")
+        ).start()
+        mock.patch.object(
+            tracing, "FALLBACK_FILE", new=os.path.join(self.tmp_dir, "traces.jsonl")
+        ).start()
+        self.addCleanup(mock.patch.stopall)
+        tracing._spans.clear()
+
+    def test_spans(self):
+        with tracing.span("add-ppa") as attributes:
+            attributes["ppa"] = "ppa:landscape/ppa"
+            tracing.record_span("exec apt-get", 0.5, **{"process.exit_code": 0})
+        with self.assertRaises(ValueError):
+            with tracing.span("register"):
+                raise ValueError()
+
+        root, child, parent, failed = get_spans(tracing.finish("config-changed"))
+
+        self.assertEqual("config-changed", root["name"])
+        self.assertNotIn("parentSpanId", root)
+        self.assertEqual(root["spanId"], parent["parentSpanId"])
+        self.assertEqual(parent["spanId"], child["parentSpanId"])
+        self.assertEqual({"ppa": "ppa:landscape/ppa"}, get_attributes(parent))
+        self.assertEqual({"process.exit_code": "0"}, get_attributes(child))
+        self.assertEqual(
+            500_000_000,
+            int(child["endTimeUnixNano"]) - int(child["startTimeUnixNano"]),
+        )
+        self.assertEqual(tracing.STATUS_ERROR, failed["status"]["code"])
+        self.assertEqual([], tracing._spans)
+
+    @mock.patch("tracing.subprocess.Popen")
+    def test_export(self, popen_mock):
+        tracing.export("update-status")
+        popen_mock.assert_not_called()
+
+        tracing.set_endpoint("http://collector:4318/v1/traces")
+        tracing.export("update-status")
+
+        args = popen_mock.call_args.args[0]
+        self.assertEqual("http://collector:4318/v1/traces", args[2])
+        with open(args[3]) as trace_file:
+            self.assertEqual(
+                "update-status", get_spans(json.load(trace_file))[0]["name"]
+            )
+        self.assertTrue(popen_mock.call_args.kwargs["start_new_session"])
+
+    def test_set_endpoint_unchanged(self):
+        """The endpoint file isn't rewritten when the endpoint doesn't change"""
+        tracing.set_endpoint("http://collector:4318/v1/traces")
+        inode = os.stat(tracing.ENDPOINT_FILE).st_ino
+
+        tracing.set_endpoint("http://collector:4318/v1/traces")
+
+        self.assertEqual(inode, os.stat(tracing.ENDPOINT_FILE).st_ino)
+
+        tracing.set_endpoint("")
+        self.assertFalse(os.path.exists(tracing.ENDPOINT_FILE))
+
+    @mock.patch("tracing.export")
+    def test_trace_dispatch(self, export_mock):
+        with tracing.trace_dispatch("install", **{"juju.hook": "install"}):
+            pass
+        export_mock.assert_called_once_with(
+            "install", False, **{"juju.hook": "install"}
+        )
+
+        export_mock.reset_mock()
+        with self.assertRaises(ValueError):
+            with tracing.trace_dispatch("install"):
+                raise ValueError()
+        export_mock.assert_called_once_with(
+            "install", True, **{"exception.type": "ValueError"}
+        )
+
+    def test_failed_dispatch_status(self):
+        root = get_spans(tracing.finish("install", error=True))[0]
+        self.assertEqual(tracing.STATUS_ERROR, root["status"]["code"])
+
+    @mock.patch("urllib.request.urlopen", side_effect=OSError())
+    def test_send_trace_fallback(self, urlopen_mock):
+        path = os.path.join(self.tmp_dir, "trace.json")
+        with open(path, "w") as trace_file:
+            json.dump(tracing.finish("install"), trace_file)
+
+        tracing.send_trace("http://collector:4318/v1/traces", path)
+
+        self.assertFalse(os.path.exists(path))
+        with open(tracing.FALLBACK_FILE) as fallback:
+            self.assertEqual("install", json.loads(fallback.readline())["name"])